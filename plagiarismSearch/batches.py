@@ -0,0 +1,151 @@
+"""
+Batch submissions for /check/batch.
+
+A batch is a list of texts, URLs or ZIP members submitted to /reports/create
+with bounded concurrency. Batches and their per-item report ids are stored in
+SQLite so their progress can be summarized later.
+"""
+from tempfile import SpooledTemporaryFile
+from typing import Optional
+import hashlib
+import json
+import os
+import time
+import uuid
+import zipfile
+
+from fastapi import HTTPException
+
+import datastore
+import uploads
+
+CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "200"))
+STATUS_CONCURRENCY = int(os.getenv("BATCH_STATUS_CONCURRENCY", "8"))
+
+# Document types PlagiarismSearch accepts inside an uploaded ZIP.
+ZIP_EXTENSIONS = (".txt", ".pdf", ".doc", ".docx", ".odt", ".rtf", ".html", ".htm", ".tex")
+
+
+class BatchStore:
+    def __init__(self, db_name: str = "batches.sqlite3"):
+        self._db = datastore.connect(db_name)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS batches ("
+            " batch_id TEXT PRIMARY KEY, created REAL NOT NULL, options TEXT NOT NULL, size INTEGER NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS batch_items ("
+            " batch_id TEXT NOT NULL, position INTEGER NOT NULL, title TEXT, source TEXT NOT NULL,"
+            " report_id INTEGER, error TEXT, dedup TEXT, PRIMARY KEY (batch_id, position))"
+        )
+
+    def create(self, options: dict, size: int) -> str:
+        batch_id = uuid.uuid4().hex
+        self._db.execute(
+            "INSERT INTO batches (batch_id, created, options, size) VALUES (?, ?, ?, ?)",
+            (batch_id, time.time(), json.dumps(options), size),
+        )
+        return batch_id
+
+    def record(self, batch_id: str, position: int, title: Optional[str], source: str,
+               report_id: Optional[int] = None, error: Optional[str] = None, dedup: Optional[str] = None):
+        self._db.execute(
+            "INSERT OR REPLACE INTO batch_items (batch_id, position, title, source, report_id, error, dedup)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (batch_id, position, title, source, report_id, error, dedup),
+        )
+
+    def get(self, batch_id: str) -> Optional[dict]:
+        row = self._db.execute(
+            "SELECT created, options, size FROM batches WHERE batch_id = ?", (batch_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        items = self._db.execute(
+            "SELECT position, title, source, report_id, error, dedup FROM batch_items"
+            " WHERE batch_id = ? ORDER BY position", (batch_id,)
+        ).fetchall()
+        return {
+            "batch_id": batch_id,
+            "created": row[0],
+            "options": json.loads(row[1]),
+            "size": row[2],
+            "items": [
+                {"index": i[0], "title": i[1], "source": i[2], "report_id": i[3], "error": i[4], "dedup": i[5]}
+                for i in items
+            ],
+        }
+
+
+def json_items(body) -> tuple:
+    """
+    Validate a JSON batch body and return (items, raw_options).
+
+    The body is either a list of strings / {"text"|"url", "title"} objects or
+    {"items": [...], "options": {...}} with /check option names.
+    """
+    options = {}
+    if isinstance(body, dict):
+        options = body.get("options")
+        body = body.get("items")
+        if options is None:
+            options = {}
+        elif not isinstance(options, dict):
+            raise HTTPException(status_code=400, detail="Batch options must be an object.")
+        if not isinstance(options.get("callback_url") or "", str):
+            raise HTTPException(status_code=400, detail="callback_url must be a string.")
+    if not isinstance(body, list) or not body:
+        raise HTTPException(status_code=400, detail="Batch must be a non-empty list of texts or URLs.")
+    items = []
+    for position, entry in enumerate(body):
+        if isinstance(entry, str):
+            entry = {"url": entry} if entry.startswith(("http://", "https://")) else {"text": entry}
+        if not isinstance(entry, dict) or not (entry.get("text") or entry.get("url")):
+            raise HTTPException(status_code=400, detail=f"Item {position} needs a text or url.")
+        for name in ("text", "url", "title"):
+            if entry.get(name) is not None and not isinstance(entry[name], str):
+                raise HTTPException(status_code=400, detail=f"Item {position}: {name} must be a string.")
+        items.append({"text": entry.get("text"), "url": entry.get("url"), "title": entry.get("title")})
+    return items, options
+
+
+def zip_members(archive: zipfile.ZipFile) -> list:
+    """Document entries of an uploaded ZIP, skipping folders and OS metadata files."""
+    members = []
+    total = 0
+    for info in archive.infolist():
+        name = os.path.basename(info.filename)
+        if info.is_dir() or not name or name.startswith(".") or info.filename.startswith("__MACOSX/"):
+            continue
+        if not name.lower().endswith(ZIP_EXTENSIONS):
+            continue
+        if info.file_size > uploads.MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"{info.filename} exceeds the maximum upload size.")
+        total += info.file_size
+        members.append(info)
+    if total > uploads.MAX_UPLOAD_BYTES * 4:
+        raise HTTPException(status_code=413, detail="ZIP expands beyond the allowed batch size.")
+    return members
+
+
+def extract_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo):
+    """
+    Copy one ZIP member to a spooled temp file; returns (file, sha256 hex).
+
+    Blocking (it decompresses the member): call it through asyncio.to_thread.
+    """
+    spooled = SpooledTemporaryFile(max_size=uploads.UPLOAD_MEMORY_BYTES)
+    sha = hashlib.sha256()
+    with archive.open(info) as member:
+        while True:
+            chunk = member.read(uploads.CHUNK_SIZE)
+            if not chunk:
+                break
+            sha.update(chunk)
+            spooled.write(chunk)
+    spooled.seek(0)
+    return spooled, sha.hexdigest()
+
+
+store = BatchStore()
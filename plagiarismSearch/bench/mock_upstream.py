@@ -0,0 +1,154 @@
+"""
+Local stand-in for the PlagiarismSearch v3 API, for load tests.
+
+Reports move from "processing" to "checked" over MOCK_REPORT_SECONDS. Every
+call can be slowed down (MOCK_LATENCY_MS +- MOCK_JITTER_MS) and fail at random
+with 5xx (MOCK_ERROR_RATE) or 429 (MOCK_429_RATE). Run it with:
+
+    uvicorn mock_upstream:app --app-dir bench --port 8799
+
+and start the proxy with PLAGIARISMSEARCH_API_BASE_URL=http://127.0.0.1:8799/api/v3.
+"""
+import asyncio
+import itertools
+import os
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+LATENCY_MS = float(os.getenv("MOCK_LATENCY_MS", "50"))
+JITTER_MS = float(os.getenv("MOCK_JITTER_MS", "20"))
+ERROR_RATE = float(os.getenv("MOCK_ERROR_RATE", "0"))
+RATE_429 = float(os.getenv("MOCK_429_RATE", "0"))
+RETRY_AFTER = os.getenv("MOCK_RETRY_AFTER", "1")
+REPORT_SECONDS = float(os.getenv("MOCK_REPORT_SECONDS", "10"))
+SOURCES = int(os.getenv("MOCK_SOURCES", "200"))
+HTML_KB = int(os.getenv("MOCK_HTML_KB", "256"))
+
+app = FastAPI(title="PlagiarismSearch mock")
+
+_ids = itertools.count(1)
+_reports: dict = {}
+calls = {"total": 0, "errors": 0, "throttled": 0}
+
+
+def _report(report_id: int) -> dict:
+    """Known reports, or an already finished one for ids the mock never issued."""
+    return _reports.setdefault(report_id, {"created": time.time() - REPORT_SECONDS, "title": f"Report {report_id}"})
+
+
+def _state(report_id: int) -> dict:
+    report = _report(report_id)
+    progress = min((time.time() - report["created"]) / REPORT_SECONDS, 1.0) if REPORT_SECONDS else 1.0
+    status = 2 if progress >= 1.0 else (1 if progress > 0 else 0)
+    return {"id": report_id, "title": report["title"], "status": status, "progress": round(progress, 4),
+            "plagiarism": round(random.Random(report_id).uniform(0, 60), 2) if status == 2 else None}
+
+
+def _sources(report_id: int) -> list:
+    rng = random.Random(report_id)
+    return [{"id": k, "url": f"https://example.com/source/{report_id}/{k}", "plagiarism": round(rng.uniform(0, 30), 2),
+             "words": rng.randint(5, 500), "title": f"Source {k} for report {report_id}"} for k in range(SOURCES)]
+
+
+def _ok(data, code: int = 200) -> dict:
+    return {"status": True, "code": code, "data": data}
+
+
+@app.middleware("http")
+async def chaos(request: Request, call_next):
+    if request.url.path.startswith("/_mock"):
+        return await call_next(request)
+    calls["total"] += 1
+    delay = max(LATENCY_MS + random.uniform(-JITTER_MS, JITTER_MS), 0) / 1000
+    if delay:
+        await asyncio.sleep(delay)
+    roll = random.random()
+    if roll < RATE_429:
+        calls["throttled"] += 1
+        return JSONResponse({"status": False, "code": 429, "message": "Too many requests"}, status_code=429,
+                            headers={"Retry-After": RETRY_AFTER})
+    if roll < RATE_429 + ERROR_RATE:
+        calls["errors"] += 1
+        return JSONResponse({"status": False, "code": 503, "message": "Service unavailable"}, status_code=503)
+    return await call_next(request)
+
+
+async def _create(request: Request) -> dict:
+    report_id = next(_ids)
+    if request.headers.get("content-type", "").startswith("application/json"):
+        title = (await request.json()).get("title")
+    else:
+        title = (await request.form()).get("title")
+    _reports[report_id] = {"created": time.time(), "title": title or f"Report {report_id}"}
+    return _ok(_state(report_id), code=202)
+
+
+@app.post("/api/v3/reports/create")
+@app.post("/api/v3/ai-reports/create")
+async def create_report(request: Request):
+    return await _create(request)
+
+
+@app.post("/api/v3/storage/create")
+async def create_storage(request: Request):
+    return _ok({"id": next(_ids)})
+
+
+@app.get("/api/v3/reports/status/{report_id}")
+@app.get("/api/v3/ai-reports/status/{report_id}")
+async def report_status(report_id: int):
+    return _ok(_state(report_id))
+
+
+@app.get("/api/v3/reports/sources/{report_id}")
+async def report_sources(report_id: int):
+    return _ok({"id": report_id, "sources": _sources(report_id)})
+
+
+@app.get("/api/v3/reports/html/{report_id}")
+@app.get("/api/v3/ai-reports/html/{report_id}")
+async def report_html(report_id: int):
+    paragraph = f"<p class='rb-r'>Sentence matched in report {report_id}. </p>"
+    html = paragraph * max(HTML_KB * 1024 // len(paragraph), 1)
+    return _ok({**_state(report_id), "html": f"<div class='report-section'>{html}</div>"})
+
+
+@app.get("/api/v3/reports/{report_id}")
+@app.get("/api/v3/ai-reports/{report_id}")
+async def report(report_id: int, show_relations: int = 0):
+    data = _state(report_id)
+    if data["status"] == 2:
+        data["sources"] = _sources(report_id)
+    return _ok(data)
+
+
+@app.api_route("/api/v3/reports", methods=["GET", "POST"])
+@app.api_route("/api/v3/ai-reports", methods=["GET", "POST"])
+async def list_reports(request: Request):
+    params = dict(request.query_params)
+    if request.method == "POST" and request.headers.get("content-type", "").startswith("application/json"):
+        params.update(await request.json())
+    page, limit = int(params.get("page", 1)), int(params.get("limit", 10))
+    ids = sorted(_reports)[(page - 1) * limit:page * limit]
+    return {"status": True, "code": 200, "data": [_state(i) for i in ids],
+            "pagination": {"page": page, "limit": limit, "count": len(_reports)}}
+
+
+@app.put("/api/v3/reports/update/{report_id}")
+async def update_report(report_id: int, request: Request):
+    _report(report_id).update({k: v for k, v in (await request.json()).items() if k == "title"})
+    return _ok(_state(report_id))
+
+
+@app.delete("/api/v3/reports/delete/{report_id}")
+async def delete_report(report_id: int):
+    _reports.pop(report_id, None)
+    return _ok({"id": report_id})
+
+
+@app.get("/_mock/stats")
+async def mock_stats():
+    return {**calls, "reports": len(_reports)}
@@ -0,0 +1,358 @@
+"""
+Load-test harness for the proxy.
+
+Starts bench/mock_upstream.py and server.py (pointed at the mock through
+PLAGIARISMSEARCH_API_BASE_URL) as subprocesses with a throwaway data
+directory, runs the selected scenarios and prints throughput and
+p50/p95/p99 latency per scenario. Startup is measured too: the time to import
+server.py in a fresh interpreter (median of --startup-runs) and the time until
+the spawned proxy answers. Results are written to bench/results/;
+--save-baseline stores them as the baseline and --compare fails (exit 1)
+when a scenario or the startup got slower or less successful than the
+baseline allows.
+
+    python bench/run.py
+    python bench/run.py --scenarios submit_burst,status_poll_storm --requests 500 --concurrency 50
+    python bench/run.py --mock-env MOCK_429_RATE=0.05 --proxy-env UPSTREAM_RATE_LIMIT=none --compare
+    python bench/run.py --scenarios "" --startup-runs 10 --compare
+
+Settings from the current environment are passed on to both processes, so
+proxy options (UPSTREAM_*, REPORT_CACHE_*, ...) can be set as usual.
+"""
+from typing import Awaitable, Callable, Optional
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROXY_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+SCENARIOS: dict = {}
+
+
+def scenario(fn):
+    SCENARIOS[fn.__name__] = fn
+    return fn
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values: list, q: float) -> Optional[float]:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(int(round(q / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: list = []
+        self.statuses: dict = {}
+        self.bytes = 0
+
+    async def call(self, fn: Callable[[], Awaitable[httpx.Response]]) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await fn()
+        except httpx.HTTPError as e:
+            key = e.__class__.__name__
+            response = None
+        else:
+            key = str(response.status_code)
+            self.bytes += len(response.content)
+        self.latencies.append(time.perf_counter() - started)
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+        return response
+
+    def summary(self, elapsed: float) -> dict:
+        latencies = sorted(self.latencies)
+        ok = sum(n for status, n in self.statuses.items() if status.isdigit() and int(status) < 400)
+
+        def ms(value):
+            return round(value * 1000, 2) if value is not None else None
+
+        return {
+            "requests": len(latencies),
+            "ok": ok,
+            "success_ratio": round(ok / len(latencies), 4) if latencies else None,
+            "statuses": dict(sorted(self.statuses.items())),
+            "seconds": round(elapsed, 3),
+            "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+            "bytes": self.bytes,
+            "latency_ms": {
+                "p50": ms(percentile(latencies, 50)),
+                "p95": ms(percentile(latencies, 95)),
+                "p99": ms(percentile(latencies, 99)),
+                "max": ms(latencies[-1] if latencies else None),
+            },
+        }
+
+
+async def fan_out(count: int, concurrency: int, task: Callable[[int], Awaitable]):
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with slots:
+            await task(i)
+
+    await asyncio.gather(*(one(i) for i in range(count)))
+
+
+async def create_reports(client: httpx.AsyncClient, count: int) -> list:
+    ids = []
+    for i in range(count):
+        response = await client.post("/check", data={"text": f"Seed document {i} {time.time_ns()} " * 20})
+        if response.status_code == 200:
+            ids.append(response.json()["data"]["id"])
+    return ids
+
+
+@scenario
+async def submit_burst(client: httpx.AsyncClient, args, recorder: Recorder):
+    """POST /check with distinct texts (a share of exact repeats with --duplicates)."""
+    run = time.time_ns()
+
+    async def task(i):
+        n = i % max(int(args.requests * (1 - args.duplicates)), 1)
+        text = f"Benchmark submission {run} number {n}. " * 40
+        await recorder.call(lambda: client.post("/check", data={"text": text, "title": f"bench-{n}"}))
+
+    await fan_out(args.requests, args.concurrency, task)
+
+
+@scenario
+async def status_poll_storm(client: httpx.AsyncClient, args, recorder: Recorder):
+    """Many clients polling /status for a handful of reports that are still processing."""
+    ids = await create_reports(client, args.reports)
+    if not ids:
+        raise RuntimeError("status_poll_storm could not create any reports")
+
+    async def task(i):
+        report_id = ids[i % len(ids)]
+        await recorder.call(lambda: client.get(f"/status/{report_id}"))
+
+    await fan_out(args.requests, args.concurrency, task)
+
+
+@scenario
+async def large_report_fetch(client: httpx.AsyncClient, args, recorder: Recorder):
+    """GET /report and /reports/sources for finished reports with many sources."""
+    base = 10_000_000 + time.time_ns() % 1_000_000
+
+    async def task(i):
+        report_id = base + i % args.reports
+        path = f"/report/{report_id}?show_relations=1" if i % 2 else f"/reports/sources/{report_id}"
+        await recorder.call(lambda: client.get(path))
+
+    await fan_out(args.requests, args.concurrency, task)
+
+
+@scenario
+async def pdf_download(client: httpx.AsyncClient, args, recorder: Recorder):
+    """GET /report/pdf for a few finished reports; the first download of each renders it."""
+    base = 20_000_000 + time.time_ns() % 1_000_000
+    count = max(args.requests // 10, 1)
+
+    async def task(i):
+        report_id = base + i % args.reports
+        await recorder.call(lambda: client.get(f"/report/pdf/{report_id}"))
+
+    await fan_out(count, min(args.concurrency, 8), task)
+
+
+IMPORT_PROBE = "import time; started = time.perf_counter(); import server; print(time.perf_counter() - started)"
+
+
+def import_seconds(env: dict, runs: int) -> dict:
+    """Time `import server` in `runs` fresh interpreters."""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=PROXY_DIR, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    samples.sort()
+    return {"median": round(percentile(samples, 50), 4), "min": round(samples[0], 4),
+            "max": round(samples[-1], 4), "runs": runs}
+
+
+def start(cmd: list, env: dict, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "wb")
+    return subprocess.Popen(cmd, cwd=PROXY_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {process.returncode}")
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.05)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def parse_env(pairs: list) -> dict:
+    env = {}
+    for pair in pairs or []:
+        name, _, value = pair.partition("=")
+        env[name] = value
+    return env
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Scenarios whose p95/p99 grew, or whose throughput or success ratio dropped,
+    and startup times that grew, beyond tolerance.
+    """
+    regressions = []
+    startup, before = results.get("startup") or {}, baseline.get("startup") or {}
+    for key in ("import_seconds", "ready_seconds"):
+        old, new = before.get(key), startup.get(key)
+        if isinstance(old, dict):
+            old, new = old["median"], (new or {}).get("median")
+        if old and new and new > old * (1 + tolerance):
+            regressions.append(f"startup: {key} {old} s -> {new} s")
+    for name, current in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        for key in ("p95", "p99"):
+            old, new = before["latency_ms"][key], current["latency_ms"][key]
+            if old and new and new > old * (1 + tolerance):
+                regressions.append(f"{name}: {key} {old} ms -> {new} ms")
+        old, new = before["throughput_rps"], current["throughput_rps"]
+        if old and new and new < old * (1 - tolerance):
+            regressions.append(f"{name}: throughput {old} -> {new} req/s")
+        old, new = before["success_ratio"], current["success_ratio"]
+        if old is not None and new is not None and new < old - 0.01:
+            regressions.append(f"{name}: success ratio {old} -> {new}")
+    return regressions
+
+
+async def run(args) -> dict:
+    mock_port, proxy_port = free_port(), free_port()
+    data_dir = tempfile.mkdtemp(prefix="proxy-bench-")
+    mock_env = {**os.environ, **parse_env(args.mock_env)}
+    proxy_env = {
+        **os.environ,
+        "PLAGIARISMSEARCH_API_KEY": os.getenv("PLAGIARISMSEARCH_API_KEY", "bench:key"),
+        "PLAGIARISMSEARCH_API_BASE_URL": f"http://127.0.0.1:{mock_port}/api/v3",
+        "PROXY_DATA_DIR": data_dir,
+        **parse_env(args.proxy_env),
+    }
+    uvicorn = [sys.executable, "-m", "uvicorn", "--log-level", "warning"]
+    mock = start(uvicorn + ["mock_upstream:app", "--app-dir", BENCH_DIR, "--port", str(mock_port)],
+                 mock_env, os.path.join(data_dir, "mock.log"))
+    proxy_started = time.perf_counter()
+    proxy = start(uvicorn + ["server:app", "--port", str(proxy_port), "--workers", str(args.workers)],
+                  proxy_env, os.path.join(data_dir, "proxy.log"))
+    results = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "settings": {"requests": args.requests, "concurrency": args.concurrency, "reports": args.reports,
+                     "workers": args.workers, "mock_env": parse_env(args.mock_env),
+                     "proxy_env": parse_env(args.proxy_env)},
+        "scenarios": {},
+    }
+    try:
+        await wait_ready(f"http://127.0.0.1:{proxy_port}/pool/stats", proxy)
+        results["startup"] = {"ready_seconds": round(time.perf_counter() - proxy_started, 4)}
+        if args.startup_runs:
+            # A data directory of its own, so the imports never touch the running proxy's stores.
+            import_env = {**proxy_env, "PROXY_DATA_DIR": os.path.join(data_dir, "import")}
+            results["startup"]["import_seconds"] = import_seconds(import_env, args.startup_runs)
+        print(f"{'startup':20} ready {results['startup']['ready_seconds']} s  "
+              f"import {results['startup'].get('import_seconds')}")
+        await wait_ready(f"http://127.0.0.1:{mock_port}/_mock/stats", mock)
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{proxy_port}", limits=limits,
+                                     timeout=args.timeout) as client:
+            for name in args.scenarios:
+                recorder = Recorder()
+                started = time.perf_counter()
+                await SCENARIOS[name](client, args, recorder)
+                summary = recorder.summary(time.perf_counter() - started)
+                results["scenarios"][name] = summary
+                print(f"{name:20} {summary['requests']:6} req  {summary['throughput_rps']:8} req/s  "
+                      f"p50 {summary['latency_ms']['p50']} ms  p95 {summary['latency_ms']['p95']} ms  "
+                      f"p99 {summary['latency_ms']['p99']} ms  ok {summary['success_ratio']}  {summary['statuses']}")
+            results["upstream"] = (await client.get(f"http://127.0.0.1:{mock_port}/_mock/stats")).json()
+    finally:
+        for process in (proxy, mock):
+            process.terminate()
+        for process in (proxy, mock):
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    results["logs"] = data_dir
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the proxy against a local PlagiarismSearch mock.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--reports", type=int, default=10, help="distinct reports used by the read scenarios")
+    parser.add_argument("--duplicates", type=float, default=0.0, help="share of repeated texts in submit_burst")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the proxy")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--startup-runs", type=int, default=5,
+                        help="fresh interpreters timed importing server.py (0 to skip)")
+    parser.add_argument("--mock-env", action="append", metavar="NAME=VALUE", help="mock setting, e.g. MOCK_LATENCY_MS=200")
+    parser.add_argument("--proxy-env", action="append", metavar="NAME=VALUE", help="proxy setting, e.g. UPSTREAM_RATE_LIMIT=none")
+    parser.add_argument("--output", help="results file (default: bench/results/<timestamp>.json)")
+    parser.add_argument("--save-baseline", action="store_true", help=f"also write the results to {BASELINE_PATH}")
+    parser.add_argument("--compare", nargs="?", const=BASELINE_PATH, metavar="BASELINE",
+                        help="compare with a baseline file and exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (default 0.2)")
+    args = parser.parse_args(argv)
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    results = asyncio.run(run(args))
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results: {output}")
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline: {BASELINE_PATH}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print("no regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,28 @@
+"""
+Local SQLite storage shared by the proxy's persistent indexes and caches.
+
+Every store gets its own database file under PROXY_DATA_DIR so they can be
+wiped independently.
+"""
+import os
+import sqlite3
+
+DATA_DIR = os.getenv("PROXY_DATA_DIR", ".data")
+
+
+def data_path(name: str) -> str:
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return os.path.join(DATA_DIR, name)
+
+
+def connect(name: str) -> sqlite3.Connection:
+    """
+    Open (or create) a SQLite database in the data directory.
+
+    The connection is shared by the event loop thread only; WAL mode keeps
+    readers from blocking the occasional writer.
+    """
+    conn = sqlite3.connect(data_path(name), check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
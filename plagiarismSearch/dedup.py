@@ -0,0 +1,181 @@
+"""
+Content-hash deduplication for /check and /ai-check submissions.
+
+A submission is keyed on its normalized text, raw file bytes or URL together
+with the search options that affect the result. Repeat submissions return the
+stored create response (same report id) and concurrent duplicates attach to the
+in-flight upstream call instead of paying for a second check.
+"""
+from typing import Awaitable, Callable, Optional
+import asyncio
+import hashlib
+import json
+import os
+import time
+import unicodedata
+
+import datastore
+
+ENABLED = os.getenv("DEDUP_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "10000"))
+TTL_SECONDS = int(os.getenv("DEDUP_TTL_SECONDS", str(7 * 24 * 3600)))
+
+HIT = "hit"
+INFLIGHT = "inflight"
+MISS = "miss"
+BYPASS = "bypass"
+
+
+def normalize_text(text: str) -> str:
+    """Unicode-normalize and collapse whitespace so cosmetic edits hash the same."""
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split())
+
+
+def submission_key(kind: str, options: dict, text: Optional[str] = None,
+                   url: Optional[str] = None, file_digest: Optional[str] = None) -> str:
+    """
+    Build the dedup key for one submission.
+
+    `kind` separates plagiarism and AI checks; `options` holds every flag that
+    changes the upstream result (title and callback_url are deliberately left out).
+    `file_digest` is the SHA-256 of the uploaded file bytes.
+    """
+    parts = {
+        "kind": kind,
+        "options": {k: options[k] for k in sorted(options) if options[k] is not None},
+        "text": hashlib.sha256(normalize_text(text).encode()).hexdigest() if text else None,
+        "url": url.strip() if url else None,
+        "file": file_digest,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+def _report_id(result) -> Optional[int]:
+    if isinstance(result, dict) and isinstance(result.get("data"), dict):
+        return result["data"].get("id")
+    return None
+
+
+class DedupIndex:
+    """Persistent key -> create-response map with TTL and LRU eviction."""
+
+    def __init__(self, db_name: str = "dedup.sqlite3", max_entries: int = MAX_ENTRIES,
+                 ttl: int = TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.inflight_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._inflight: dict = {}
+        self._db = datastore.connect(db_name)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS submissions ("
+            " key TEXT PRIMARY KEY, report_id INTEGER, response TEXT NOT NULL,"
+            " created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS submissions_report ON submissions(report_id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS submissions_lru ON submissions(last_used)")
+
+    def get(self, key: str) -> Optional[dict]:
+        row = self._db.execute(
+            "SELECT response, created FROM submissions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if self.ttl and now - row[1] > self.ttl:
+            self._db.execute("DELETE FROM submissions WHERE key = ?", (key,))
+            return None
+        self._db.execute("UPDATE submissions SET last_used = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key: str, result: dict):
+        now = time.time()
+        self._db.execute(
+            "INSERT OR REPLACE INTO submissions (key, report_id, response, created, last_used)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (key, _report_id(result), json.dumps(result), now, now),
+        )
+        self._evict()
+
+    def _evict(self):
+        count = self._db.execute("SELECT COUNT(*) FROM submissions").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM submissions WHERE key IN"
+                " (SELECT key FROM submissions ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+            self.evictions += excess
+
+    def count(self, outcome: str):
+        """Record a lookup answered outside submit(), e.g. by the job queue."""
+        if outcome == HIT:
+            self.hits += 1
+        elif outcome == INFLIGHT:
+            self.inflight_hits += 1
+        elif outcome == MISS:
+            self.misses += 1
+
+    def forget_report(self, report_id: int):
+        """Drop every submission that points at a deleted or failed report."""
+        self._db.execute("DELETE FROM submissions WHERE report_id = ?", (report_id,))
+
+    async def submit(self, key: str, create: Callable[[], Awaitable[dict]]):
+        """
+        Return (result, outcome) for a submission.
+
+        `create` performs the upstream call and only runs on a miss. Errors are
+        propagated to every caller attached to the same in-flight submission and
+        nothing is stored for them.
+        """
+        stored = self.get(key)
+        if stored is not None:
+            self.hits += 1
+            return stored, HIT
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.inflight_hits += 1
+            return await asyncio.shield(pending), INFLIGHT
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        # Mark exceptions as retrieved when nobody else attached to this submission.
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            result = await create()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        if _report_id(result) is not None:
+            self.put(key, result)
+        future.set_result(result)
+        return result, MISS
+
+    def stats(self) -> dict:
+        entries = self._db.execute("SELECT COUNT(*) FROM submissions").fetchone()[0]
+        lookups = self.hits + self.inflight_hits + self.misses
+        return {
+            "enabled": ENABLED,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "inflight_hits": self.inflight_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "in_flight": len(self._inflight),
+            "hit_ratio": round((self.hits + self.inflight_hits) / lookups, 4) if lookups else None,
+        }
+
+
+index = DedupIndex()
@@ -0,0 +1,331 @@
+"""
+Server-side text extraction for /check uploads.
+
+PDF, DOCX, TXT and TeX uploads are turned into normalized plain text in a
+process pool, optionally with references and quotations removed, and the text
+is sent to PlagiarismSearch instead of the binary document. The same text is
+used for the dedup key and the near-duplicate index. Anything that cannot be
+extracted (other formats, scanned PDFs, pypdf not installed) is forwarded as
+the original file.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import asyncio
+import io
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import time
+import unicodedata
+import zipfile
+from xml.etree import ElementTree
+
+from fastapi import HTTPException, UploadFile
+
+import metrics
+import uploads
+
+ENABLED = os.getenv("EXTRACT_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+WORKERS = int(os.getenv("EXTRACT_WORKERS", "2"))
+MAX_QUEUE = int(os.getenv("EXTRACT_QUEUE", "32"))
+# Less text than this usually means a scanned PDF; send the file and let upstream OCR it.
+MIN_TEXT_CHARS = int(os.getenv("EXTRACT_MIN_TEXT_CHARS", "200"))
+RETRY_AFTER_SECONDS = 5
+
+PDF = "pdf"
+DOCX = "docx"
+TXT = "txt"
+TEX = "tex"
+
+STAGES = ("read", "extract", "filter", "normalize")
+
+_EXTENSIONS = {".pdf": PDF, ".docx": DOCX, ".txt": TXT, ".md": TXT, ".text": TXT, ".tex": TEX, ".latex": TEX}
+_CONTENT_TYPES = {
+    "application/pdf": PDF,
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": DOCX,
+    "text/plain": TXT,
+    "application/x-tex": TEX,
+    "text/x-tex": TEX,
+}
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_REFERENCES_HEADING = re.compile(
+    r"^\s*(?:\d+\.?\s*)?(references|bibliography|works cited|literature cited|reference list|sources)\s*:?\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+_QUOTED = re.compile(r"\"[^\"\n]{1,2000}\"|\u201c[^\u201d]{1,2000}\u201d|\u00ab[^\u00bb]{1,2000}\u00bb|\u201e[^\u201c\u201d]{1,2000}[\u201c\u201d]")
+_TEX_COMMENT = re.compile(r"(?<!\\)%.*")
+_TEX_DROP_ENVS = re.compile(r"\\begin\{(equation|align|figure|table|tabular|verbatim|lstlisting|tikzpicture)\*?\}.*?\\end\{\1\*?\}", re.DOTALL)
+_TEX_BIBLIOGRAPHY = re.compile(r"\\begin\{thebibliography\}.*?\\end\{thebibliography\}|\\bibliography\{[^}]*\}|\\printbibliography", re.DOTALL)
+_TEX_QUOTES = re.compile(r"\\begin\{(quote|quotation)\}.*?\\end\{\1\}|``.*?''", re.DOTALL)
+_TEX_DROP_COMMANDS = re.compile(r"\\(cite[a-z]*|ref|eqref|label|includegraphics|usepackage|documentclass|bibliographystyle|input|include)\*?(\[[^\]]*\])*\{[^}]*\}")
+_TEX_COMMAND = re.compile(r"\\[a-zA-Z@]+\*?(\[[^\]]*\])?")
+_TEX_MATH = re.compile(r"\$\$.*?\$\$|\$[^$]*\$|\\\[.*?\\\]", re.DOTALL)
+
+
+def kind_of(filename: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext in _EXTENSIONS:
+        return _EXTENSIONS[ext]
+    return _CONTENT_TYPES.get((content_type or "").split(";")[0].strip().lower())
+
+
+def _open(source):
+    """A path as-is, upload bytes as a file object: what PdfReader and ZipFile accept."""
+    return io.BytesIO(source) if isinstance(source, bytes) else source
+
+
+def _pdf_text(source) -> str:
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return ""
+    reader = PdfReader(_open(source))
+    return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+
+
+def _docx_text(source) -> str:
+    with zipfile.ZipFile(_open(source)) as archive:
+        root = ElementTree.fromstring(archive.read("word/document.xml"))
+    paragraphs = []
+    for paragraph in root.iter(f"{_W}p"):
+        parts = []
+        for node in paragraph.iter():
+            if node.tag == f"{_W}t" and node.text:
+                parts.append(node.text)
+            elif node.tag == f"{_W}tab":
+                parts.append("\t")
+            elif node.tag in (f"{_W}br", f"{_W}cr"):
+                parts.append("\n")
+        paragraphs.append("".join(parts))
+    return "\n\n".join(paragraphs)
+
+
+def _plain_text(data: bytes) -> str:
+    if data.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return data.decode("utf-16", errors="replace")
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("latin-1")
+
+
+def _tex_text(source: str, filter_references: bool, filter_quotes: bool) -> str:
+    source = _TEX_COMMENT.sub("", source)
+    begin = source.find("\\begin{document}")
+    if begin != -1:
+        source = source[begin + len("\\begin{document}"):]
+        source = source.split("\\end{document}", 1)[0]
+    if filter_references:
+        source = _TEX_BIBLIOGRAPHY.sub("", source)
+    if filter_quotes:
+        source = _TEX_QUOTES.sub("", source)
+    source = _TEX_DROP_ENVS.sub("", source)
+    source = _TEX_MATH.sub("", source)
+    source = _TEX_DROP_COMMANDS.sub("", source)
+    source = _TEX_COMMAND.sub("", source)
+    return source.replace("{", "").replace("}", "").replace("~", " ")
+
+
+def normalize(text: str) -> str:
+    """NFKC, undo end-of-line hyphenation, and collapse whitespace while keeping paragraph breaks."""
+    text = unicodedata.normalize("NFKC", text).replace("\r\n", "\n").replace("\r", "\n")
+    text = re.sub(r"(\w)-\n(\w)", r"\1\2", text)
+    text = "".join(ch for ch in text if ch in "\n\t" or unicodedata.category(ch)[0] != "C")
+    paragraphs = re.split(r"\n\s*\n", text)
+    return "\n\n".join(p for p in (" ".join(p.split()) for p in paragraphs) if p)
+
+
+def strip_references(text: str) -> str:
+    """Drop everything from the last references/bibliography heading onwards."""
+    headings = list(_REFERENCES_HEADING.finditer(text))
+    # A heading in the first half is more likely a table of contents entry.
+    if headings and headings[-1].start() > len(text) // 2:
+        return text[:headings[-1].start()].rstrip()
+    return text
+
+
+def strip_quotes(text: str) -> str:
+    return _QUOTED.sub("", text)
+
+
+def _read(source) -> bytes:
+    if isinstance(source, bytes):
+        return source
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def _extract(source, kind: str, filter_references: bool, filter_quotes: bool) -> dict:
+    """Worker-process entry point, reading the upload's bytes or its copy at a path: (text, per-stage seconds)."""
+    timings = {}
+    started = time.perf_counter()
+    if kind == PDF:
+        raw = _pdf_text(source)
+    elif kind == DOCX:
+        raw = _docx_text(source)
+    elif kind == TEX:
+        raw = _tex_text(_plain_text(_read(source)), filter_references, filter_quotes)
+    else:
+        raw = _plain_text(_read(source))
+    timings["extract"] = time.perf_counter() - started
+    # Filters run on the raw text: reference headings are recognised by sitting on their own line.
+    started = time.perf_counter()
+    if filter_references:
+        raw = strip_references(raw)
+    if filter_quotes and kind != TEX:
+        raw = strip_quotes(raw)
+    timings["filter"] = time.perf_counter() - started
+    started = time.perf_counter()
+    text = normalize(raw)
+    timings["normalize"] = time.perf_counter() - started
+    return {"text": text, "timings": timings}
+
+
+def _source(upload: UploadFile) -> tuple:
+    """
+    What the worker reads, and whether it is a temporary copy: (bytes or path, size, copied).
+
+    An upload still spooled in memory is at most UPLOAD_MEMORY_BYTES, so its
+    bytes go to the worker directly. One rolled over to disk has no name to
+    hand over, so it is copied in chunks to a named temporary file instead.
+    """
+    file = upload.file
+    if not getattr(file, "_rolled", True):
+        file.seek(0)
+        data = file.read()
+        file.seek(0)
+        return data, len(data), False
+    path, size = _spill(file)
+    return path, size, True
+
+
+def _spill(file) -> tuple:
+    """Copy an upload to a temporary file in chunks and rewind it: (path, size)."""
+    file.seek(0)
+    with tempfile.NamedTemporaryFile(prefix="extract-", delete=False) as out:
+        shutil.copyfileobj(file, out, uploads.CHUNK_SIZE)
+        size = out.tell()
+    file.seek(0)
+    return out.name, size
+
+
+class TextExtractor:
+    def __init__(self, workers: int = WORKERS, max_queue: int = MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.runs = 0
+        self.extracted = 0
+        self.fallbacks = 0
+        self.failures = 0
+        self.rejected = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.stage_seconds = {stage: 0.0 for stage in STAGES}
+        self.stage_seconds_max = {stage: 0.0 for stage in STAGES}
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+            self._slots = asyncio.Semaphore(self.workers)
+        return self._pool
+
+    def _record(self, timings: dict):
+        self.runs += 1
+        for stage, seconds in timings.items():
+            self.stage_seconds[stage] += seconds
+            metrics.EXTRACT_SECONDS.observe(seconds, stage)
+            self.stage_seconds_max[stage] = max(self.stage_seconds_max[stage], seconds)
+
+    async def extract(self, upload: UploadFile, filter_references: bool = False,
+                      filter_quotes: bool = False) -> Optional[dict]:
+        """
+        Extract the text of an upload; None when it should be sent as-is.
+
+        Returns {"text", "kind", "bytes_in", "bytes_out", "timings"} with
+        per-stage timings in seconds. The upload is rewound either way.
+        """
+        kind = kind_of(upload.filename, upload.content_type)
+        if kind is None:
+            self.fallbacks += 1
+            return None
+        pool = self._executor()
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Text extraction queue is full, retry shortly.",
+                                headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+        # The request's upload reservation covers the worker's copy: it lives no longer than the request.
+        path = None
+        try:
+            started = time.perf_counter()
+            source, size, copied = await asyncio.to_thread(_source, upload)
+            if copied:
+                path = source
+            timings = {"read": time.perf_counter() - started}
+            self.waiting += 1
+            try:
+                await self._slots.acquire()
+            finally:
+                self.waiting -= 1
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    pool, _extract, source, kind, filter_references, filter_quotes)
+            except Exception:
+                # Corrupt or encrypted documents: let upstream have a go at the original.
+                self.failures += 1
+                return None
+            finally:
+                self._slots.release()
+        finally:
+            if path is not None:
+                os.remove(path)
+        timings.update(result["timings"])
+        self._record(timings)
+        text = result["text"]
+        if len(text) < MIN_TEXT_CHARS:
+            self.fallbacks += 1
+            return None
+        encoded = len(text.encode())
+        self.extracted += 1
+        self.bytes_in += size
+        self.bytes_out += encoded
+        return {"text": text, "kind": kind, "bytes_in": size, "bytes_out": encoded, "timings": timings}
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": ENABLED,
+            "workers": self.workers,
+            "queue_depth": self.waiting,
+            "extracted": self.extracted,
+            "fallbacks": self.fallbacks,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "stage_ms": {
+                stage: {
+                    "avg": round(self.stage_seconds[stage] / self.runs * 1000, 3) if self.runs else None,
+                    "max": round(self.stage_seconds_max[stage] * 1000, 3),
+                }
+                for stage in STAGES
+            },
+        }
+
+
+def server_timing(timings: dict) -> str:
+    """Server-Timing header value for per-stage timings in seconds."""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+extractor = TextExtractor()
@@ -0,0 +1,86 @@
+"""
+Cached liveness data for /health and /healthz.
+
+The keep-alive cron job pings the health endpoints every few minutes. Instead of
+calling upstream on every ping, a background task asks upstream for one report
+(GET /reports?limit=1) every HEALTH_PROBE_INTERVAL seconds and the endpoints
+serve the latest result from memory. psutil is only imported once /health is
+first asked for system figures.
+"""
+from typing import Callable, Optional
+import asyncio
+import os
+import time
+
+import upstream
+
+PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "120"))
+PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "10"))
+
+
+class UpstreamProbe:
+    def __init__(self, interval: float = PROBE_INTERVAL, timeout: float = PROBE_TIMEOUT):
+        self.interval = interval
+        self.timeout = timeout
+        self.last: Optional[dict] = None
+        self.probes = 0
+        self.failures = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def check(self, url: str, headers: dict) -> dict:
+        """Call upstream once and remember the outcome."""
+        started = time.perf_counter()
+        result = {"reachable": False, "status_code": None, "error": None}
+        try:
+            # Straight to the client: a probe must not wait on the rate limiter or trip the breaker.
+            async with upstream.client() as http:
+                response = await http.get(url, headers=headers, params={"page": 1, "limit": 1},
+                                          timeout=self.timeout)
+            result["status_code"] = response.status_code
+            result["reachable"] = response.status_code < 500
+        except Exception as e:
+            # Reported, never raised: an exception would end the probe loop.
+            result["error"] = e.__class__.__name__
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        result["checked_at"] = time.time()
+        self.probes += 1
+        if not result["reachable"]:
+            self.failures += 1
+        self.last = result
+        return result
+
+    async def _loop(self, url: str, headers: Callable[[], dict]):
+        while True:
+            await self.check(url, headers())
+            await asyncio.sleep(self.interval)
+
+    def start(self, url: str, headers: Callable[[], dict]):
+        """Probe now (in the background, so startup does not wait) and then every `interval` seconds."""
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._loop(url, headers))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def snapshot(self) -> dict:
+        if self.last is None:
+            return {"reachable": None, "checked_at": None, "interval": self.interval}
+        return {**self.last, "age_seconds": round(time.time() - self.last["checked_at"], 3),
+                "interval": self.interval, "probes": self.probes, "failures": self.failures}
+
+
+def system() -> dict:
+    """Host uptime and memory, from a single psutil reading."""
+    import psutil
+
+    memory = psutil.virtual_memory()
+    return {
+        "uptime": time.time() - psutil.boot_time(),
+        "memory": {"total": memory.total, "available": memory.available, "percent": memory.percent},
+    }
+
+
+probe = UpstreamProbe()
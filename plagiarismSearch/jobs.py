@@ -0,0 +1,327 @@
+"""
+Durable submission queue for /check, /ai-check and /storage/create.
+
+With `Prefer: respond-async` (or JOBS_ASYNC_DEFAULT=1) a submission is stored
+in SQLite, together with a copy of its upload under PROXY_DATA_DIR/jobs, and
+answered at once with 202 and a local job id. JOBS_WORKERS background tasks
+send queued jobs upstream, so a burst of submissions reaches PlagiarismSearch
+at the pace of the workers and the upstream rate limiter. A job that is
+throttled or finds upstream unreachable is retried with backoff.
+
+Several processes (uvicorn --workers) may share the queue. A worker claims a
+job with a conditional UPDATE, so only one process ever runs it, and holds it
+under a lease of JOBS_LEASE_SECONDS that it renews while the submission is in
+flight. A running job whose lease has expired belonged to a process that died
+mid-submit and is claimed again, so delivery is at-least-once.
+"""
+from typing import Awaitable, Callable, Optional
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import time
+import uuid
+
+from fastapi import HTTPException, UploadFile
+
+import datastore
+import upstream
+
+ASYNC_DEFAULT = os.getenv("JOBS_ASYNC_DEFAULT", "0").strip().lower() in ("1", "true", "yes", "on")
+WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "8"))
+RETRY_BASE_DELAY = float(os.getenv("JOBS_RETRY_BASE_DELAY", "5"))
+RETRY_MAX_DELAY = float(os.getenv("JOBS_RETRY_MAX_DELAY", "300"))
+KEEP_SECONDS = int(os.getenv("JOBS_KEEP_SECONDS", str(7 * 24 * 3600)))
+LEASE_SECONDS = float(os.getenv("JOBS_LEASE_SECONDS", "120"))
+IDLE_POLL_SECONDS = 5.0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Statuses after which upstream certainly did not create anything; other errors fail the job.
+RETRY_STATUSES = {429, 503}
+
+
+def wants_async(prefer: Optional[str]) -> bool:
+    """True when the request's Prefer header (or the default) asks for a queued submission."""
+    return ASYNC_DEFAULT or "respond-async" in (prefer or "").lower()
+
+
+def _retryable(error: HTTPException) -> bool:
+    if isinstance(error, upstream.UpstreamTransportError):
+        return error.connect
+    return error.status_code in RETRY_STATUSES
+
+
+def _delay(error: HTTPException, attempts: int) -> float:
+    retry_after = (error.headers or {}).get("Retry-After")
+    if retry_after is not None:
+        try:
+            return min(max(float(retry_after), 1.0), RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+    return random.uniform(RETRY_BASE_DELAY, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempts)))
+
+
+class JobQueue:
+    def __init__(self, db_name: str = "jobs.sqlite3", workers: int = WORKERS, lease_seconds: float = LEASE_SECONDS):
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.db_name = db_name
+        # Written into claimed rows, so a process only ever settles or releases its own jobs.
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.files_dir = os.path.join(datastore.DATA_DIR, "jobs")
+        self._conn = None
+        self._wakeup = asyncio.Event()
+        self._tasks: list = []
+        self.enqueued = 0
+        self.submitted = 0
+        self.retried = 0
+        self.failed = 0
+        self.recovered = 0
+        self.lost = 0
+
+    @property
+    def _db(self):
+        """The queue database, opened (and its schema created) on first use rather than at import."""
+        if self._conn is None:
+            conn = datastore.connect(self.db_name)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, state TEXT NOT NULL, path TEXT NOT NULL,"
+                " fields TEXT NOT NULL, document TEXT, meta TEXT NOT NULL, dedup_key TEXT,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " next_attempt REAL NOT NULL, created REAL NOT NULL, updated REAL NOT NULL,"
+                " owner TEXT, lease_until REAL,"
+                " report_id INTEGER, result TEXT, error TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_due ON jobs(state, next_attempt)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_lease ON jobs(state, lease_until)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_dedup ON jobs(dedup_key)")
+            self._conn = conn
+        return self._conn
+
+    async def enqueue(self, kind: str, path: str, fields: dict, upload: Optional[UploadFile] = None,
+                      meta: Optional[dict] = None, dedup_key: Optional[str] = None) -> dict:
+        """
+        Store a submission (and a copy of its upload) and wake a worker.
+
+        `fields` are the upstream create fields, `meta` is kept for the
+        on_done hook and `dedup_key` lets duplicates find this job.
+        """
+        job_id = uuid.uuid4().hex
+        document = None
+        if upload is not None:
+            target = os.path.join(self.files_dir, job_id)
+            await upload.seek(0)
+            await asyncio.to_thread(self._copy, upload.file, target)
+            await upload.seek(0)
+            document = {"file": target, "filename": upload.filename, "content_type": upload.content_type}
+        now = time.time()
+        self._db.execute(
+            "INSERT INTO jobs (job_id, kind, state, path, fields, document, meta, dedup_key, next_attempt,"
+            " created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, QUEUED, path, json.dumps(fields), json.dumps(document) if document else None,
+             json.dumps(meta or {}), dedup_key, now, now, now),
+        )
+        self.enqueued += 1
+        self._wakeup.set()
+        return self.get(job_id)
+
+    @staticmethod
+    def _copy(source, target: str):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as out:
+            shutil.copyfileobj(source, out, 1024 * 1024)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._db.execute(
+            "SELECT job_id, kind, state, path, fields, document, meta, dedup_key, attempts, next_attempt, created,"
+            " updated, report_id, result, error FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0], "kind": row[1], "state": row[2], "path": row[3], "fields": json.loads(row[4]),
+            "document": json.loads(row[5]) if row[5] else None, "meta": json.loads(row[6]), "dedup_key": row[7],
+            "attempts": row[8], "next_attempt": row[9], "created": row[10], "updated": row[11],
+            "report_id": row[12], "result": json.loads(row[13]) if row[13] else None, "error": row[14],
+        }
+
+    def find_active(self, dedup_key: str) -> Optional[dict]:
+        """A queued or running job for the same submission, so duplicates can attach to it."""
+        row = self._db.execute(
+            "SELECT job_id FROM jobs WHERE dedup_key = ? AND state IN (?, ?) ORDER BY created LIMIT 1",
+            (dedup_key, QUEUED, RUNNING),
+        ).fetchone()
+        return self.get(row[0]) if row else None
+
+    def _claim(self) -> Optional[dict]:
+        """
+        Take the oldest due job: a queued one, or a running one whose owner's lease ran out.
+
+        The UPDATE only succeeds while the row is still claimable, so when
+        several processes race for a job exactly one of them gets it.
+        """
+        now = time.time()
+        candidates = self._db.execute(
+            "SELECT job_id, state FROM jobs WHERE (state = ? AND next_attempt <= ?) OR (state = ? AND lease_until < ?)"
+            " ORDER BY created LIMIT 8",
+            (QUEUED, now, RUNNING, now),
+        ).fetchall()
+        for job_id, state in candidates:
+            claimed = self._db.execute(
+                "UPDATE jobs SET state = ?, owner = ?, lease_until = ?, attempts = attempts + 1, updated = ?"
+                " WHERE job_id = ? AND (state = ? OR (state = ? AND lease_until < ?))",
+                (RUNNING, self.owner, now + self.lease_seconds, now, job_id, QUEUED, RUNNING, now),
+            ).rowcount
+            if claimed:
+                if state == RUNNING:
+                    self.recovered += 1
+                return self.get(job_id)
+        return None
+
+    def _settle(self, job: dict, assignments: str, params: tuple) -> bool:
+        """Update a job this process still owns; False when its lease was lost to another process."""
+        settled = self._db.execute(
+            f"UPDATE jobs SET {assignments}, owner = NULL, lease_until = NULL, updated = ?"
+            " WHERE job_id = ? AND state = ? AND owner = ?",
+            (*params, time.time(), job["job_id"], RUNNING, self.owner),
+        ).rowcount
+        if not settled:
+            self.lost += 1
+        return bool(settled)
+
+    def _renew(self, job: dict) -> bool:
+        return bool(self._db.execute(
+            "UPDATE jobs SET lease_until = ? WHERE job_id = ? AND state = ? AND owner = ?",
+            (time.time() + self.lease_seconds, job["job_id"], RUNNING, self.owner),
+        ).rowcount)
+
+    async def _keep_lease(self, job: dict):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not self._renew(job):
+                return
+
+    def _next_due(self) -> float:
+        row = self._db.execute(
+            "SELECT MIN(CASE WHEN state = ? THEN next_attempt ELSE lease_until END) FROM jobs"
+            " WHERE state = ? OR (state = ? AND lease_until IS NOT NULL)",
+            (QUEUED, QUEUED, RUNNING),
+        ).fetchone()
+        if row[0] is None:
+            return IDLE_POLL_SECONDS
+        return min(max(row[0] - time.time(), 0.0), IDLE_POLL_SECONDS)
+
+    def _finish(self, job: dict, state: str, result=None, error: Optional[str] = None) -> bool:
+        data = result.get("data") if isinstance(result, dict) else None
+        report_id = data.get("id") if isinstance(data, dict) else None
+        if not self._settle(job, "state = ?, report_id = ?, result = ?, error = ?",
+                            (state, report_id, json.dumps(result) if result is not None else None, error)):
+            return False
+        if job["document"]:
+            try:
+                os.remove(job["document"]["file"])
+            except OSError:
+                pass
+        return True
+
+    async def _run(self, job: dict, send: Callable[[dict], Awaitable[dict]],
+                   on_done: Callable[[dict, dict], None]):
+        lease = asyncio.create_task(self._keep_lease(job))
+        try:
+            result = await send(job)
+        except HTTPException as e:
+            if _retryable(e) and job["attempts"] < MAX_ATTEMPTS:
+                self.retried += 1
+                self._settle(job, "state = ?, next_attempt = ?, error = ?",
+                             (QUEUED, time.time() + _delay(e, job["attempts"]), str(e.detail)[:500]))
+                return
+            self.failed += 1
+            self._finish(job, FAILED, error=str(e.detail)[:500])
+            return
+        except Exception as e:
+            self.failed += 1
+            self._finish(job, FAILED, error=f"{e.__class__.__name__}: {e}"[:500])
+            return
+        finally:
+            lease.cancel()
+        self.submitted += 1
+        if self._finish(job, DONE, result=result):
+            on_done(job, result)
+
+    async def _worker(self, send, on_done):
+        while True:
+            job = self._claim()
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self._next_due())
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job, send, on_done)
+
+    def start(self, send: Callable[[dict], Awaitable[dict]], on_done: Callable[[dict, dict], None]):
+        """Start the workers; `send` performs the upstream call, `on_done` sees every successful result."""
+        self.purge()
+        self._tasks = [asyncio.create_task(self._worker(send, on_done)) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Cancel the workers and hand this process's interrupted jobs back to the queue."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._conn is not None:
+            self._db.execute(
+                "UPDATE jobs SET state = ?, owner = NULL, lease_until = NULL, updated = ? WHERE state = ? AND owner = ?",
+                (QUEUED, time.time(), RUNNING, self.owner),
+            )
+
+    def purge(self):
+        """Forget finished jobs older than JOBS_KEEP_SECONDS."""
+        self._db.execute("DELETE FROM jobs WHERE state IN (?, ?) AND updated < ?",
+                         (DONE, FAILED, time.time() - KEEP_SECONDS))
+
+    def stats(self) -> dict:
+        counts = dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        oldest = self._db.execute("SELECT MIN(created) FROM jobs WHERE state = ?", (QUEUED,)).fetchone()[0]
+        return {
+            "async_default": ASYNC_DEFAULT,
+            "workers": self.workers,
+            "running_workers": sum(1 for t in self._tasks if not t.done()),
+            "queued": counts.get(QUEUED, 0),
+            "running": counts.get(RUNNING, 0),
+            "done": counts.get(DONE, 0),
+            "failed": counts.get(FAILED, 0),
+            "oldest_queued_seconds": round(time.time() - oldest, 3) if oldest else None,
+            "enqueued": self.enqueued,
+            "submitted": self.submitted,
+            "retried": self.retried,
+            "failures": self.failed,
+            "recovered": self.recovered,
+            "lost_leases": self.lost,
+            "lease_seconds": self.lease_seconds,
+        }
+
+
+def public(job: dict) -> dict:
+    """The client-facing view of a job (no stored fields or file paths)."""
+    view = {key: job[key] for key in ("job_id", "kind", "state", "attempts", "created", "updated", "report_id")}
+    if job["state"] == DONE:
+        view["result"] = job["result"]
+    elif job["error"]:
+        view["error"] = job["error"]
+    if job["state"] == QUEUED:
+        view["next_attempt"] = job["next_attempt"]
+    return view
+
+
+queue = JobQueue()
@@ -0,0 +1,116 @@
+"""
+Concurrent listing of a whole report history for GET /reports/stream.
+
+Pages of GET /reports are fetched ahead of the client with at most
+LIST_PREFETCH requests in flight and written out as NDJSON, one report per
+line, in page order. Only the prefetch window is held in memory, however many
+reports the account has. `ids` lookups are split into chunks of LIST_IDS_CHUNK
+ids, one POST /reports per chunk, through the same window.
+"""
+from contextlib import aclosing
+from functools import partial
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Optional
+import asyncio
+import collections
+import itertools
+import math
+import os
+
+from fastapi import HTTPException
+
+import passthrough
+
+PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "100"))
+PREFETCH = int(os.getenv("LIST_PREFETCH", "4"))
+IDS_CHUNK = int(os.getenv("LIST_IDS_CHUNK", "100"))
+# Upper bound for an open-ended listing whose upstream response carries no total.
+MAX_PAGES = int(os.getenv("LIST_MAX_PAGES", "1000"))
+
+MEDIA_TYPE = "application/x-ndjson"
+
+stats = {"streams": 0, "pages": 0, "reports": 0, "errors": 0}
+
+
+def page_items(payload) -> list:
+    data = payload.get("data") if isinstance(payload, dict) else None
+    return data if isinstance(data, list) else []
+
+
+def total_pages(payload, limit: int) -> Optional[int]:
+    """Page count from the upstream pagination block, when it has one."""
+    pagination = payload.get("pagination") if isinstance(payload, dict) else None
+    if not isinstance(pagination, dict):
+        return None
+    total = pagination.get("total", pagination.get("count"))
+    if not isinstance(total, int):
+        return None
+    return max(math.ceil(total / limit), 1)
+
+
+async def _ordered(calls: Iterator[Callable[[], Awaitable]], window: int) -> AsyncIterator:
+    """Run calls with at most `window` in flight and yield their results in call order."""
+    pending = collections.deque()
+    try:
+        for call in itertools.islice(calls, window):
+            pending.append(asyncio.ensure_future(call()))
+        while pending:
+            result = await pending.popleft()
+            # Refill before yielding so upstream keeps working while the client reads.
+            for call in itertools.islice(calls, 1):
+                pending.append(asyncio.ensure_future(call()))
+            yield result
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _lines(payload) -> bytes:
+    items = page_items(payload)
+    stats["pages"] += 1
+    stats["reports"] += len(items)
+    return b"".join(passthrough.dumps(item) + b"\n" for item in items)
+
+
+async def _ndjson(first, calls: Iterator[Callable[[], Awaitable]], short: Optional[int] = None):
+    """
+    NDJSON lines of the first payload and then of every call's result.
+
+    With `short` set, the stream ends after the first page holding fewer items.
+    An upstream failure mid-stream becomes a final {"error": ...} line, since
+    the status code has already been sent.
+    """
+    stats["streams"] += 1
+    yield _lines(first)
+    position = 1
+    try:
+        async with aclosing(_ordered(calls, PREFETCH)) as results:
+            async for payload in results:
+                position += 1
+                yield _lines(payload)
+                if short is not None and len(page_items(payload)) < short:
+                    break
+    except HTTPException as e:
+        stats["errors"] += 1
+        yield passthrough.dumps({"error": e.detail, "status_code": e.status_code, "request": position + 1}) + b"\n"
+
+
+async def by_pages(fetch: Callable[[int], Awaitable], first: int = 1, last: Optional[int] = None,
+                   limit: int = PAGE_SIZE):
+    """
+    Fetch page `first` now, so that errors still get a proper status code, and
+    return an NDJSON stream of it and the following pages up to `last`.
+    """
+    payload = await fetch(first)
+    bounds = [b for b in (last, total_pages(payload, limit)) if b is not None]
+    last = min(bounds + [first + MAX_PAGES - 1])
+    calls = iter(())
+    if len(page_items(payload)) >= limit and last > first:
+        calls = (partial(fetch, page) for page in range(first + 1, last + 1))
+    return _ndjson(payload, calls, short=limit)
+
+
+async def by_ids(fetch: Callable[[List[int]], Awaitable], ids: List[int], chunk: int = IDS_CHUNK):
+    """Look reports up `chunk` ids per upstream call; same streaming as by_pages()."""
+    chunks = [ids[i:i + chunk] for i in range(0, len(ids), chunk)]
+    payload = await fetch(chunks[0])
+    return _ndjson(payload, (partial(fetch, c) for c in chunks[1:]))
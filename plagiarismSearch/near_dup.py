@@ -0,0 +1,274 @@
+"""
+Local near-duplicate pre-screening for /check and /storage/create.
+
+Every text that passes through the proxy is reduced to a MinHash signature of
+its word shingles and stored in SQLite together with LSH band buckets. A query
+is one indexed bucket lookup plus a signature comparison for the handful of
+candidates, so it answers in milliseconds without calling PlagiarismSearch.
+Signatures are packed uint32 arrays (512 bytes per document); nothing is held
+in memory between queries.
+
+Bulk indexing of an existing corpus runs in a process pool:
+
+    python near_dup.py build corpus/ other.txt --workers 4
+"""
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Optional
+import argparse
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+from fastapi import UploadFile
+
+import datastore
+from dedup import normalize_text
+
+ENABLED = os.getenv("NEAR_DUP_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.5"))
+MAX_CANDIDATES = int(os.getenv("NEAR_DUP_MAX_CANDIDATES", "10"))
+MAX_TEXT_BYTES = int(os.getenv("NEAR_DUP_MAX_TEXT_BYTES", str(4 * 1024 * 1024)))
+BUILD_WORKERS = int(os.getenv("NEAR_DUP_BUILD_WORKERS", str(os.cpu_count() or 2)))
+
+SHINGLE_WORDS = 5
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+
+# Files the index can read as plain text (bulk build and uploads).
+TEXT_EXTENSIONS = (".txt", ".md", ".tex", ".csv")
+
+_MASK32 = (1 << 32) - 1
+_EMPTY = _MASK32 + 1
+# Offset added per hop when an empty bin borrows a neighbour's value (densification).
+_ROTATION = 0x9E3779B1
+_WORD = re.compile(r"\w+")
+
+
+def content_key(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode()).hexdigest()
+
+
+def shingles(text: str) -> set:
+    """64-bit hashes of the lower-cased word 5-grams of a text."""
+    words = _WORD.findall(normalize_text(text).lower())
+    if len(words) < SHINGLE_WORDS:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = (" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1))
+    return {int.from_bytes(hashlib.blake2b(g.encode(), digest_size=8).digest(), "little") for g in grams}
+
+
+def signature(hashes: set) -> array:
+    """
+    One-permutation MinHash signature.
+
+    Each shingle hash goes to one of NUM_PERM bins by its low bits and each bin
+    keeps its minimum, so a signature costs one pass over the shingles instead
+    of NUM_PERM. Empty bins borrow from the next non-empty bin to the right
+    (rotation densification), which keeps short texts comparable.
+    """
+    if not hashes:
+        return array("I", [_MASK32] * NUM_PERM)
+    bins = [_EMPTY] * NUM_PERM
+    for h in hashes:
+        slot = h % NUM_PERM
+        value = (h // NUM_PERM) & _MASK32
+        if value < bins[slot]:
+            bins[slot] = value
+    sig = array("I")
+    for slot in range(NUM_PERM):
+        hop = 0
+        while bins[(slot + hop) % NUM_PERM] == _EMPTY:
+            hop += 1
+        sig.append((bins[(slot + hop) % NUM_PERM] + hop * _ROTATION) & _MASK32)
+    return sig
+
+
+def bands(sig: array) -> list:
+    """One LSH bucket id per band, as a signed 64-bit integer for SQLite."""
+    buckets = []
+    for band in range(BANDS):
+        rows = sig[band * ROWS:(band + 1) * ROWS].tobytes()
+        digest = hashlib.blake2b(band.to_bytes(2, "little") + rows, digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, "little", signed=True))
+    return buckets
+
+
+def similarity(a: array, b: array) -> float:
+    """Estimated Jaccard similarity of the two shingle sets."""
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+
+def fingerprint(text: str) -> tuple:
+    """(content key, shingle count, signature bytes); CPU-bound, run it off the event loop."""
+    hashes = shingles(text)
+    return content_key(text), len(hashes), signature(hashes).tobytes()
+
+
+def _fingerprint_file(path: str) -> Optional[tuple]:
+    """Process-pool entry point for bulk builds."""
+    try:
+        with open(path, "rb") as f:
+            text = f.read(MAX_TEXT_BYTES).decode("utf-8", errors="replace")
+    except OSError:
+        return None
+    if not text.strip():
+        return None
+    return (path, os.path.basename(path)) + fingerprint(text)
+
+
+class NearDupIndex:
+    def __init__(self, db_name: str = "near_dup.sqlite3"):
+        self._db = datastore.connect(db_name)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " doc_id INTEGER PRIMARY KEY, content_key TEXT NOT NULL UNIQUE, source TEXT NOT NULL,"
+            " title TEXT, report_id INTEGER, storage_id INTEGER, shingles INTEGER NOT NULL,"
+            " signature BLOB NOT NULL, created REAL NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS buckets (bucket INTEGER NOT NULL, doc_id INTEGER NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS buckets_bucket ON buckets (bucket)")
+        self.queries = 0
+        self.indexed = 0
+        self.query_seconds_total = 0.0
+
+    def add(self, key: str, shingle_count: int, sig: bytes, source: str, title: Optional[str] = None,
+            report_id: Optional[int] = None, storage_id: Optional[int] = None) -> int:
+        """Insert a document, or fill in the report/storage id of one already indexed."""
+        doc_id = self.link(key, report_id=report_id, storage_id=storage_id)
+        if doc_id is not None:
+            return doc_id
+        self._db.execute("BEGIN")
+        try:
+            doc_id = self._db.execute(
+                "INSERT INTO documents (content_key, source, title, report_id, storage_id, shingles, signature, created)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, source, title, report_id, storage_id, shingle_count, sig, time.time()),
+            ).lastrowid
+            buckets = bands(array("I", sig))
+            self._db.executemany("INSERT INTO buckets (bucket, doc_id) VALUES (?, ?)",
+                                 [(bucket, doc_id) for bucket in buckets])
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self.indexed += 1
+        return doc_id
+
+    def link(self, key: str, report_id: Optional[int] = None, storage_id: Optional[int] = None) -> Optional[int]:
+        """Fill in the report/storage id of an indexed document; None when the key is not indexed."""
+        row = self._db.execute("SELECT doc_id FROM documents WHERE content_key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._db.execute(
+            "UPDATE documents SET report_id = COALESCE(?, report_id), storage_id = COALESCE(?, storage_id)"
+            " WHERE doc_id = ?", (report_id, storage_id, row[0]),
+        )
+        return row[0]
+
+    def query(self, key: str, sig: bytes, threshold: float = THRESHOLD, limit: int = MAX_CANDIDATES) -> list:
+        """Indexed documents whose estimated similarity is at least `threshold`, best first."""
+        started = time.perf_counter()
+        target = array("I", sig)
+        buckets = bands(target)
+        rows = self._db.execute(
+            "SELECT d.doc_id, d.content_key, d.source, d.title, d.report_id, d.storage_id, d.signature"
+            " FROM documents d JOIN (SELECT DISTINCT doc_id FROM buckets WHERE bucket IN (%s)) b"
+            " ON b.doc_id = d.doc_id" % ",".join("?" * len(buckets)), buckets,
+        ).fetchall()
+        candidates = []
+        for doc_id, doc_key, source, title, report_id, storage_id, doc_sig in rows:
+            score = 1.0 if doc_key == key else similarity(target, array("I", doc_sig))
+            if score >= threshold:
+                candidates.append({"doc_id": doc_id, "similarity": round(score, 3), "exact": doc_key == key,
+                                   "source": source, "title": title, "report_id": report_id,
+                                   "storage_id": storage_id})
+        candidates.sort(key=lambda c: c["similarity"], reverse=True)
+        self.queries += 1
+        self.query_seconds_total += time.perf_counter() - started
+        return candidates[:limit]
+
+    def build(self, paths: Iterable[str], workers: int = BUILD_WORKERS, source: str = "bulk") -> dict:
+        """Fingerprint text files in a process pool and index them; blocking, for the CLI."""
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                for root, _, names in os.walk(path):
+                    files.extend(os.path.join(root, n) for n in sorted(names) if n.lower().endswith(TEXT_EXTENSIONS))
+            else:
+                files.append(path)
+        added = skipped = 0
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            for result in pool.map(_fingerprint_file, files, chunksize=16):
+                if result is None:
+                    skipped += 1
+                    continue
+                _, title, key, shingle_count, sig = result
+                self.add(key, shingle_count, sig, source, title=title)
+                added += 1
+        return {"files": len(files), "indexed": added, "skipped": skipped,
+                "seconds": round(time.perf_counter() - started, 3)}
+
+    def stats(self) -> dict:
+        documents = self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        return {
+            "enabled": ENABLED,
+            "documents": documents,
+            "threshold": THRESHOLD,
+            "num_perm": NUM_PERM,
+            "bands": BANDS,
+            "indexed": self.indexed,
+            "queries": self.queries,
+            "query_ms_avg": round(self.query_seconds_total / self.queries * 1000, 3) if self.queries else None,
+        }
+
+
+async def upload_text(upload: UploadFile) -> Optional[str]:
+    """Text of a plain-text upload (first MAX_TEXT_BYTES), or None for other document types."""
+    name = (upload.filename or "").lower()
+    if not ((upload.content_type or "").startswith("text/plain") or name.endswith(TEXT_EXTENSIONS)):
+        return None
+    await upload.seek(0)
+    data = await upload.read(MAX_TEXT_BYTES)
+    await upload.seek(0)
+    return data.decode("utf-8", errors="replace")
+
+
+async def screen(text: str, threshold: float = THRESHOLD) -> tuple:
+    """Fingerprint a text off the event loop and query the index; returns (fingerprint, candidates)."""
+    fp = await asyncio.to_thread(fingerprint, text)
+    return fp, index.query(fp[0], fp[2], threshold=threshold)
+
+
+def remember(fp: tuple, source: str, title: Optional[str] = None, result=None, storage: bool = False):
+    """Index a fingerprinted document, linking it to the upstream id in `result` when there is one."""
+    data = result.get("data") if isinstance(result, dict) else None
+    upstream_id = data.get("id") if isinstance(data, dict) else None
+    key, shingle_count, sig = fp
+    index.add(key, shingle_count, sig, source, title=title,
+              report_id=None if storage else upstream_id, storage_id=upstream_id if storage else None)
+
+
+index = NearDupIndex()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-build the local near-duplicate index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="index text files and directories")
+    build.add_argument("paths", nargs="+")
+    build.add_argument("--workers", type=int, default=BUILD_WORKERS)
+    args = parser.parse_args(argv)
+    print(index.build(args.paths, workers=args.workers))
+    print(index.stats())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
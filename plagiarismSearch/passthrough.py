@@ -0,0 +1,205 @@
+"""
+Raw upstream bodies for the report endpoints.
+
+Report, sources and HTML payloads can be megabytes of JSON. Instead of decoding
+them into dicts and letting FastAPI encode them again, the proxy keeps the bytes
+exactly as PlagiarismSearch sent them (gzip-encoded when upstream compressed the
+transfer) and hands them to the client with the upstream content type. Only the
+code that needs to look inside a body (terminal-status checks, PDF rendering,
+status polling) decodes it, with orjson when it is installed.
+
+Every body carries a strong ETag derived from a hash of its identity bytes, so
+a client that sends the tag back in If-None-Match gets an empty 304. Bodies are
+sent brotli-compressed when the client accepts br and the brotli package is
+installed, gzip-compressed otherwise; cached reports keep both compressed forms
+so a hit never compresses anything again.
+"""
+from typing import Optional
+import gzip
+import hashlib
+import json
+import os
+
+from fastapi import Request, Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Identity bodies smaller than this are sent uncompressed.
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+JSON_MEDIA_TYPE = "application/json"
+GZIP = "gzip"
+BR = "br"
+GZIP_LEVEL = 6
+
+
+def loads(data):
+    """Decode JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> bytes:
+    """Encode JSON to UTF-8 bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def accepted_encodings(request: Request) -> set:
+    """Content codings the client accepts (q > 0), lower-cased; "*" is kept as-is."""
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").lower().split(","):
+        coding, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        try:
+            if params.startswith("q=") and float(params[2:]) <= 0:
+                continue
+        except ValueError:
+            pass
+        if coding.strip():
+            accepted.add(coding.strip())
+    return accepted
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    """
+    Weak If-None-Match comparison against `etag` (the bare hash). Tags sent
+    for any content coding of the same body match, since the content is equal.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        tag = tag.removeprefix("W/").strip('"')
+        if tag.split("-", 1)[0] == etag:
+            return True
+    return False
+
+
+class Body:
+    """
+    A JSON body as received from upstream: `data` is gzip-compressed when
+    `encoding` is "gzip". Cached bodies may also carry their brotli form in
+    `br`; `etag` is filled in the first time it is needed.
+    """
+
+    __slots__ = ("data", "encoding", "media_type", "etag", "br")
+
+    def __init__(self, data: bytes, encoding: Optional[str] = None, media_type: str = JSON_MEDIA_TYPE,
+                 etag: Optional[str] = None, br: Optional[bytes] = None):
+        self.data = data
+        self.encoding = encoding
+        self.media_type = media_type
+        self.etag = etag
+        self.br = br
+
+    def raw(self) -> bytes:
+        """The identity-encoded bytes."""
+        if self.encoding == GZIP:
+            return gzip.decompress(self.data)
+        return self.data
+
+    def json(self):
+        """Decode the payload; only for callers that need to look inside it."""
+        return loads(self.raw())
+
+    def digest(self) -> str:
+        """Content hash of the identity bytes, computed once per Body."""
+        if self.etag is None:
+            self.etag = content_hash(self.raw())
+        return self.etag
+
+    @property
+    def size(self) -> int:
+        """Bytes held by this body, all stored encodings included."""
+        return len(self.data) + len(self.br or b"")
+
+    def prepared(self) -> "Body":
+        """
+        The form kept by the report cache: gzip-encoded, with its ETag and,
+        when brotli is installed and the body is large enough, its brotli form.
+        """
+        raw = self.raw()
+        data = self.data if self.encoding == GZIP else gzip.compress(raw, GZIP_LEVEL)
+        br = None
+        if brotli is not None and len(raw) >= COMPRESS_MIN_BYTES:
+            br = brotli.compress(raw, quality=BROTLI_QUALITY)
+        return Body(data, GZIP, self.media_type, etag=self.etag or content_hash(raw), br=br)
+
+    @classmethod
+    def stored(cls, data: bytes, media_type: str = JSON_MEDIA_TYPE, etag: Optional[str] = None,
+               br: Optional[bytes] = None) -> "Body":
+        """A body read back from the report cache, which stores gzip bytes."""
+        return cls(data, GZIP, media_type, etag=etag, br=br)
+
+
+def compose(members: dict) -> Body:
+    """A JSON object whose Body members are spliced in as raw bytes instead of being decoded."""
+    parts = []
+    for name, value in members.items():
+        raw = value.raw() if isinstance(value, Body) else dumps(value)
+        parts.append(dumps(name) + b":" + raw)
+    return Body(b"{" + b",".join(parts) + b"}")
+
+
+def _coding(body: Body, accepted: set) -> Optional[str]:
+    """
+    The content coding to send. Stored forms are preferred, so cached bodies
+    are never compressed again; an identity body is compressed only when it is
+    at least COMPRESS_MIN_BYTES long.
+    """
+    wants_br = BR in accepted or "*" in accepted
+    wants_gzip = GZIP in accepted or "*" in accepted
+    if body.br is not None and wants_br:
+        return BR
+    if body.encoding == GZIP:
+        return GZIP if wants_gzip else None
+    if len(body.data) < COMPRESS_MIN_BYTES:
+        return None
+    if wants_br and brotli is not None:
+        return BR
+    return GZIP if wants_gzip else None
+
+
+def _content(body: Body, coding: Optional[str]) -> bytes:
+    if coding == BR:
+        return body.br if body.br is not None else brotli.compress(body.raw(), quality=BROTLI_QUALITY)
+    if coding == GZIP:
+        return body.data if body.encoding == GZIP else gzip.compress(body.data, GZIP_LEVEL)
+    return body.raw()
+
+
+def respond(request: Request, body: Body, headers: Optional[dict] = None) -> Response:
+    """
+    Send a Body with its ETag, in the best content coding the client accepts,
+    or an empty 304 when the client already holds it.
+    """
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+    etag = body.digest()
+    coding = _coding(body, accepted_encodings(request))
+    # Each coding is a different representation, so it gets its own strong tag.
+    headers["ETag"] = f'"{etag}-{coding}"' if coding else f'"{etag}"'
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    if coding:
+        headers["Content-Encoding"] = coding
+    return Response(content=_content(body, coding), media_type=body.media_type, headers=headers)
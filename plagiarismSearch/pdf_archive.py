@@ -0,0 +1,123 @@
+"""
+Streaming ZIP archives of report PDFs for GET /reports/pdf/archive.
+
+Up to ARCHIVE_CONCURRENCY reports are fetched and rendered at once (through the
+PDF renderer, so PDFs already in the PDF cache are reused) and each PDF is
+written into the archive as soon as it is ready, in completion order. The
+archive is produced on the fly: only the chunk being copied is held in memory,
+never the archive or a whole PDF. Reports that fail to render are listed in a
+final errors.json entry instead of failing the download.
+"""
+from typing import AsyncIterator, Awaitable, Callable, List
+import asyncio
+import os
+import time
+import zipfile
+
+from fastapi import HTTPException
+
+import passthrough
+
+CONCURRENCY = int(os.getenv("ARCHIVE_CONCURRENCY", "4"))
+MAX_REPORTS = int(os.getenv("ARCHIVE_MAX_REPORTS", "500"))
+CHUNK_SIZE = 256 * 1024
+
+MEDIA_TYPE = "application/zip"
+ERRORS_ENTRY = "errors.json"
+
+stats = {"archives": 0, "entries": 0, "failures": 0, "bytes": 0}
+
+
+class _Sink:
+    """Write-only stream for ZipFile; the archive generator drains it after every write."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        stats["bytes"] += len(data)
+        return data
+
+
+def entry_name(report_id: int) -> str:
+    return f"report_{report_id}.pdf"
+
+
+def _entry(name: str) -> zipfile.ZipInfo:
+    # PDFs are already compressed; storing them keeps the archive cheap to produce.
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    return info
+
+
+async def _render(render: Callable[[int], Awaitable[str]], report_id: int):
+    """(report_id, path, None) or (report_id, None, error detail)."""
+    try:
+        return report_id, await render(report_id), None
+    except HTTPException as e:
+        return report_id, None, e.detail
+    except Exception as e:
+        return report_id, None, f"{e.__class__.__name__}: {e}"
+
+
+async def stream(ids: List[int], render: Callable[[int], Awaitable[str]],
+                 concurrency: int = CONCURRENCY) -> AsyncIterator[bytes]:
+    """ZIP bytes holding the PDF of every report in `ids`; `render` returns a PDF path."""
+    stats["archives"] += 1
+    sink = _Sink()
+    archive = zipfile.ZipFile(sink, "w")
+    queued = iter(ids)
+    pending = set()
+    errors = {}
+    try:
+        for report_id in queued:
+            pending.add(asyncio.ensure_future(_render(render, report_id)))
+            if len(pending) >= concurrency:
+                break
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for report_id in queued:
+                pending.add(asyncio.ensure_future(_render(render, report_id)))
+                if len(pending) >= concurrency:
+                    break
+            for task in done:
+                report_id, path, error = task.result()
+                if error is None:
+                    try:
+                        pdf = open(path, "rb")
+                    except OSError as e:
+                        # Trimmed from the PDF cache since it was rendered.
+                        error = str(e)
+                if error is not None:
+                    stats["failures"] += 1
+                    errors[str(report_id)] = error
+                    continue
+                with pdf, archive.open(_entry(entry_name(report_id)), "w") as out:
+                    while chunk := pdf.read(CHUNK_SIZE):
+                        out.write(chunk)
+                        if data := sink.drain():
+                            yield data
+                stats["entries"] += 1
+                if data := sink.drain():
+                    yield data
+        if errors:
+            archive.writestr(_entry(ERRORS_ENTRY), passthrough.dumps(errors))
+        archive.close()
+        yield sink.drain()
+    finally:
+        for task in pending:
+            task.cancel()
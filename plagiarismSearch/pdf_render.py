@@ -0,0 +1,156 @@
+"""
+Off-loop PDF rendering for /report/pdf/{id}.
+
+WeasyPrint runs in a bounded process pool so a render never blocks the event
+loop. Finished PDFs are cached on disk under a name derived from the report id
+and a hash of the HTML, so repeat downloads are served as plain files without
+rendering again. WeasyPrint is only ever imported inside the worker processes,
+which keeps it out of the server's startup time.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import asyncio
+import hashlib
+import importlib.util
+import multiprocessing
+import os
+import time
+
+from fastapi import HTTPException
+
+import datastore
+import metrics
+from upstream import SingleFlight
+
+WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "2"))
+MAX_QUEUE = int(os.getenv("PDF_RENDER_QUEUE", "16"))
+CACHE_MAX_FILES = int(os.getenv("PDF_CACHE_MAX_FILES", "500"))
+RETRY_AFTER_SECONDS = 10
+
+# Checked without importing it.
+AVAILABLE = importlib.util.find_spec("weasyprint") is not None
+
+PDF_STYLE = '''<style>body { font-family: Arial, sans-serif; margin: 2em; color: #222; } .ps-rb-ai { background: #ffe4b2; } .rb-r { background: #ffb3b3; } .rb-y { background: #fff7b2; } .rb-p { background: #b2e0ff; } .ps-rb-ai { background: #e6e6ff; } .status--10 .rp, .status--11 .rp { background: #e0e0e0; } .report-section { margin-bottom: 2em; padding: 1em; border-radius: 8px; background: #fff; box-shadow: 0 2px 8px #0001; } a { color: #2980b9; }</style>'''
+
+
+def report_html(html_content: str) -> str:
+    """Wrap an upstream HTML report with the default PDF styling."""
+    return f"<html><head>{PDF_STYLE}</head><body>{html_content}</body></html>"
+
+
+def _render(html_full: str, path: str) -> float:
+    """Worker-process entry point: render to a temp file, then move it into place."""
+    from weasyprint import HTML
+
+    started = time.perf_counter()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    HTML(string=html_full).write_pdf(tmp_path)
+    os.replace(tmp_path, path)
+    return time.perf_counter() - started
+
+
+class PdfRenderer:
+    def __init__(self, workers: int = WORKERS, max_queue: int = MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._flights = SingleFlight()
+        self.waiting = 0
+        self.rendering = 0
+        self.renders = 0
+        self.failures = 0
+        self.rejected = 0
+        self.cache_hits = 0
+        self.render_seconds_total = 0.0
+        self.render_seconds_max = 0.0
+        self.render_seconds_last = None
+
+    def cache_path(self, report_id: int, html_full: str) -> str:
+        digest = hashlib.sha256(html_full.encode()).hexdigest()[:32]
+        directory = datastore.data_path("pdf")
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"report_{report_id}_{digest}.pdf")
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn keeps the workers free of the event loop's threads and sockets.
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+            self._slots = asyncio.Semaphore(self.workers)
+        return self._pool
+
+    async def _render_to(self, html_full: str, path: str):
+        pool = self._executor()
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="PDF render queue is full, retry shortly.",
+                                headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.rendering += 1
+        try:
+            seconds = await asyncio.get_running_loop().run_in_executor(pool, _render, html_full, path)
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self.rendering -= 1
+            self._slots.release()
+        self.renders += 1
+        self.render_seconds_total += seconds
+        self.render_seconds_max = max(self.render_seconds_max, seconds)
+        self.render_seconds_last = seconds
+        metrics.PDF_RENDER_SECONDS.observe(seconds)
+        self._trim_cache(os.path.dirname(path))
+
+    def _trim_cache(self, directory: str):
+        entries = [e for e in os.scandir(directory) if e.name.endswith(".pdf")]
+        if len(entries) <= CACHE_MAX_FILES:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:len(entries) - CACHE_MAX_FILES]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    async def render(self, report_id: int, html_content: str) -> str:
+        """Return the path of the rendered PDF, rendering it only if not cached."""
+        html_full = report_html(html_content)
+        path = self.cache_path(report_id, html_full)
+        if os.path.exists(path):
+            self.cache_hits += 1
+            os.utime(path)
+            return path
+        await self._flights.do(path, lambda: self._render_to(html_full, path))
+        return path
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queue_depth": self.waiting,
+            "rendering": self.rendering,
+            "renders": self.renders,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "cache_hits": self.cache_hits,
+            "render_seconds": {
+                "total": round(self.render_seconds_total, 3),
+                "avg": round(self.render_seconds_total / self.renders, 3) if self.renders else None,
+                "max": round(self.render_seconds_max, 3),
+                "last": round(self.render_seconds_last, 3) if self.render_seconds_last is not None else None,
+            },
+        }
+
+
+renderer = PdfRenderer()
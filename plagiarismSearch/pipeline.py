@@ -0,0 +1,94 @@
+"""
+Combined plagiarism + AI-detection checks for /pipeline.
+
+One upload creates a plagiarism report and an AI report concurrently. The pair
+of upstream ids is stored in SQLite under a local pipeline id, so status,
+progress and the final reports can be asked for together.
+"""
+from typing import Optional
+import time
+import uuid
+
+import datastore
+from report_cache import is_terminal_status
+
+REPORT = "report"
+AI_REPORT = "ai_report"
+PARTS = (REPORT, AI_REPORT)
+
+
+class PipelineStore:
+    def __init__(self, db_name: str = "pipelines.sqlite3"):
+        self._db = datastore.connect(db_name)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pipelines ("
+            " pipeline_id TEXT PRIMARY KEY, created REAL NOT NULL, title TEXT,"
+            " report_id INTEGER, ai_report_id INTEGER, report_error TEXT, ai_report_error TEXT)"
+        )
+        self.created = 0
+
+    def create(self, title: Optional[str], ids: dict, errors: dict) -> str:
+        pipeline_id = uuid.uuid4().hex
+        self._db.execute(
+            "INSERT INTO pipelines (pipeline_id, created, title, report_id, ai_report_id, report_error, ai_report_error)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (pipeline_id, time.time(), title, ids.get(REPORT), ids.get(AI_REPORT),
+             errors.get(REPORT), errors.get(AI_REPORT)),
+        )
+        self.created += 1
+        return pipeline_id
+
+    def get(self, pipeline_id: str) -> Optional[dict]:
+        row = self._db.execute(
+            "SELECT created, title, report_id, ai_report_id, report_error, ai_report_error FROM pipelines"
+            " WHERE pipeline_id = ?", (pipeline_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "pipeline_id": pipeline_id,
+            "created": row[0],
+            "title": row[1],
+            "ids": {REPORT: row[2], AI_REPORT: row[3]},
+            "errors": {REPORT: row[4], AI_REPORT: row[5]},
+        }
+
+
+def upstream_id(result) -> Optional[int]:
+    data = result.get("data") if isinstance(result, dict) else None
+    return data.get("id") if isinstance(data, dict) else None
+
+
+def summary(pipeline: dict, statuses: dict) -> dict:
+    """
+    Merge the two status responses. A part that failed to submit counts as
+    finished, so `done` means nothing is left to wait for.
+    """
+    parts = {}
+    progress = []
+    for part in PARTS:
+        if pipeline["ids"][part] is None:
+            parts[part] = {"report_id": None, "error": pipeline["errors"][part], "done": True}
+            continue
+        payload = statuses.get(part)
+        if not isinstance(payload, dict):
+            # The status could not be fetched; `payload` is the error detail.
+            parts[part] = {"report_id": pipeline["ids"][part], "status_error": payload, "done": False}
+            progress.append(0.0)
+            continue
+        data = payload.get("data") or {}
+        terminal = is_terminal_status(data.get("status"))
+        parts[part] = {"report_id": pipeline["ids"][part], "status": data.get("status"),
+                       "progress": 1.0 if terminal else data.get("progress"), "done": terminal}
+        progress.append(1.0 if terminal else (data.get("progress") or 0.0))
+    done = all(p["done"] for p in parts.values())
+    return {
+        "pipeline_id": pipeline["pipeline_id"],
+        "title": pipeline["title"],
+        "done": done,
+        "progress": round(sum(progress) / len(progress), 4) if progress else None,
+        **parts,
+    }
+
+
+store = PipelineStore()
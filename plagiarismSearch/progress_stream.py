@@ -0,0 +1,219 @@
+"""
+Push-based report progress for /progress/{id}/stream.
+
+Every subscriber to a report id shares one background poller, so upstream
+status calls scale with the number of reports being watched rather than the
+number of open browser tabs. The poller backs off while nothing changes and
+stops once the report is finished or the last subscriber leaves. Webhook
+updates are published straight to subscribers. If the poller fails, every
+subscriber gets an `error` event and its stream ends.
+"""
+from typing import Awaitable, Callable, Optional
+import asyncio
+import json
+import logging
+import os
+
+from fastapi import HTTPException
+import httpx
+
+from report_cache import is_terminal_status
+import scheduler
+
+MIN_INTERVAL = float(os.getenv("PROGRESS_POLL_MIN_SECONDS", "2"))
+MAX_INTERVAL = float(os.getenv("PROGRESS_POLL_MAX_SECONDS", "30"))
+BACKOFF = float(os.getenv("PROGRESS_POLL_BACKOFF", "1.5"))
+HEARTBEAT_SECONDS = float(os.getenv("PROGRESS_HEARTBEAT_SECONDS", "15"))
+
+logger = logging.getLogger(__name__)
+
+
+def _fingerprint(payload) -> tuple:
+    data = payload.get("data") if isinstance(payload, dict) else None
+    if not isinstance(data, dict):
+        return (None, None)
+    return (data.get("status"), data.get("progress"))
+
+
+def _terminal(payload) -> bool:
+    return is_terminal_status(_fingerprint(payload)[0])
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class ProgressHub:
+    def __init__(self, fetch: Callable[[int], Awaitable[dict]], min_interval: float = MIN_INTERVAL,
+                 max_interval: float = MAX_INTERVAL, backoff: float = BACKOFF):
+        self.fetch = fetch
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self._subscribers: dict = {}
+        self._pollers: dict = {}
+        self._last: dict = {}
+        self.polls = 0
+        self.events_sent = 0
+        self.poller_errors = 0
+
+    def subscribe(self, report_id: int) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(report_id, set()).add(queue)
+        last = self._last.get(report_id)
+        if last is not None:
+            queue.put_nowait(("status", last))
+            if _terminal(last):
+                return queue
+        if report_id not in self._pollers:
+            self._pollers[report_id] = asyncio.create_task(self._poll(report_id))
+        return queue
+
+    def unsubscribe(self, report_id: int, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(report_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[report_id]
+            self._last.pop(report_id, None)
+            poller = self._pollers.pop(report_id, None)
+            if poller is not None:
+                poller.cancel()
+
+    def _send(self, report_id: int, event: str, payload):
+        for queue in self._subscribers.get(report_id, ()):
+            queue.put_nowait((event, payload))
+            self.events_sent += 1
+
+    def _fail(self, report_id: int, error: dict):
+        """Send a final error event and detach the report's subscribers, ending their streams."""
+        self._send(report_id, "error", error)
+        self._subscribers.pop(report_id, None)
+        self._last.pop(report_id, None)
+
+    def publish(self, report_id: int, payload: dict) -> bool:
+        """Forward a status to subscribers if it changed; returns whether it did."""
+        last = self._last.get(report_id)
+        if last is not None and _fingerprint(last) == _fingerprint(payload):
+            return False
+        if report_id not in self._subscribers:
+            return False
+        self._last[report_id] = payload
+        self._send(report_id, "status", payload)
+        return True
+
+    async def _poll(self, report_id: int):
+        # Shared by every subscriber, so not scheduled as the request that started it.
+        scheduler.run_as_system()
+        interval = self.min_interval
+        try:
+            while report_id in self._subscribers:
+                try:
+                    payload = await self.fetch(report_id)
+                    self.polls += 1
+                except HTTPException as e:
+                    # Client errors (unknown report, bad auth) will not fix themselves.
+                    if 400 <= e.status_code < 500 and e.status_code != 429:
+                        self._fail(report_id, {"status_code": e.status_code, "detail": e.detail})
+                        return
+                    interval = min(interval * self.backoff, self.max_interval)
+                except httpx.TransportError:
+                    interval = min(interval * self.backoff, self.max_interval)
+                except Exception as e:
+                    # An unexpected payload or a bug: without this the streams would only ever see keep-alives.
+                    self.poller_errors += 1
+                    logger.exception("Progress poller for report %s failed", report_id)
+                    self._fail(report_id, {"status_code": 502, "detail": f"Status polling failed: {e.__class__.__name__}"})
+                    return
+                else:
+                    if self.publish(report_id, payload):
+                        interval = self.min_interval
+                    else:
+                        interval = min(interval * self.backoff, self.max_interval)
+                    if _terminal(payload):
+                        return
+                await asyncio.sleep(interval)
+        finally:
+            if self._pollers.get(report_id) is asyncio.current_task():
+                del self._pollers[report_id]
+
+    async def close(self):
+        pollers = list(self._pollers.values())
+        for poller in pollers:
+            poller.cancel()
+        await asyncio.gather(*pollers, return_exceptions=True)
+        self._pollers.clear()
+
+    def stats(self) -> dict:
+        return {
+            "reports": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "pollers": len(self._pollers),
+            "polls": self.polls,
+            "events_sent": self.events_sent,
+            "poller_errors": self.poller_errors,
+            "min_interval": self.min_interval,
+            "max_interval": self.max_interval,
+        }
+
+
+async def stream(hub: ProgressHub, report_id: int, is_disconnected: Callable[[], Awaitable[bool]],
+                 heartbeat: Optional[float] = None):
+    """SSE body generator: status events until the report finishes or the client leaves."""
+    heartbeat = HEARTBEAT_SECONDS if heartbeat is None else heartbeat
+    queue = hub.subscribe(report_id)
+    try:
+        while True:
+            try:
+                event, payload = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            yield sse_event(event, payload)
+            if event == "error" or (event == "status" and _terminal(payload)):
+                yield sse_event("end", {"report_id": report_id})
+                return
+    finally:
+        hub.unsubscribe(report_id, queue)
+
+
+async def stream_many(parts: dict, is_disconnected: Callable[[], Awaitable[bool]],
+                      heartbeat: Optional[float] = None):
+    """
+    SSE body generator for several reports at once; `parts` maps a name to
+    (hub, report_id). Status events carry {"part", "report_id", "status"} and
+    the stream ends once every part is finished or has failed.
+    """
+    heartbeat = HEARTBEAT_SECONDS if heartbeat is None else heartbeat
+    merged: asyncio.Queue = asyncio.Queue()
+    subscriptions = {name: (hub, report_id, hub.subscribe(report_id)) for name, (hub, report_id) in parts.items()}
+
+    async def forward(name: str, queue: asyncio.Queue):
+        while True:
+            merged.put_nowait((name, *await queue.get()))
+
+    forwarders = [asyncio.create_task(forward(name, queue)) for name, (_, _, queue) in subscriptions.items()]
+    pending = set(parts)
+    try:
+        while pending:
+            try:
+                name, event, payload = await asyncio.wait_for(merged.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            report_id = subscriptions[name][1]
+            yield sse_event(event, {"part": name, "report_id": report_id,
+                                    ("status" if event == "status" else "error"): payload})
+            if event == "error" or (event == "status" and _terminal(payload)):
+                pending.discard(name)
+        yield sse_event("end", {name: report_id for name, (_, report_id, _) in subscriptions.items()})
+    finally:
+        for task in forwarders:
+            task.cancel()
+        for hub, report_id, queue in subscriptions.values():
+            hub.unsubscribe(report_id, queue)
@@ -0,0 +1,160 @@
+"""
+Field projection and source paging for report payloads.
+
+`fields=id,status,plagiarism,sources.url` keeps only the listed members of the
+report's `data` object (a dotted name keeps that member of every list item), and
+`sources_offset`/`sources_limit` keep one window of `data.sources`, adding
+`data.sources_total`. The envelope (`status`, `code`, ...) is always kept.
+
+With ijson installed the body is parsed incrementally from its gzip bytes, so
+only the projected part is ever built in memory, however large the report.
+Without it the body is decoded in one go and projected the same way.
+"""
+from typing import Iterator, Optional
+import gzip
+import io
+
+import passthrough
+from passthrough import Body
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+ROOT = "data"
+SOURCES = "sources"
+
+# select() decisions.
+ALL = "all"
+PART = "part"
+NONE = "none"
+
+stats = {"projections": 0, "incremental": 0}
+
+
+def parse_fields(fields: Optional[str]) -> Optional[set]:
+    """`fields=` as a set of dotted names, or None when everything is wanted."""
+    names = {name.strip() for name in (fields or "").split(",") if name.strip()}
+    return names or None
+
+
+def _events(body: Body) -> Iterator[tuple]:
+    """(event, value) pairs in ijson's vocabulary, scalars reported as ("value", v)."""
+    if ijson is None:
+        yield from _walk(body.json())
+        return
+    stats["incremental"] += 1
+    stream = io.BytesIO(body.data)
+    if body.encoding == passthrough.GZIP:
+        stream = gzip.GzipFile(fileobj=stream)
+    for _, event, value in ijson.parse(stream, use_float=True):
+        if event in ("start_map", "end_map", "start_array", "end_array", "map_key"):
+            yield event, value
+        else:
+            yield "value", value
+
+
+def _walk(obj) -> Iterator[tuple]:
+    if isinstance(obj, dict):
+        yield "start_map", None
+        for key, value in obj.items():
+            yield "map_key", key
+            yield from _walk(value)
+        yield "end_map", None
+    elif isinstance(obj, list):
+        yield "start_array", None
+        for value in obj:
+            yield from _walk(value)
+        yield "end_array", None
+    else:
+        yield "value", obj
+
+
+def _skip(events: Iterator[tuple], event: str):
+    """Consume the rest of a value that starts with `event`."""
+    if event not in ("start_map", "start_array"):
+        return
+    depth = 1
+    for event, _ in events:
+        if event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+            if depth == 0:
+                return
+
+
+class _Projector:
+    def __init__(self, fields: Optional[set], sources_offset: int, sources_limit: Optional[int]):
+        self.wanted = None if fields is None else {f"{ROOT}.{name}" for name in fields}
+        self.window = None
+        if sources_offset or sources_limit is not None:
+            end = None if sources_limit is None else sources_offset + sources_limit
+            self.window = (sources_offset, end)
+
+    def select(self, path: str) -> str:
+        if self.wanted is None or ("." not in path and path != ROOT):
+            return ALL
+        if any(path == name or path.startswith(name + ".") for name in self.wanted):
+            return ALL
+        if any(name.startswith(path + ".") for name in self.wanted):
+            return PART
+        return NONE
+
+    def value(self, events: Iterator[tuple], event: str, value, path: str, whole: bool):
+        if event == "start_map":
+            obj = {}
+            for event, key in events:
+                if event == "end_map":
+                    return obj
+                child = f"{path}.{key}" if path else key
+                event, value = next(events)
+                decision = ALL if whole else self.select(child)
+                if decision == NONE:
+                    _skip(events, event)
+                    continue
+                if child == f"{ROOT}.{SOURCES}" and self.window is not None and event == "start_array":
+                    obj[key], obj[f"{SOURCES}_total"] = self.window_of(events, child, decision == ALL)
+                else:
+                    obj[key] = self.value(events, event, value, child, decision == ALL)
+            return obj
+        if event == "start_array":
+            items = []
+            for event, value in events:
+                if event == "end_array":
+                    return items
+                # List items share their list's path, so `sources.url` reaches every source.
+                items.append(self.value(events, event, value, path, whole))
+            return items
+        return value
+
+    def window_of(self, events: Iterator[tuple], path: str, whole: bool) -> tuple:
+        """The items of an array inside the window, and the array's length."""
+        start, end = self.window
+        items = []
+        index = 0
+        for event, value in events:
+            if event == "end_array":
+                break
+            if index >= start and (end is None or index < end):
+                items.append(self.value(events, event, value, path, whole))
+            else:
+                _skip(events, event)
+            index += 1
+        return items, index
+
+
+def project(body: Body, fields: Optional[set] = None, sources_offset: int = 0,
+            sources_limit: Optional[int] = None) -> Body:
+    """A new identity-encoded Body holding the selected part of `body`."""
+    stats["projections"] += 1
+    projector = _Projector(fields, sources_offset, sources_limit)
+    events = _events(body)
+    event, value = next(events)
+    result = projector.value(events, event, value, "", False)
+    return Body(passthrough.dumps(result), media_type=passthrough.JSON_MEDIA_TYPE)
+
+
+def wanted(fields: Optional[set], sources_offset: int, sources_limit: Optional[int]) -> bool:
+    return fields is not None or bool(sources_offset) or sources_limit is not None
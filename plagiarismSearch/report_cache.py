@@ -0,0 +1,237 @@
+"""
+Read-through cache for finished reports, grouped sources and HTML reports.
+
+A report never changes once its check is finished, so terminal payloads are kept
+in an in-process LRU (memory tier) backed by a SQLite file (disk tier) that
+survives restarts. Reports that are still checking are always fetched upstream.
+
+Entries are the raw upstream JSON bytes, gzip-compressed in both tiers, together
+with their ETag and brotli form (see passthrough), so a hit is served without
+decoding, hashing or compressing anything.
+"""
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+import gzip
+import io
+import os
+import time
+
+import datastore
+import passthrough
+from passthrough import Body
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+ENABLED = os.getenv("REPORT_CACHE_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+MEMORY_MAX_BYTES = int(os.getenv("REPORT_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+MEMORY_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MEMORY_ENTRIES", "512"))
+DISK_MAX_BYTES = int(os.getenv("REPORT_CACHE_DISK_BYTES", str(1024 * 1024 * 1024)))
+
+# Payload kinds, one per proxied endpoint.
+REPORT = "report"
+SOURCES = "sources"
+HTML = "html"
+AI_REPORT = "ai-report"
+AI_HTML = "ai-html"
+
+# Plagiarism report kinds share the /reports/{id} id space; update/delete on a
+# report invalidates all of them.
+REPORT_KINDS = (REPORT, SOURCES, HTML)
+AI_REPORT_KINDS = (AI_REPORT, AI_HTML)
+
+MEMORY_HIT = "memory"
+DISK_HIT = "disk"
+MISS = "miss"
+BYPASS = "bypass"
+
+
+def is_terminal_status(status) -> bool:
+    """status == 2 means checked, status <= -10 is an error; everything else is still checking."""
+    if status is None:
+        return False
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        return False
+    return status == 2 or status <= -10
+
+
+def is_failed_status(status) -> bool:
+    """A terminal status other than checked: the report will never have results."""
+    return is_terminal_status(status) and int(status) != 2
+
+
+def payload_status(payload) -> Optional[int]:
+    if isinstance(payload, dict) and isinstance(payload.get("data"), dict):
+        return payload["data"].get("status")
+    return None
+
+
+def body_status(body: Body) -> Optional[int]:
+    """
+    data.status of an undecoded body. With ijson installed only the bytes up
+    to that member are parsed and nothing else is built; without it the body
+    is decoded whole.
+    """
+    if ijson is None:
+        return payload_status(body.json())
+    stream = io.BytesIO(body.data)
+    if body.encoding == passthrough.GZIP:
+        stream = gzip.GzipFile(fileobj=stream)
+    for status in ijson.items(stream, "data.status", use_float=True):
+        return status
+    return None
+
+
+def is_terminal(payload) -> bool:
+    return is_terminal_status(payload_status(payload))
+
+
+def is_failed(payload) -> bool:
+    return is_failed_status(payload_status(payload))
+
+
+class ReportCache:
+    """Two-tier LRU cache keyed by (kind, report id, show_relations)."""
+
+    def __init__(self, db_name: str = "reports.sqlite3", memory_max_bytes: int = MEMORY_MAX_BYTES,
+                 memory_max_entries: int = MEMORY_MAX_ENTRIES, disk_max_bytes: int = DISK_MAX_BYTES):
+        self.memory_max_bytes = memory_max_bytes
+        self.memory_max_entries = memory_max_entries
+        self.disk_max_bytes = disk_max_bytes
+        self._memory: OrderedDict = OrderedDict()
+        self._memory_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self._db = datastore.connect(db_name)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS reports ("
+            " kind TEXT NOT NULL, report_id INTEGER NOT NULL, show_relations INTEGER NOT NULL,"
+            " body BLOB NOT NULL, etag TEXT NOT NULL, br BLOB, size INTEGER NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (kind, report_id, show_relations))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS reports_lru ON reports(last_used)")
+
+    def _remember(self, key: tuple, body: Body):
+        size = body.size
+        if size > self.memory_max_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key)[1]
+        self._memory[key] = (body, size)
+        self._memory_bytes += size
+        while self._memory and (self._memory_bytes > self.memory_max_bytes
+                                or len(self._memory) > self.memory_max_entries):
+            _, (_, evicted_size) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_size
+
+    def get(self, kind: str, report_id: int, show_relations: int = 0):
+        """Return (Body, tier) or (None, MISS)."""
+        key = (kind, report_id, show_relations)
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            return entry[0], MEMORY_HIT
+        row = self._db.execute(
+            "SELECT body, etag, br FROM reports WHERE kind = ? AND report_id = ? AND show_relations = ?", key
+        ).fetchone()
+        if row is None:
+            return None, MISS
+        self._db.execute(
+            "UPDATE reports SET last_used = ? WHERE kind = ? AND report_id = ? AND show_relations = ?",
+            (time.time(), *key),
+        )
+        body = Body.stored(row[0], etag=row[1], br=row[2])
+        self._remember(key, body)
+        return body, DISK_HIT
+
+    def put(self, kind: str, report_id: int, show_relations: int, body: Body) -> Body:
+        """Store a body in both tiers and return the stored (prepared) form."""
+        key = (kind, report_id, show_relations)
+        body = body.prepared()
+        self._db.execute(
+            "INSERT OR REPLACE INTO reports (kind, report_id, show_relations, body, etag, br, size, last_used)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (*key, body.data, body.etag, body.br, body.size, time.time()),
+        )
+        self._remember(key, body)
+        self._trim_disk()
+        return body
+
+    def _trim_disk(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM reports").fetchone()[0]
+        if total <= self.disk_max_bytes:
+            return
+        rows = self._db.execute("SELECT kind, report_id, show_relations, size FROM reports ORDER BY last_used ASC")
+        victims = []
+        for kind, report_id, show_relations, size in rows:
+            if total <= self.disk_max_bytes:
+                break
+            victims.append((kind, report_id, show_relations))
+            total -= size
+        self._db.executemany(
+            "DELETE FROM reports WHERE kind = ? AND report_id = ? AND show_relations = ?", victims
+        )
+
+    def invalidate(self, report_id: int, kinds=REPORT_KINDS):
+        """Drop every cached payload of a report, in both tiers."""
+        for key in [k for k in self._memory if k[1] == report_id and k[0] in kinds]:
+            self._memory_bytes -= self._memory.pop(key)[1]
+        self._db.executemany(
+            "DELETE FROM reports WHERE kind = ? AND report_id = ?", [(kind, report_id) for kind in kinds]
+        )
+
+    async def get_or_fetch(self, kind: str, report_id: int, show_relations: int,
+                           fetch: Callable[[], Awaitable[Body]],
+                           on_failed: Optional[Callable[[int], None]] = None):
+        """
+        Return (Body, outcome), calling `fetch` on a miss.
+
+        Only payloads whose report reached a terminal status are stored; only
+        data.status of a fetched body is read to find that out. `on_failed`
+        is called with the report id when a fetched payload shows the check failed.
+        """
+        if not ENABLED:
+            return await fetch(), BYPASS
+        body, outcome = self.get(kind, report_id, show_relations)
+        if body is not None:
+            if outcome == MEMORY_HIT:
+                self.memory_hits += 1
+            else:
+                self.disk_hits += 1
+            return body, outcome
+        self.misses += 1
+        body = await fetch()
+        status = body_status(body)
+        if is_terminal_status(status):
+            body = self.put(kind, report_id, show_relations, body)
+            if on_failed is not None and is_failed_status(status):
+                on_failed(report_id)
+        else:
+            self.uncacheable += 1
+        return body, MISS
+
+    def stats(self) -> dict:
+        disk_entries, disk_bytes = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM reports"
+        ).fetchone()
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "enabled": ENABLED,
+            "memory": {"entries": len(self._memory), "bytes": self._memory_bytes,
+                       "max_bytes": self.memory_max_bytes, "max_entries": self.memory_max_entries},
+            "disk": {"entries": disk_entries, "bytes": disk_bytes, "max_bytes": self.disk_max_bytes},
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "uncacheable": self.uncacheable,
+            "hit_ratio": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else None,
+        }
+
+
+cache = ReportCache()
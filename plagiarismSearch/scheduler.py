@@ -0,0 +1,259 @@
+"""
+Priority scheduling and per-tenant admission for upstream calls.
+
+Every upstream attempt needs one of SCHEDULER_SLOTS slots. Waiting calls are
+served by priority class, interactive before background before bulk, and bulk
+and background calls may only hold a share of the slots, so a single-paper
+/check or /report never queues behind a batch import. Within a class, tenants
+take turns (round robin), so one tenant's burst does not delay the others.
+
+SchedulerMiddleware tags each request with its class (from the path, lowered by
+an X-Priority header) and tenant (the client address, or the first of
+SCHEDULER_TENANT_HEADERS present when the request comes from one of
+SCHEDULER_TRUSTED_CLIENTS). A tenant with SCHEDULER_TENANT_MAX_PENDING calls
+waiting or running, or a call that waited SCHEDULER_MAX_WAIT seconds, gets a
+429 with Retry-After instead of queueing longer. Calls made outside a request
+(job queue workers, progress pollers) run as the quota-free "system" tenant in
+the background class.
+"""
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import NamedTuple, Optional
+import asyncio
+import hashlib
+import math
+import os
+import time
+
+from fastapi import HTTPException
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+BULK = "bulk"
+CLASSES = (INTERACTIVE, BACKGROUND, BULK)
+
+SLOTS = int(os.getenv("SCHEDULER_SLOTS", "16"))
+BACKGROUND_SHARE = float(os.getenv("SCHEDULER_BACKGROUND_SHARE", "0.75"))
+BULK_SHARE = float(os.getenv("SCHEDULER_BULK_SHARE", "0.5"))
+TENANT_MAX_PENDING = int(os.getenv("SCHEDULER_TENANT_MAX_PENDING", "32"))
+MAX_WAIT = float(os.getenv("SCHEDULER_MAX_WAIT", "30"))
+TENANT_HEADERS = [h.strip().lower() for h in
+                  os.getenv("SCHEDULER_TENANT_HEADERS", "x-tenant-id,x-api-token,x-group-id,x-user-id").split(",")
+                  if h.strip()]
+# Tenant headers are not authenticated, so they are only believed from these addresses (the
+# app's own backend); anyone else could dodge the quota with a new value on every request.
+TRUSTED_CLIENTS = {h.strip() for h in os.getenv("SCHEDULER_TRUSTED_CLIENTS", "127.0.0.1,::1").split(",") if h.strip()}
+# Tenant headers whose values are secrets and only shown hashed.
+SECRET_HEADERS = {"x-api-token", "authorization"}
+MAX_RETRY_AFTER = 60
+
+# Endpoints that fan out into many upstream calls.
+BULK_PATHS = ("/check/batch", "/reports/stream", "/reports/pdf/archive")
+
+
+class Ticket(NamedTuple):
+    priority: str
+    tenant: str
+    exempt: bool = False
+
+
+SYSTEM = Ticket(BACKGROUND, "system", exempt=True)
+
+_current: ContextVar[Ticket] = ContextVar("scheduler_ticket", default=SYSTEM)
+
+
+def current() -> Ticket:
+    return _current.get()
+
+
+def run_as_system():
+    """Schedule the rest of the current task as the system tenant (for tasks a request happened to start)."""
+    _current.set(SYSTEM)
+
+
+class Rejected(HTTPException):
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(status_code=429, detail=detail,
+                         headers={"Retry-After": str(min(max(math.ceil(retry_after), 1), MAX_RETRY_AFTER))})
+
+
+class Scheduler:
+    def __init__(self, slots: int = SLOTS, background_share: float = BACKGROUND_SHARE,
+                 bulk_share: float = BULK_SHARE, tenant_max_pending: int = TENANT_MAX_PENDING,
+                 max_wait: float = MAX_WAIT):
+        self.slots = slots
+        self.limits = {INTERACTIVE: slots, BACKGROUND: max(int(slots * background_share), 1),
+                       BULK: max(int(slots * bulk_share), 1)}
+        self.tenant_max_pending = tenant_max_pending
+        self.max_wait = max_wait
+        self.running = {priority: 0 for priority in CLASSES}
+        # Per class: tenant -> its waiting futures, in round-robin order.
+        self._queues = {priority: OrderedDict() for priority in CLASSES}
+        self._pending: dict = {}
+        self.hold_seconds = 0.5
+        self.granted = {priority: 0 for priority in CLASSES}
+        self.queued = {priority: 0 for priority in CLASSES}
+        self.wait_seconds = {priority: 0.0 for priority in CLASSES}
+        self.rejected = {"quota": 0, "timeout": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.slots > 0
+
+    def waiting(self, priority: str) -> int:
+        return sum(len(q) for q in self._queues[priority].values())
+
+    def _retry_after(self, priority: str) -> float:
+        """Rough time until a new call of this class would get a slot."""
+        ahead = sum(self.waiting(p) for p in CLASSES[:CLASSES.index(priority) + 1])
+        return (ahead + 1) * self.hold_seconds / self.limits[priority]
+
+    def _dispatch(self):
+        while sum(self.running.values()) < self.slots:
+            for priority in CLASSES:
+                queue = self._queues[priority]
+                if queue and self.running[priority] < self.limits[priority]:
+                    tenant, waiters = next(iter(queue.items()))
+                    future = waiters.popleft()
+                    # The tenant goes to the back of the rotation, or leaves it when it has nobody waiting.
+                    del queue[tenant]
+                    if waiters:
+                        queue[tenant] = waiters
+                    self.running[priority] += 1
+                    future.set_result(None)
+                    break
+            else:
+                return
+
+    def _remove(self, ticket: Ticket, future: asyncio.Future):
+        waiters = self._queues[ticket.priority].get(ticket.tenant)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            if not waiters:
+                del self._queues[ticket.priority][ticket.tenant]
+
+    def _leave(self, ticket: Ticket):
+        self._pending[ticket.tenant] -= 1
+        if not self._pending[ticket.tenant]:
+            del self._pending[ticket.tenant]
+
+    def _release(self, ticket: Ticket):
+        self.running[ticket.priority] -= 1
+        self._dispatch()
+
+    async def _acquire(self, ticket: Ticket):
+        if not ticket.exempt and self._pending.get(ticket.tenant, 0) >= self.tenant_max_pending:
+            self.rejected["quota"] += 1
+            raise Rejected("Too many upstream calls in progress for this tenant, retry shortly.",
+                           self._retry_after(ticket.priority))
+        self._pending[ticket.tenant] = self._pending.get(ticket.tenant, 0) + 1
+        future = asyncio.get_running_loop().create_future()
+        self._queues[ticket.priority].setdefault(ticket.tenant, deque()).append(future)
+        self._dispatch()
+        if future.done():
+            self.granted[ticket.priority] += 1
+            return
+        self.queued[ticket.priority] += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), None if ticket.exempt else self.max_wait)
+        except BaseException as e:
+            if future.done():
+                # Granted just as the wait ended: hand the slot straight back.
+                self._release(ticket)
+            else:
+                future.cancel()
+                self._remove(ticket, future)
+            self._leave(ticket)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected["timeout"] += 1
+                raise Rejected("Upstream capacity is busy, retry shortly.", self._retry_after(ticket.priority))
+            raise
+        self.wait_seconds[ticket.priority] += time.monotonic() - started
+        self.granted[ticket.priority] += 1
+
+    @asynccontextmanager
+    async def slot(self, ticket: Optional[Ticket] = None):
+        """Hold one upstream slot for the current request's ticket (or `ticket`)."""
+        if not self.enabled:
+            yield
+            return
+        ticket = ticket or current()
+        await self._acquire(ticket)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            # Moving average of slot hold times, for Retry-After estimates.
+            self.hold_seconds += (time.monotonic() - started - self.hold_seconds) * 0.1
+            self._release(ticket)
+            self._leave(ticket)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "slots": self.slots,
+            "in_use": sum(self.running.values()),
+            "tenant_max_pending": self.tenant_max_pending,
+            "max_wait": self.max_wait,
+            "hold_seconds_avg": round(self.hold_seconds, 4),
+            "classes": {
+                priority: {
+                    "limit": self.limits[priority],
+                    "running": self.running[priority],
+                    "waiting": self.waiting(priority),
+                    "waiting_tenants": len(self._queues[priority]),
+                    "granted": self.granted[priority],
+                    "queued": self.queued[priority],
+                    "wait_seconds_avg": round(self.wait_seconds[priority] / self.queued[priority], 4)
+                    if self.queued[priority] else None,
+                } for priority in CLASSES
+            },
+            "tenants": len(self._pending),
+            "busiest_tenants": dict(sorted(self._pending.items(), key=lambda item: -item[1])[:10]),
+            "rejected": self.rejected,
+        }
+
+
+def _tenant(headers: dict, client) -> str:
+    host = client[0] if client else None
+    if "*" in TRUSTED_CLIENTS or host in TRUSTED_CLIENTS:
+        for name in TENANT_HEADERS:
+            value = headers.get(name.encode())
+            if value:
+                value = value.decode("latin-1").strip()
+                if name in SECRET_HEADERS:
+                    value = hashlib.sha256(value.encode()).hexdigest()[:16]
+                return f"{name}:{value}"
+    return f"ip:{host}" if host else "ip:unknown"
+
+
+def _priority(path: str, headers: dict) -> str:
+    priority = BULK if path.startswith(BULK_PATHS) else INTERACTIVE
+    asked = headers.get(b"x-priority", b"").decode("latin-1").strip().lower()
+    # Clients may lower their priority, never raise it.
+    if asked in CLASSES and CLASSES.index(asked) > CLASSES.index(priority):
+        priority = asked
+    return priority
+
+
+class SchedulerMiddleware:
+    """ASGI middleware that sets the scheduling ticket for the request's upstream calls."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        token = _current.set(Ticket(_priority(scope["path"], headers), _tenant(headers, scope.get("client"))))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+
+
+scheduler = Scheduler()
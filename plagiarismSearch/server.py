@@ -1,16 +1,35 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request, Query, Body, Response
-from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse, StreamingResponse, FileResponse
 from typing import Optional, List
-import httpx
+from contextlib import asynccontextmanager
+from functools import lru_cache
+import asyncio
+import hmac
+import mimetypes
 import os
+import zipfile
+import zlib
 from dotenv import load_dotenv
-import io
-try:
-    from weasyprint import HTML
-except ImportError:
-    HTML = None
 from fastapi.middleware.cors import CORSMiddleware
+import upstream
+import dedup
+import report_cache
+import status_store
+import progress_stream
+import uploads
+import pdf_render
+import batches
+import near_dup
+import extract
+import metrics
+import passthrough
+import listing
+import jobs
+import pipeline
+import projection
+import pdf_archive
+import health
+import scheduler
 
 load_dotenv()
 
@@ -20,9 +39,40 @@ if API_KEY:
 else:
     print("API KEY not loaded from .env!")
 
-API_BASE_URL = "https://plagiarismsearch.com/api/v3"
+# Point at a stand-in (e.g. bench/mock_upstream.py) to test without spending API credits.
+API_BASE_URL = os.getenv("PLAGIARISMSEARCH_API_BASE_URL", "https://plagiarismsearch.com/api/v3").rstrip("/")
 
-app = FastAPI(title="PlagiarismSearch Proxy API")
+# Shared secret; callback URLs must carry ?token=<WEBHOOK_TOKEN>. Required with WEBHOOK_CALLBACK_URL.
+WEBHOOK_TOKEN = os.getenv("WEBHOOK_TOKEN")
+# Public URL of /webhook/plagiarismsearch, used as callback_url for /check when the client sends none.
+WEBHOOK_CALLBACK_URL = os.getenv("WEBHOOK_CALLBACK_URL")
+if WEBHOOK_CALLBACK_URL and not WEBHOOK_TOKEN:
+    print("WEBHOOK_CALLBACK_URL is set without WEBHOOK_TOKEN; webhook callbacks will be rejected!")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await upstream.open_pool()
+    jobs.queue.start(send_job, job_finished)
+    if API_KEY:
+        health.probe.start(f"{API_BASE_URL}/reports", headers)
+    try:
+        yield
+    finally:
+        await health.probe.stop()
+        await jobs.queue.stop()
+        await progress_hub.close()
+        await ai_progress_hub.close()
+        pdf_render.renderer.shutdown()
+        extract.extractor.shutdown()
+        await upstream.close_pool()
+
+app = FastAPI(title="PlagiarismSearch Proxy API", lifespan=lifespan)
+
+# Innermost: tags the request's upstream calls with its priority class and tenant.
+app.add_middleware(scheduler.SchedulerMiddleware)
+
+# Added before CORS so rejected uploads still get CORS headers.
+app.add_middleware(uploads.UploadLimitMiddleware)
 
 # Enable CORS for all origins (for development)
 app.add_middleware(
@@ -33,7 +83,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-templates = Jinja2Templates(directory="templates")
+# Outermost, so latency covers the whole middleware stack.
+app.add_middleware(metrics.MetricsMiddleware)
+
+@lru_cache(maxsize=None)
+def templates():
+    # Jinja2 is only needed for the index page, so it is not imported at startup.
+    from fastapi.templating import Jinja2Templates
+    return Jinja2Templates(directory="templates")
 
 headers = lambda: {"Authorization": API_KEY} if API_KEY else {}
 
@@ -56,24 +113,139 @@ async def health_check(request: Request):
     except:
         raise HTTPException(status_code=401, detail="Invalid authentication format")
     
-    import psutil
     import time
     
     return {
         "status": "healthy",
         "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-        "uptime": time.time() - psutil.boot_time(),
-        "memory": {
-            "total": psutil.virtual_memory().total,
-            "available": psutil.virtual_memory().available,
-            "percent": psutil.virtual_memory().percent
-        },
+        **health.system(),
+        "upstream": health.probe.snapshot(),
         "version": "1.0.0"
     }
 
+@metrics.registry.collector
+def component_metrics():
+    """Scrape-time view of the counters the caches, indexes and upstream client already keep."""
+    pool = upstream.pool_stats()
+    flights = pool["coalescing"]
+    dedup_stats = dedup.index.stats()
+    cache_stats = report_cache.cache.stats()
+    status_stats = status_store.store.stats()
+    upload_stats = uploads.budget.stats()
+    pdf_stats = pdf_render.renderer.stats()
+    breaker = pool["breaker"]
+    yield ("proxy_upstream_requests_total", "counter", "HTTP requests sent by the shared upstream client.",
+           [({}, pool["requests"])])
+    yield ("proxy_upstream_new_connections_total", "counter", "New TCP connections opened to PlagiarismSearch.",
+           [({}, pool["new_connections"])])
+    yield ("proxy_upstream_retries_total", "counter", "Upstream attempts that were retries.",
+           [({}, pool["retries"]["retried"])])
+    yield ("proxy_upstream_circuit_open", "gauge", "1 while the upstream circuit breaker is open or half-open.",
+           [({}, 0 if breaker["state"] == "closed" else 1)])
+    yield ("proxy_upstream_short_circuited_total", "counter", "Calls rejected by the open circuit breaker.",
+           [({}, breaker["short_circuited"])])
+    yield ("proxy_coalescing_requests_total", "counter", "Upstream GETs by whether they joined an in-flight call.",
+           [({"outcome": "call"}, flights["upstream_calls"]), ({"outcome": "coalesced"}, flights["coalesced"])])
+    yield ("proxy_coalescing_ratio", "gauge", "Share of upstream GETs served by an in-flight call.",
+           [({}, flights["coalesced_ratio"])])
+    yield ("proxy_dedup_lookups_total", "counter", "Submission dedup lookups by outcome.",
+           [({"outcome": "hit"}, dedup_stats["hits"]), ({"outcome": "inflight"}, dedup_stats["inflight_hits"]),
+            ({"outcome": "miss"}, dedup_stats["misses"])])
+    yield ("proxy_dedup_hit_ratio", "gauge", "Share of submissions answered by the dedup index.",
+           [({}, dedup_stats["hit_ratio"])])
+    yield ("proxy_report_cache_lookups_total", "counter", "Report cache lookups by outcome.",
+           [({"outcome": "memory"}, cache_stats["memory_hits"]), ({"outcome": "disk"}, cache_stats["disk_hits"]),
+            ({"outcome": "miss"}, cache_stats["misses"])])
+    yield ("proxy_report_cache_hit_ratio", "gauge", "Share of report reads served from the cache.",
+           [({}, cache_stats["hit_ratio"])])
+    yield ("proxy_report_cache_bytes", "gauge", "Bytes held by each report cache tier.",
+           [({"tier": "memory"}, cache_stats["memory"]["bytes"]), ({"tier": "disk"}, cache_stats["disk"]["bytes"])])
+    yield ("proxy_status_lookups_total", "counter", "Status polls by where they were answered.",
+           [({"source": "local"}, status_stats["local_hits"]), ({"source": "upstream"}, status_stats["upstream_fetches"])])
+    yield ("proxy_status_local_ratio", "gauge", "Share of status polls answered locally.",
+           [({}, status_stats["local_ratio"])])
+    yield ("proxy_upload_bytes_total", "counter", "Upload body bytes received.", [({}, upload_stats["bytes_received"])])
+    yield ("proxy_upload_bytes_in_use", "gauge", "Upload bytes currently reserved.", [({}, upload_stats["in_use"])])
+    yield ("proxy_uploads_rejected_total", "counter", "Uploads rejected before their body was read.",
+           [({"reason": "too_large"}, upload_stats["rejected_too_large"]),
+            ({"reason": "busy"}, upload_stats["rejected_busy"])])
+    yield ("proxy_pdf_render_queue_depth", "gauge", "PDF renders waiting for a worker.", [({}, pdf_stats["queue_depth"])])
+    yield ("proxy_pdf_cache_hits_total", "counter", "PDF downloads served from the PDF cache.",
+           [({}, pdf_stats["cache_hits"])])
+    yield ("proxy_progress_stream_subscribers", "gauge", "Open progress streams.",
+           [({}, progress_hub.stats()["subscribers"])])
+    job_stats = jobs.queue.stats()
+    yield ("proxy_jobs", "gauge", "Submission jobs by state.",
+           [({"state": state}, job_stats[state]) for state in (jobs.QUEUED, jobs.RUNNING, jobs.DONE, jobs.FAILED)])
+    yield ("proxy_jobs_retried_total", "counter", "Job attempts rescheduled after a retryable upstream error.",
+           [({}, job_stats["retried"])])
+    yield ("proxy_report_stream_reports_total", "counter", "Reports written to /reports/stream.",
+           [({}, listing.stats["reports"])])
+    yield ("proxy_report_stream_errors_total", "counter", "Report streams cut short by an upstream error.",
+           [({}, listing.stats["errors"])])
+    yield ("proxy_report_projections_total", "counter", "Report bodies cut down by fields= or a sources window.",
+           [({}, projection.stats["projections"])])
+    scheduler_stats = scheduler.scheduler.stats()
+    yield ("proxy_scheduler_running", "gauge", "Upstream slots in use by priority class.",
+           [({"class": name}, c["running"]) for name, c in scheduler_stats["classes"].items()])
+    yield ("proxy_scheduler_waiting", "gauge", "Upstream calls waiting for a slot by priority class.",
+           [({"class": name}, c["waiting"]) for name, c in scheduler_stats["classes"].items()])
+    yield ("proxy_scheduler_rejected_total", "counter", "Upstream calls answered 429 by the scheduler.",
+           [({"reason": reason}, count) for reason, count in scheduler_stats["rejected"].items()])
+    yield ("proxy_pdf_archive_entries_total", "counter", "PDFs written to /reports/pdf/archive downloads.",
+           [({"outcome": "ok"}, pdf_archive.stats["entries"]), ({"outcome": "failed"}, pdf_archive.stats["failures"])])
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text exposition of request, upstream, cache and render metrics."""
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/pool/stats")
+async def upstream_pool_stats(reset: int = Query(0)):
+    """Connection pool usage for the shared upstream client."""
+    stats = upstream.pool_stats()
+    if reset:
+        upstream.stats.reset()
+    return stats
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    """Upstream slots by priority class, waiting calls, busiest tenants and 429 rejections."""
+    return scheduler.scheduler.stats()
+
+@app.get("/dedup/stats")
+async def dedup_stats():
+    """Hit/miss counters and size of the submission dedup index."""
+    return dedup.index.stats()
+
+@app.get("/cache/stats")
+async def report_cache_stats():
+    """Size and hit ratio of the finished-report cache."""
+    return report_cache.cache.stats()
+
+@app.get("/status-store/stats")
+async def status_store_stats():
+    """How many status polls were answered locally versus upstream."""
+    return status_store.store.stats()
+
+@app.get("/uploads/stats")
+async def upload_stats():
+    """Upload size limits and bytes currently reserved by in-flight uploads."""
+    return uploads.budget.stats()
+
+@app.get("/extract/stats")
+async def extract_stats():
+    """Documents converted to text, bytes saved and per-stage extraction times."""
+    return extract.extractor.stats()
+
+@app.get("/near-duplicates/stats")
+async def near_duplicate_stats():
+    """Size of the local near-duplicate index and its query latency."""
+    return near_dup.index.stats()
+
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return templates().TemplateResponse("index.html", {"request": request})
 
 @app.get("/reports")
 async def list_reports(
@@ -94,17 +266,7 @@ async def list_reports(
         params["ids"] = ids
     if remote_id:
         params["remote_id"] = remote_id
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{API_BASE_URL}/reports",
-            headers=headers(),
-            params=params
-        )
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-        return response.json()
+    return await upstream.get_json(f"{API_BASE_URL}/reports", headers(), params)
 
 @app.post("/reports")
 async def batch_reports(
@@ -125,20 +287,168 @@ async def batch_reports(
         payload["ids"] = ids
     if remote_id:
         payload["remote_id"] = remote_id
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{API_BASE_URL}/reports",
-            headers={**headers(), "Content-Type": "application/json"},
-            json=payload
+    # POST /reports only looks reports up, so it is as safe to retry as a GET.
+    return await upstream.request_json(
+        "POST",
+        f"{API_BASE_URL}/reports",
+        idempotent=True,
+        headers={**headers(), "Content-Type": "application/json"},
+        json=payload
+    )
+
+@app.get("/reports/stream")
+async def stream_reports(
+    show_relations: int = Query(0),
+    ids: Optional[List[int]] = Query(None),
+    remote_id: Optional[str] = Query(None),
+    page_from: int = Query(1, ge=1),
+    page_to: Optional[int] = Query(None, ge=1),
+    limit: int = Query(listing.PAGE_SIZE, ge=1)
+):
+    """Every report, a page range, or a list of ids as NDJSON, fetched from upstream concurrently."""
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API key not set.")
+    params = {"show_relations": show_relations}
+    if remote_id:
+        params["remote_id"] = remote_id
+    if ids:
+        async def fetch_ids(chunk: List[int]):
+            return await upstream.request_json(
+                "POST",
+                f"{API_BASE_URL}/reports",
+                idempotent=True,
+                headers={**headers(), "Content-Type": "application/json"},
+                json={**params, "ids": chunk, "page": 1, "limit": len(chunk)}
+            )
+
+        lines = await listing.by_ids(fetch_ids, ids)
+    else:
+        async def fetch_page(page: int):
+            return await upstream.get_json(f"{API_BASE_URL}/reports", headers(), {**params, "page": page, "limit": limit})
+
+        lines = await listing.by_pages(fetch_page, page_from, page_to, limit)
+    return StreamingResponse(lines, media_type=listing.MEDIA_TYPE)
+
+# Search options accepted by /check and their defaults; shared with /check/batch.
+CHECK_OPTION_DEFAULTS = {
+    "is_search_web": 1,
+    "is_search_storage": 1,
+    "is_json": 1,
+    "is_search_filter_chars": 0,
+    "is_search_filter_references": 0,
+    "is_search_filter_quotes": 0,
+    "is_search_ai": 1,
+    "search_web_disable_urls": None,
+    "search_web_exclude_urls": None,
+    "search_storage_sensibility_percentage": None,
+    "search_storage_sensibility_words": None,
+}
+CHECK_STRING_OPTIONS = ("search_web_disable_urls", "search_web_exclude_urls")
+
+def check_options(values) -> dict:
+    """Coerce raw option values (form fields or JSON) to /check option types, filling in defaults."""
+    options = {}
+    for name, default in CHECK_OPTION_DEFAULTS.items():
+        value = values.get(name)
+        if value is None or value == "":
+            options[name] = default
+        elif name in CHECK_STRING_OPTIONS:
+            options[name] = str(value)
+        else:
+            try:
+                options[name] = int(value)
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=422, detail=f"{name} must be an integer.")
+    return options
+
+def check_fields(options: dict, text: Optional[str] = None, url: Optional[str] = None,
+                 title: Optional[str] = None, callback_url: Optional[str] = None) -> dict:
+    """Upstream /reports/create fields for one submission."""
+    fields = {name: value for name, value in options.items() if value is not None}
+    for name, value in (("text", text), ("url", url), ("title", title), ("callback_url", callback_url)):
+        if value:
+            fields[name] = value
+    return fields
+
+async def upstream_create(path: str, fields: dict, document=None):
+    """POST a create call upstream; multipart when `document` (an httpx file tuple) is given."""
+    if document:
+        return await upstream.request_json(
+            "POST",
+            f"{API_BASE_URL}{path}",
+            headers=headers(),
+            data={name: str(value) for name, value in fields.items()},
+            files={"document": document}
         )
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-        return response.json()
+    return await upstream.request_json(
+        "POST",
+        f"{API_BASE_URL}{path}",
+        headers={**headers(), "Content-Type": "application/json"},
+        json=fields
+    )
+
+async def submit_check(options: dict, text: Optional[str] = None, url: Optional[str] = None,
+                       title: Optional[str] = None, callback_url: Optional[str] = None, document=None):
+    """Create one plagiarism report upstream; multipart when `document` (an httpx file tuple) is given."""
+    fields = check_fields(options, text=text, url=url, title=title, callback_url=callback_url)
+    return await upstream_create("/reports/create", fields, document)
+
+async def queue_submission(response: Response, kind: str, path: str, fields: dict,
+                           file: Optional[UploadFile] = None, dedup_key: Optional[str] = None,
+                           meta: Optional[dict] = None):
+    """
+    Answer a Prefer: respond-async submission with a queued job (202), or with
+    the stored result of an identical submission. Identical submissions that
+    are still queued share one job.
+    """
+    job = None
+    if dedup_key is not None:
+        stored = dedup.index.get(dedup_key)
+        if stored is not None:
+            dedup.index.count(dedup.HIT)
+            response.headers["X-Dedup"] = dedup.HIT
+            return stored
+        job = jobs.queue.find_active(dedup_key)
+    if job is not None:
+        dedup.index.count(dedup.INFLIGHT)
+        response.headers["X-Dedup"] = dedup.INFLIGHT
+    else:
+        if dedup_key is not None:
+            dedup.index.count(dedup.MISS)
+        response.headers["X-Dedup"] = dedup.MISS if dedup_key is not None else dedup.BYPASS
+        job = await jobs.queue.enqueue(kind, path, fields, upload=file, meta=meta, dedup_key=dedup_key)
+    response.status_code = 202
+    response.headers["Location"] = f"/jobs/{job['job_id']}"
+    response.headers["Preference-Applied"] = "respond-async"
+    return jobs.public(job)
+
+async def send_job(job: dict):
+    """Job queue worker call: replay a stored submission upstream."""
+    document = job["document"]
+    if not document:
+        return await upstream_create(job["path"], job["fields"])
+    with open(document["file"], "rb") as f:
+        return await upstream_create(job["path"], job["fields"], (document["filename"], f, document["content_type"]))
+
+def job_finished(job: dict, result):
+    """Dedup and near-duplicate bookkeeping the synchronous endpoints do after their upstream call."""
+    data = result.get("data") if isinstance(result, dict) else None
+    upstream_id = data.get("id") if isinstance(data, dict) else None
+    if upstream_id is None:
+        return
+    if job["dedup_key"]:
+        dedup.index.put(job["dedup_key"], result)
+    content_key = job["meta"].get("content_key")
+    if content_key:
+        if job["kind"] == "storage":
+            near_dup.index.link(content_key, storage_id=upstream_id)
+        else:
+            near_dup.index.link(content_key, report_id=upstream_id)
 
 @app.post("/check")
 async def check_document(
+    request: Request,
+    response: Response,
     file: Optional[UploadFile] = File(None),
     text: Optional[str] = Form(None),
     url: Optional[str] = Form(None),
@@ -154,90 +464,256 @@ async def check_document(
     search_web_exclude_urls: Optional[str] = Form(None),
     is_search_ai: int = Form(1),
     search_storage_sensibility_percentage: Optional[int] = Form(None),
-    search_storage_sensibility_words: Optional[int] = Form(None)
+    search_storage_sensibility_words: Optional[int] = Form(None),
+    skip_similarity: Optional[float] = Form(None)
 ):
     """
     Submit a document, text, or URL for plagiarism checking.
     At least one of file, text, or url is required.
+    Identical submissions are answered from the dedup index (see X-Dedup header).
+    PDF, DOCX, TXT and TeX uploads are converted to text locally and the text
+    is submitted instead of the file (see X-Extraction and Server-Timing).
+    Texts are pre-screened against the local near-duplicate index; with
+    skip_similarity set, a match at least that similar is returned instead of
+    starting a paid upstream check.
+    With Prefer: respond-async the submission is queued and answered with a
+    job id (see /jobs/{job_id}).
     """
     if not API_KEY:
         raise HTTPException(status_code=500, detail="API key not set.")
     if not (file or text or url):
         raise HTTPException(status_code=400, detail="One of file, text, or url is required.")
 
-    async with httpx.AsyncClient() as client:
-        if file:
-            form_data = {
-                "is_search_web": str(is_search_web),
-                "is_search_storage": str(is_search_storage),
-                "is_json": str(is_json),
-                "is_search_filter_chars": str(is_search_filter_chars),
-                "is_search_filter_references": str(is_search_filter_references),
-                "is_search_filter_quotes": str(is_search_filter_quotes),
-                "is_search_ai": str(is_search_ai)
-            }
-            if title:
-                form_data["title"] = title
-            if callback_url:
-                form_data["callback_url"] = callback_url
-            if text:
-                form_data["text"] = text
-            if url:
-                form_data["url"] = url
-            if search_web_disable_urls:
-                form_data["search_web_disable_urls"] = search_web_disable_urls
-            if search_web_exclude_urls:
-                form_data["search_web_exclude_urls"] = search_web_exclude_urls
-            if search_storage_sensibility_percentage is not None:
-                form_data["search_storage_sensibility_percentage"] = str(search_storage_sensibility_percentage)
-            if search_storage_sensibility_words is not None:
-                form_data["search_storage_sensibility_words"] = str(search_storage_sensibility_words)
-            files = {"document": (file.filename, await file.read(), file.content_type)}
-            response = await client.post(
-                f"{API_BASE_URL}/reports/create",
-                headers=headers(),
-                data=form_data,
-                files=files
-            )
-        else:
-            payload = {
-                "is_search_web": is_search_web,
-                "is_search_storage": is_search_storage,
-                "is_json": is_json,
-                "is_search_filter_chars": is_search_filter_chars,
-                "is_search_filter_references": is_search_filter_references,
-                "is_search_filter_quotes": is_search_filter_quotes,
-                "is_search_ai": is_search_ai
-            }
-            if text:
-                payload["text"] = text
-            if url:
-                payload["url"] = url
-            if title:
-                payload["title"] = title
-            if callback_url:
-                payload["callback_url"] = callback_url
-            if search_web_disable_urls:
-                payload["search_web_disable_urls"] = search_web_disable_urls
-            if search_web_exclude_urls:
-                payload["search_web_exclude_urls"] = search_web_exclude_urls
-            if search_storage_sensibility_percentage is not None:
-                payload["search_storage_sensibility_percentage"] = search_storage_sensibility_percentage
-            if search_storage_sensibility_words is not None:
-                payload["search_storage_sensibility_words"] = search_storage_sensibility_words
-            response = await client.post(
-                f"{API_BASE_URL}/reports/create",
-                headers={**headers(), "Content-Type": "application/json"},
-                json=payload
-            )
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-        return response.json()
+    callback_url = callback_url or WEBHOOK_CALLBACK_URL
+    options = check_options({
+        "is_search_web": is_search_web,
+        "is_search_storage": is_search_storage,
+        "is_json": is_json,
+        "is_search_filter_chars": is_search_filter_chars,
+        "is_search_filter_references": is_search_filter_references,
+        "is_search_filter_quotes": is_search_filter_quotes,
+        "is_search_ai": is_search_ai,
+        "search_web_disable_urls": search_web_disable_urls,
+        "search_web_exclude_urls": search_web_exclude_urls,
+        "search_storage_sensibility_percentage": search_storage_sensibility_percentage,
+        "search_storage_sensibility_words": search_storage_sensibility_words,
+    })
+    file, text, title = await extract_upload(file, text, title, options, response)
+    file_digest = await uploads.digest(file) if file else None
+    fingerprint, candidates = await prescreen(text, file, response)
+    if candidates and skip_similarity is not None and candidates[0]["similarity"] >= skip_similarity:
+        response.headers["X-Dedup"] = dedup.BYPASS
+        return {"status": True, "skipped": True, "near_duplicates": candidates}
+
+    if jobs.wants_async(request.headers.get("prefer")):
+        key = dedup.submission_key("check", options, text=text, url=url, file_digest=file_digest) if dedup.ENABLED else None
+        if fingerprint is not None:
+            near_dup.remember(fingerprint, "check", title=title or (file.filename if file else None))
+        fields = check_fields(options, text=text, url=url, title=title, callback_url=callback_url)
+        meta = {"content_key": fingerprint[0] if fingerprint else None}
+        result = await queue_submission(response, "check", "/reports/create", fields, file, key, meta)
+        if candidates:
+            result = {**result, "near_duplicates": candidates}
+        return result
+
+    async def create():
+        document = uploads.upstream_file(file) if file else None
+        return await submit_check(options, text=text, url=url, title=title,
+                                  callback_url=callback_url, document=document)
+
+    if not dedup.ENABLED:
+        response.headers["X-Dedup"] = dedup.BYPASS
+        result = await create()
+    else:
+        key = dedup.submission_key("check", options, text=text, url=url, file_digest=file_digest)
+        result, outcome = await dedup.index.submit(key, create)
+        response.headers["X-Dedup"] = outcome
+    if fingerprint is not None:
+        near_dup.remember(fingerprint, "check", title=title or (file.filename if file else None), result=result)
+    if candidates and isinstance(result, dict):
+        result = {**result, "near_duplicates": candidates}
+    return result
+
+async def extract_upload(file: Optional[UploadFile], text: Optional[str], title: Optional[str],
+                         options: dict, response: Response) -> tuple:
+    """
+    Replace an extractable upload by its text (see X-Extraction and
+    Server-Timing); returns (file, text, title), with file None once extracted.
+    """
+    if not (file and not text and extract.ENABLED):
+        return file, text, title
+    extracted = await extract.extractor.extract(
+        file,
+        filter_references=bool(options["is_search_filter_references"]),
+        filter_quotes=bool(options["is_search_filter_quotes"]),
+    )
+    response.headers["X-Extraction"] = extracted["kind"] if extracted else "none"
+    if not extracted:
+        return file, text, title
+    response.headers["Server-Timing"] = extract.server_timing(extracted["timings"])
+    return None, extracted["text"], title or file.filename
+
+async def prescreen(text: Optional[str], file: Optional[UploadFile], response: Response) -> tuple:
+    """Query the near-duplicate index for a text or plain-text upload; returns (fingerprint, candidates)."""
+    if not near_dup.ENABLED:
+        return None, []
+    content = text or (await near_dup.upload_text(file) if file else None)
+    if not content or not content.strip():
+        return None, []
+    fingerprint, candidates = await near_dup.screen(content)
+    response.headers["X-Near-Duplicates"] = str(len(candidates))
+    return fingerprint, candidates
+
+@app.post("/near-duplicates")
+async def near_duplicates(
+    response: Response,
+    file: Optional[UploadFile] = File(None),
+    text: Optional[str] = Form(None),
+    threshold: float = Form(near_dup.THRESHOLD)
+):
+    """Look a text or plain-text file up in the local near-duplicate index without calling upstream."""
+    content = text or (await near_dup.upload_text(file) if file else None)
+    if not content or not content.strip():
+        raise HTTPException(status_code=400, detail="A text or a plain-text file is required.")
+    fingerprint, candidates = await near_dup.screen(content, threshold=threshold)
+    return {"shingles": fingerprint[1], "threshold": threshold, "candidates": candidates}
+
+@app.post("/check/batch")
+async def check_batch(request: Request):
+    """
+    Submit many documents for plagiarism checking in one request.
+
+    Accepts a JSON list of texts/URLs (optionally {"items": [...], "options": {...}})
+    or a multipart ZIP upload in `file` with the /check option fields. Items are
+    sent to /reports/create with BATCH_CONCURRENCY parallel submissions.
+    """
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API key not set.")
+    if request.headers.get("content-type", "").startswith("multipart/"):
+        async with request.form() as form:
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=400, detail="A ZIP file is required in the 'file' field.")
+            try:
+                archive = await asyncio.to_thread(zipfile.ZipFile, upload.file)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail="Uploaded file is not a valid ZIP archive.")
+            with archive:
+                items = [
+                    {"title": os.path.basename(info.filename), "member": info}
+                    for info in batches.zip_members(archive)
+                ]
+                return await submit_batch(items, form, form.get("callback_url"), archive)
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be JSON or a multipart ZIP upload.")
+    items, raw_options = batches.json_items(body)
+    return await submit_batch(items, raw_options, raw_options.get("callback_url"))
+
+async def submit_batch(items: list, raw_options, callback_url: Optional[str] = None,
+                       archive: Optional[zipfile.ZipFile] = None):
+    if not items:
+        raise HTTPException(status_code=400, detail="Batch contains no documents.")
+    if len(items) > batches.MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {batches.MAX_ITEMS} items.")
+    options = check_options(raw_options)
+    callback_url = callback_url or WEBHOOK_CALLBACK_URL
+    batch_id = batches.store.create(options, len(items))
+    slots = asyncio.Semaphore(batches.CONCURRENCY)
+
+    async def submit_item(position: int, item: dict):
+        text, url, title = item.get("text"), item.get("url"), item.get("title")
+        source = "zip" if "member" in item else ("url" if url else "text")
+        spooled = None
+        async with slots:
+            try:
+                document = file_digest = None
+                if "member" in item:
+                    spooled, file_digest = await asyncio.to_thread(batches.extract_member, archive, item["member"])
+                    content_type = mimetypes.guess_type(title)[0] or "application/octet-stream"
+                    document = (title, uploads.StreamingFile(spooled), content_type)
+
+                async def create():
+                    return await submit_check(options, text=text, url=url, title=title,
+                                              callback_url=callback_url, document=document)
+
+                if dedup.ENABLED:
+                    key = dedup.submission_key("check", options, text=text, url=url, file_digest=file_digest)
+                    result, outcome = await dedup.index.submit(key, create)
+                else:
+                    result, outcome = await create(), dedup.BYPASS
+                report_id = (result.get("data") or {}).get("id")
+                batches.store.record(batch_id, position, title, source, report_id=report_id, dedup=outcome)
+                return {"index": position, "title": title, "source": source, "report_id": report_id, "dedup": outcome}
+            except HTTPException as e:
+                error = str(e.detail)[:500]
+                batches.store.record(batch_id, position, title, source, error=error)
+                return {"index": position, "title": title, "source": source, "error": error, "status_code": e.status_code}
+            except (zipfile.BadZipFile, zlib.error, OSError) as e:
+                # A corrupt member fails on its own; the other items may already exist upstream.
+                error = f"Could not read {title} from the ZIP: {e}"[:500]
+                batches.store.record(batch_id, position, title, source, error=error)
+                return {"index": position, "title": title, "source": source, "error": error, "status_code": 400}
+            finally:
+                if spooled is not None:
+                    spooled.close()
+
+    results = await asyncio.gather(*[submit_item(i, item) for i, item in enumerate(items)])
+    return {
+        "batch_id": batch_id,
+        "submitted": sum(1 for r in results if r.get("report_id")),
+        "failed": sum(1 for r in results if "error" in r),
+        "items": results,
+    }
+
+@app.get("/check/batch/{batch_id}")
+async def check_batch_status(batch_id: str):
+    """Summarize progress across every report of a batch."""
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API key not set.")
+    batch = batches.store.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found.")
+    slots = asyncio.Semaphore(batches.STATUS_CONCURRENCY)
+
+    async def item_status(item: dict):
+        if not item["report_id"]:
+            return item
+        async with slots:
+            try:
+                data = status_store.store.get(item["report_id"]) or await fetch_upstream_status(item["report_id"])
+            except HTTPException as e:
+                return {**item, "status_error": str(e.detail)[:500]}
+        report = data.get("data") or {}
+        return {**item, "status": report.get("status"), "status_label": report.get("status_label"),
+                "progress": report.get("progress"), "plagiarism": report.get("plagiarism")}
+
+    items = await asyncio.gather(*[item_status(item) for item in batch["items"]])
+    checked = sum(1 for i in items if i.get("status") == 2)
+    failed = sum(1 for i in items if report_cache.is_failed_status(i.get("status")))
+    progress = [1.0 if report_cache.is_terminal_status(i.get("status")) else (i.get("progress") or 0.0)
+                for i in items if i.get("report_id")]
+    return {
+        "batch_id": batch_id,
+        "created": batch["created"],
+        "size": batch["size"],
+        "summary": {
+            "submitted": sum(1 for i in items if i.get("report_id")),
+            "submit_errors": sum(1 for i in items if i.get("error")),
+            "checked": checked,
+            "failed": failed,
+            "processing": len(progress) - checked - failed,
+            "progress": round(sum(progress) / len(progress), 4) if progress else None,
+            "done": bool(progress) and checked + failed == len(progress),
+        },
+        "items": items,
+    }
 
 @app.post("/ai-check")
 async def ai_check(
+    request: Request,
+    response: Response,
     file: Optional[UploadFile] = File(None),
     text: Optional[str] = Form(None),
     url: Optional[str] = Form(None),
@@ -251,51 +727,34 @@ async def ai_check(
         raise HTTPException(status_code=500, detail="API key not set.")
     if not (file or text or url):
         raise HTTPException(status_code=400, detail="One of file, text, or url is required.")
-    async with httpx.AsyncClient() as client:
-        if file:
-            form_data = {
-                "is_filter_references": str(is_filter_references),
-                "is_json": str(is_json),
-                "force": str(force)
-            }
-            if title:
-                form_data["title"] = title
-            if callback_url:
-                form_data["callback_url"] = callback_url
-            if text:
-                form_data["text"] = text
-            if url:
-                form_data["url"] = url
-            files = {"document": (file.filename, await file.read(), file.content_type)}
-            response = await client.post(
-                f"{API_BASE_URL}/ai-reports/create",
-                headers=headers(),
-                data=form_data,
-                files=files
-            )
-        else:
-            payload = {"is_filter_references": is_filter_references, "is_json": is_json, "force": force}
-            if text:
-                payload["text"] = text
-            if url:
-                payload["url"] = url
-            if title:
-                payload["title"] = title
-            if callback_url:
-                payload["callback_url"] = callback_url
-            response = await client.post(
-                f"{API_BASE_URL}/ai-reports/create",
-                headers={**headers(), "Content-Type": "application/json"},
-                json=payload
-            )
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-        return response.json()
+    file_digest = await uploads.digest(file) if file else None
+    fields = {"is_filter_references": is_filter_references, "is_json": is_json, "force": force}
+    for name, value in (("title", title), ("callback_url", callback_url), ("text", text), ("url", url)):
+        if value:
+            fields[name] = value
+
+    async def create():
+        document = uploads.upstream_file(file) if file else None
+        return await upstream_create("/ai-reports/create", fields, document)
+
+    # force=1 explicitly asks upstream for a fresh check, so it skips the dedup index.
+    key = None
+    if dedup.ENABLED and not force:
+        options = {"is_filter_references": is_filter_references, "is_json": is_json}
+        key = dedup.submission_key("ai-check", options, text=text, url=url, file_digest=file_digest)
+    if jobs.wants_async(request.headers.get("prefer")):
+        return await queue_submission(response, "ai-check", "/ai-reports/create", fields, file, key)
+    if key is None:
+        response.headers["X-Dedup"] = dedup.BYPASS
+        return await create()
+    result, outcome = await dedup.index.submit(key, create)
+    response.headers["X-Dedup"] = outcome
+    return result
 
 @app.post("/storage/create")
 async def create_storage(
+    request: Request,
+    response: Response,
     file: Optional[UploadFile] = File(None),
     text: Optional[str] = Form(None),
     url: Optional[str] = Form(None),
@@ -310,242 +769,480 @@ async def create_storage(
         raise HTTPException(status_code=500, detail="API key not set.")
     if not (file or text or url):
         raise HTTPException(status_code=400, detail="One of file, text, or url is required.")
-    async with httpx.AsyncClient() as client:
-        if file:
-            form_data = {
-                "is_search_filter_chars": str(is_search_filter_chars),
-                "is_json": str(is_json)
-            }
-            if title:
-                form_data["title"] = title
-            if group_id:
-                form_data["group_id"] = str(group_id)
-            if user_id:
-                form_data["user_id"] = str(user_id)
-            if file_id:
-                form_data["file_id"] = str(file_id)
-            if text:
-                form_data["text"] = text
-            if url:
-                form_data["url"] = url
-            files = {"document": (file.filename, await file.read(), file.content_type)}
-            response = await client.post(
-                f"{API_BASE_URL}/storage/create",
-                headers=headers(),
-                data=form_data,
-                files=files
-            )
+
+    fields = {"is_search_filter_chars": is_search_filter_chars, "is_json": is_json}
+    for name, value in (("title", title), ("group_id", group_id), ("user_id", user_id), ("file_id", file_id),
+                        ("text", text), ("url", url)):
+        if value:
+            fields[name] = value
+    fingerprint = None
+    if near_dup.ENABLED:
+        content = text or (await near_dup.upload_text(file) if file else None)
+        if content and content.strip():
+            fingerprint = await asyncio.to_thread(near_dup.fingerprint, content)
+    if jobs.wants_async(request.headers.get("prefer")):
+        if fingerprint is not None:
+            near_dup.remember(fingerprint, "storage", title=title or (file.filename if file else None), storage=True)
+        meta = {"content_key": fingerprint[0] if fingerprint else None}
+        return await queue_submission(response, "storage", "/storage/create", fields, file, meta=meta)
+
+    document = uploads.upstream_file(file) if file else None
+    result = await upstream_create("/storage/create", fields, document)
+    if fingerprint is not None:
+        near_dup.remember(fingerprint, "storage", title=title or (file.filename if file else None),
+                          result=result, storage=True)
+    return result
+
+@app.post("/pipeline")
+async def check_pipeline(
+    request: Request,
+    response: Response,
+    file: Optional[UploadFile] = File(None),
+    text: Optional[str] = Form(None),
+    url: Optional[str] = Form(None),
+    title: Optional[str] = Form(None),
+    callback_url: Optional[str] = Form(None)
+):
+    """
+    Run a plagiarism check and an AI-detection check on one upload.
+
+    Takes the /check fields and options. The document is received (and
+    extracted) once and both reports are created upstream concurrently, each
+    through the dedup index. Follow them together with /pipeline/{pipeline_id},
+    its /stream and its /result.
+    """
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API key not set.")
+    if not (file or text or url):
+        raise HTTPException(status_code=400, detail="One of file, text, or url is required.")
+    options = check_options(await request.form())
+    file, text, title = await extract_upload(file, text, title, options, response)
+    file_digest = await uploads.digest(file) if file else None
+    fingerprint, candidates = await prescreen(text, file, response)
+    ai_options = {"is_filter_references": options["is_search_filter_references"], "is_json": 1}
+
+    async def create_report():
+        async def create():
+            document = uploads.upstream_file(file) if file else None
+            return await submit_check(options, text=text, url=url, title=title,
+                                      callback_url=callback_url or WEBHOOK_CALLBACK_URL, document=document)
+
+        if not dedup.ENABLED:
+            return await create()
+        key = dedup.submission_key("check", options, text=text, url=url, file_digest=file_digest)
+        return (await dedup.index.submit(key, create))[0]
+
+    async def create_ai_report():
+        fields = {**ai_options, "force": 0}
+        for name, value in (("title", title), ("callback_url", callback_url), ("text", text), ("url", url)):
+            if value:
+                fields[name] = value
+
+        async def create():
+            document = uploads.upstream_file(file) if file else None
+            return await upstream_create("/ai-reports/create", fields, document)
+
+        if not dedup.ENABLED:
+            return await create()
+        key = dedup.submission_key("ai-check", ai_options, text=text, url=url, file_digest=file_digest)
+        return (await dedup.index.submit(key, create))[0]
+
+    results = dict(zip(pipeline.PARTS, await asyncio.gather(create_report(), create_ai_report(),
+                                                            return_exceptions=True)))
+    ids, errors = {}, {}
+    for part, result in results.items():
+        if isinstance(result, HTTPException):
+            errors[part] = str(result.detail)[:500]
+        elif isinstance(result, BaseException):
+            raise result
         else:
-            payload = {"is_search_filter_chars": is_search_filter_chars, "is_json": is_json}
-            if text:
-                payload["text"] = text
-            if url:
-                payload["url"] = url
-            if title:
-                payload["title"] = title
-            if group_id:
-                payload["group_id"] = group_id
-            if user_id:
-                payload["user_id"] = user_id
-            if file_id:
-                payload["file_id"] = file_id
-            response = await client.post(
-                f"{API_BASE_URL}/storage/create",
-                headers={**headers(), "Content-Type": "application/json"},
-                json=payload
-            )
+            ids[part] = pipeline.upstream_id(result)
+    if not ids:
+        raise results[pipeline.REPORT]
+    if fingerprint is not None:
+        near_dup.remember(fingerprint, "check", title=title or (file.filename if file else None),
+                          result=results[pipeline.REPORT] if pipeline.REPORT in ids else None)
+    pipeline_id = pipeline.store.create(title, ids, errors)
+    response.headers["Location"] = f"/pipeline/{pipeline_id}"
+    merged = {"pipeline_id": pipeline_id}
+    for part in pipeline.PARTS:
+        merged[part] = results[part] if part in ids else {"error": errors[part]}
+    if candidates:
+        merged["near_duplicates"] = candidates
+    return merged
+
+def get_pipeline(pipeline_id: str) -> dict:
+    found = pipeline.store.get(pipeline_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Pipeline not found.")
+    return found
+
+async def pipeline_summary(found: dict) -> dict:
+    fetchers = {pipeline.REPORT: poll_report_status, pipeline.AI_REPORT: fetch_ai_status}
+
+    async def status(part: str):
         try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-        return response.json()
+            return await fetchers[part](found["ids"][part])
+        except HTTPException as e:
+            return str(e.detail)[:500]
+
+    parts = [part for part in pipeline.PARTS if found["ids"][part] is not None]
+    statuses = dict(zip(parts, await asyncio.gather(*[status(part) for part in parts])))
+    return pipeline.summary(found, statuses)
+
+@app.get("/pipeline/{pipeline_id}")
+async def pipeline_status(pipeline_id: str):
+    """Merged status and progress of both reports of a pipeline."""
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API key not set.")
+    return await pipeline_summary(get_pipeline(pipeline_id))
+
+@app.get("/pipeline/{pipeline_id}/stream")
+async def pipeline_stream(pipeline_id: str, request: Request):
+    """Server-sent status events of both reports; ends once both are finished."""
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API key not set.")
+    found = get_pipeline(pipeline_id)
+    hubs = {pipeline.REPORT: progress_hub, pipeline.AI_REPORT: ai_progress_hub}
+    parts = {part: (hubs[part], found["ids"][part]) for part in pipeline.PARTS if found["ids"][part] is not None}
+    return StreamingResponse(
+        progress_stream.stream_many(parts, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/pipeline/{pipeline_id}/result")
+async def pipeline_result(pipeline_id: str, request: Request, response: Response, show_relations: int = 0):
+    """
+    Both finished reports in one response, or 202 with the merged status
+    while either is still being checked.
+    """
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API key not set.")
+    found = get_pipeline(pipeline_id)
+    summary = await pipeline_summary(found)
+    if not summary["done"]:
+        response.status_code = 202
+        return summary
+    report_id, ai_report_id = found["ids"][pipeline.REPORT], found["ids"][pipeline.AI_REPORT]
+
+    async def report():
+        if report_id is None:
+            return {"error": found["errors"][pipeline.REPORT]}
+
+        async def fetch():
+            return await upstream.get_raw(f"{API_BASE_URL}/reports/{report_id}", headers(), {"show_relations": show_relations})
+
+        return (await report_cache.cache.get_or_fetch(report_cache.REPORT, report_id, show_relations, fetch,
+                                                      on_failed=dedup.index.forget_report))[0]
+
+    async def ai_report():
+        if ai_report_id is None:
+            return {"error": found["errors"][pipeline.AI_REPORT]}
+
+        async def fetch():
+            return await upstream.get_raw(f"{API_BASE_URL}/ai-reports/{ai_report_id}", headers(), {"show_relations": show_relations})
+
+        return (await report_cache.cache.get_or_fetch(report_cache.AI_REPORT, ai_report_id, show_relations, fetch))[0]
+
+    bodies = await asyncio.gather(report(), ai_report())
+    merged = passthrough.compose({"pipeline_id": pipeline_id, "summary": summary,
+                                  pipeline.REPORT: bodies[0], pipeline.AI_REPORT: bodies[1]})
+    return passthrough.respond(request, merged)
+
+@app.get("/jobs/stats")
+async def job_queue_stats():
+    """Queue depth, worker count and submit/retry counters of the job queue."""
+    return jobs.queue.stats()
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """State of a queued submission; once done, `result` holds the upstream create response."""
+    job = jobs.queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return jobs.public(job)
+
+async def report_status(report_id: int, response: Response):
+    """
+    Answer a status poll from the local status store, falling back to
+    upstream when the report is unknown or its in-progress status is stale.
+    While the upstream circuit breaker is open a stale status beats a 503.
+    """
+    stored = status_store.store.get(report_id)
+    if stored is not None:
+        status_store.store.local_hits += 1
+        response.headers["X-Status-Source"] = "local"
+        return stored
+    try:
+        data = await fetch_upstream_status(report_id)
+    except upstream.CircuitOpenError:
+        stored = status_store.store.get(report_id, allow_stale=True)
+        if stored is None:
+            raise
+        response.headers["X-Status-Source"] = "stale"
+        return stored
+    response.headers["X-Status-Source"] = "upstream"
+    return data
+
+async def fetch_upstream_status(report_id: int):
+    """Fetch a report status from upstream and record it in the status store."""
+    data = await upstream.get_json(f"{API_BASE_URL}/reports/status/{report_id}", headers())
+    status_store.store.upstream_fetches += 1
+    status_store.store.put(report_id, data)
+    if report_cache.is_failed(data):
+        # A failed check should not be handed out again for duplicate submissions.
+        dedup.index.forget_report(report_id)
+    return data
+
+async def poll_report_status(report_id: int):
+    """Status source for the progress stream poller; finished reports never hit upstream."""
+    stored = status_store.store.get(report_id)
+    if stored is not None and report_cache.is_terminal(stored):
+        status_store.store.local_hits += 1
+        return stored
+    return await fetch_upstream_status(report_id)
+
+progress_hub = progress_stream.ProgressHub(poll_report_status)
+
+async def fetch_ai_status(report_id: int):
+    return await upstream.get_json(f"{API_BASE_URL}/ai-reports/status/{report_id}", headers())
+
+ai_progress_hub = progress_stream.ProgressHub(fetch_ai_status)
 
 @app.get("/status/{report_id}")
-async def check_status(report_id: int):
+async def check_status(report_id: int, response: Response):
     """Get the status of a plagiarism check."""
     if not API_KEY:
         raise HTTPException(status_code=500, detail="API key not set.")
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{API_BASE_URL}/reports/status/{report_id}",
-            headers=headers()
-        )
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-        return response.json()
+    return await report_status(report_id, response)
+
+async def respond_report(request: Request, body, outcome: str, fields: Optional[str], sources_offset: int,
+                         sources_limit: Optional[int]):
+    """Send a report body, cut down first when the client asked for `fields` or a window of sources."""
+    selected = projection.parse_fields(fields)
+    if projection.wanted(selected, sources_offset, sources_limit):
+        body = await asyncio.to_thread(projection.project, body, selected, sources_offset, sources_limit)
+    return passthrough.respond(request, body, {"X-Cache": outcome})
 
 @app.get("/report/{report_id}")
-async def get_report(report_id: int, show_relations: int = 0):
+async def get_report(report_id: int, request: Request, show_relations: int = 0, fields: Optional[str] = None,
+                     sources_offset: int = Query(0, ge=0), sources_limit: Optional[int] = Query(None, ge=0)):
     """Retrieve the plagiarism report data."""
     if not API_KEY:
         raise HTTPException(status_code=500, detail="API key not set.")
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{API_BASE_URL}/reports/{report_id}",
-            headers=headers(),
-            params={"show_relations": show_relations}
-        )
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-        return response.json()
+
+    async def fetch():
+        return await upstream.get_raw(f"{API_BASE_URL}/reports/{report_id}", headers(), {"show_relations": show_relations})
+
+    body, outcome = await report_cache.cache.get_or_fetch(report_cache.REPORT, report_id, show_relations, fetch,
+                                                          on_failed=dedup.index.forget_report)
+    return await respond_report(request, body, outcome, fields, sources_offset, sources_limit)
 
 @app.put("/reports/update/{report_id}")
 async def update_report(report_id: int, data: dict = Body(...)):
     if not API_KEY:
         raise HTTPException(status_code=500, detail="API key not set.")
-    async with httpx.AsyncClient() as client:
-        response = await client.put(
-            f"{API_BASE_URL}/reports/update/{report_id}",
-            headers={**headers(), "Content-Type": "application/json"},
-            json=data
-        )
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-        return response.json()
+    result = await upstream.request_json(
+        "PUT",
+        f"{API_BASE_URL}/reports/update/{report_id}",
+        headers={**headers(), "Content-Type": "application/json"},
+        json=data
+    )
+    report_cache.cache.invalidate(report_id)
+    return result
 
 @app.delete("/reports/delete/{report_id}")
 async def delete_report(report_id: int):
     if not API_KEY:
         raise HTTPException(status_code=500, detail="API key not set.")
-    async with httpx.AsyncClient() as client:
-        response = await client.delete(
-            f"{API_BASE_URL}/reports/delete/{report_id}",
-            headers=headers()
-        )
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-        return response.json()
+    result = await upstream.request_json(
+        "DELETE",
+        f"{API_BASE_URL}/reports/delete/{report_id}",
+        headers=headers()
+    )
+    dedup.index.forget_report(report_id)
+    report_cache.cache.invalidate(report_id)
+    status_store.store.forget(report_id)
+    return result
 
 @app.get("/reports/sources/{report_id}")
-async def get_grouped_sources(report_id: int):
+async def get_grouped_sources(report_id: int, request: Request, fields: Optional[str] = None,
+                              sources_offset: int = Query(0, ge=0), sources_limit: Optional[int] = Query(None, ge=0)):
     if not API_KEY:
         raise HTTPException(status_code=500, detail="API key not set.")
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{API_BASE_URL}/reports/sources/{report_id}",
-            headers=headers()
-        )
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-        return response.json()
+
+    async def fetch():
+        return await upstream.get_raw(f"{API_BASE_URL}/reports/sources/{report_id}", headers())
+
+    body, outcome = await report_cache.cache.get_or_fetch(report_cache.SOURCES, report_id, 0, fetch,
+                                                          on_failed=dedup.index.forget_report)
+    return await respond_report(request, body, outcome, fields, sources_offset, sources_limit)
 
 @app.get("/reports/html/{report_id}")
-async def get_html_report(report_id: int):
+async def get_html_report(report_id: int, request: Request):
     if not API_KEY:
         raise HTTPException(status_code=500, detail="API key not set.")
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{API_BASE_URL}/reports/html/{report_id}",
-            headers=headers()
-        )
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-        return response.json()
+
+    async def fetch():
+        return await upstream.get_raw(f"{API_BASE_URL}/reports/html/{report_id}", headers())
+
+    body, outcome = await report_cache.cache.get_or_fetch(report_cache.HTML, report_id, 0, fetch)
+    return passthrough.respond(request, body, {"X-Cache": outcome})
+
+async def render_report_pdf(report_id: int) -> str:
+    """Path of the report's PDF, rendered from its (cached) HTML report unless already in the PDF cache."""
+    async def fetch():
+        return await upstream.get_raw(f"{API_BASE_URL}/reports/html/{report_id}", headers())
+
+    body, _ = await report_cache.cache.get_or_fetch(report_cache.HTML, report_id, 0, fetch)
+    html_content = (body.json().get("data") or {}).get("html", "")
+    if not html_content:
+        raise HTTPException(status_code=404, detail="No HTML content found for this report.")
+    return await pdf_render.renderer.render(report_id, html_content)
 
 @app.get("/report/pdf/{report_id}")
 async def report_pdf(report_id: int):
     if not API_KEY:
         raise HTTPException(status_code=500, detail="API key not set.")
-    if HTML is None:
+    if not pdf_render.AVAILABLE:
         raise HTTPException(status_code=500, detail="WeasyPrint is not installed. Please install with 'pip install weasyprint'.")
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{API_BASE_URL}/reports/html/{report_id}",
-            headers=headers()
-        )
-        response.raise_for_status()
-        data = response.json()
-        html_content = data.get("data", {}).get("html", "")
-        if not html_content:
-            raise HTTPException(status_code=404, detail="No HTML content found for this report.")
-        # Add default styling for PDF
-        style = '''<style>body { font-family: Arial, sans-serif; margin: 2em; color: #222; } .ps-rb-ai { background: #ffe4b2; } .rb-r { background: #ffb3b3; } .rb-y { background: #fff7b2; } .rb-p { background: #b2e0ff; } .ps-rb-ai { background: #e6e6ff; } .status--10 .rp, .status--11 .rp { background: #e0e0e0; } .report-section { margin-bottom: 2em; padding: 1em; border-radius: 8px; background: #fff; box-shadow: 0 2px 8px #0001; } a { color: #2980b9; }</style>'''
-        html_full = f"<html><head>{style}</head><body>{html_content}</body></html>"
-        pdf_io = io.BytesIO()
-        HTML(string=html_full).write_pdf(pdf_io)
-        pdf_io.seek(0)
-        return StreamingResponse(pdf_io, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=report_{report_id}.pdf"})
+    path = await render_report_pdf(report_id)
+    return FileResponse(path, media_type="application/pdf", filename=pdf_archive.entry_name(report_id))
+
+async def remote_report_ids(remote_id: str) -> List[int]:
+    """Ids of every report with this remote_id, read page by page from GET /reports."""
+    ids = []
+    page = 1
+    while True:
+        payload = await upstream.get_json(f"{API_BASE_URL}/reports", headers(),
+                                          {"remote_id": remote_id, "page": page, "limit": listing.PAGE_SIZE})
+        items = listing.page_items(payload)
+        ids.extend(item["id"] for item in items if isinstance(item, dict) and "id" in item)
+        if len(ids) > pdf_archive.MAX_REPORTS:
+            break
+        last = listing.total_pages(payload, listing.PAGE_SIZE)
+        if len(items) < listing.PAGE_SIZE or (last is not None and page >= last) or page >= listing.MAX_PAGES:
+            break
+        page += 1
+    return ids
+
+@app.get("/reports/pdf/archive")
+async def report_pdf_archive(ids: Optional[List[int]] = Query(None), remote_id: Optional[str] = Query(None)):
+    """A ZIP of the PDFs of the given reports, or of every report with `remote_id`, streamed as they render."""
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API key not set.")
+    if not pdf_render.AVAILABLE:
+        raise HTTPException(status_code=500, detail="WeasyPrint is not installed. Please install with 'pip install weasyprint'.")
+    if not ids and not remote_id:
+        raise HTTPException(status_code=422, detail="Pass report ids or a remote_id.")
+    filename = "reports.zip"
+    if not ids:
+        filename = "reports_{}.zip".format("".join(c for c in remote_id if c.isalnum() or c in "-_.") or "remote")
+        ids = await remote_report_ids(remote_id)
+        if not ids:
+            raise HTTPException(status_code=404, detail="No reports found for this remote_id.")
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > pdf_archive.MAX_REPORTS:
+        raise HTTPException(status_code=413, detail=f"An archive holds at most {pdf_archive.MAX_REPORTS} reports.")
+    return StreamingResponse(pdf_archive.stream(ids, render_report_pdf), media_type=pdf_archive.MEDIA_TYPE,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/pdf/stats")
+async def pdf_render_stats():
+    """Render queue depth, render times, PDF cache hits and archive downloads."""
+    return {**pdf_render.renderer.stats(), "archives": pdf_archive.stats}
 
 @app.get("/ai-reports/{report_id}")
-async def get_ai_report(report_id: int, show_relations: int = 0):
+async def get_ai_report(report_id: int, request: Request, show_relations: int = 0, fields: Optional[str] = None,
+                        sources_offset: int = Query(0, ge=0), sources_limit: Optional[int] = Query(None, ge=0)):
     if not API_KEY:
         raise HTTPException(status_code=500, detail="API key not set.")
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{API_BASE_URL}/ai-reports/{report_id}",
-            headers=headers(),
-            params={"show_relations": show_relations}
-        )
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-        return response.json()
+
+    async def fetch():
+        return await upstream.get_raw(f"{API_BASE_URL}/ai-reports/{report_id}", headers(), {"show_relations": show_relations})
+
+    body, outcome = await report_cache.cache.get_or_fetch(report_cache.AI_REPORT, report_id, show_relations, fetch)
+    return await respond_report(request, body, outcome, fields, sources_offset, sources_limit)
 
 @app.get("/ai-reports/html/{report_id}")
-async def get_ai_html_report(report_id: int):
+async def get_ai_html_report(report_id: int, request: Request):
     if not API_KEY:
         raise HTTPException(status_code=500, detail="API key not set.")
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{API_BASE_URL}/ai-reports/{report_id}",
-            headers=headers(),
-            params={"show_relations": -3}
-        )
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-        return response.json()
+
+    async def fetch():
+        return await upstream.get_raw(f"{API_BASE_URL}/ai-reports/{report_id}", headers(), {"show_relations": -3})
+
+    body, outcome = await report_cache.cache.get_or_fetch(report_cache.AI_HTML, report_id, 0, fetch)
+    return passthrough.respond(request, body, {"X-Cache": outcome})
 
 @app.post("/webhook/plagiarismsearch")
-async def plagiarismsearch_webhook(request: Request):
-    data = await request.json()
-    # You can log, process, or trigger actions here
-    # For now, just return the received payload
+async def plagiarismsearch_webhook(request: Request, token: Optional[str] = Query(None)):
+    """
+    Receive ReportCheckedWebhook callbacks and record the report status locally,
+    so status polls no longer need to reach upstream.
+
+    Without WEBHOOK_TOKEN anyone can call this, so a callback is only taken as a
+    hint: a final status is fetched from upstream before it is stored.
+    """
+    if WEBHOOK_TOKEN:
+        if token is None or not hmac.compare_digest(token.encode(), WEBHOOK_TOKEN.encode()):
+            raise HTTPException(status_code=403, detail="Invalid webhook token.")
+    elif WEBHOOK_CALLBACK_URL:
+        raise HTTPException(status_code=503, detail="Webhook disabled: WEBHOOK_CALLBACK_URL requires WEBHOOK_TOKEN.")
+    try:
+        if "application/json" in request.headers.get("content-type", ""):
+            data = await request.json()
+        else:
+            data = dict(await request.form())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Webhook payload is not valid JSON.")
+    report = status_store.webhook_report(data)
+    if report is None:
+        raise HTTPException(status_code=400, detail="Webhook payload does not contain a report id.")
+    try:
+        report_id = int(report["id"])
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Webhook report id must be an integer.")
+    if WEBHOOK_TOKEN or not report_cache.is_terminal_status(report.get("status")):
+        response = status_store.store.record_webhook(report_id, report)
+    else:
+        response = await fetch_upstream_status(report_id)
+    progress_hub.publish(report_id, response)
+    if report_cache.is_failed(response):
+        dedup.index.forget_report(report_id)
     return {"received": data}
 
 @app.get("/progress/{report_id}")
-async def progress_status(report_id: int):
+async def progress_status(report_id: int, response: Response):
     if not API_KEY:
         raise HTTPException(status_code=500, detail="API key not set.")
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            f"{API_BASE_URL}/reports/status/{report_id}",
-            headers=headers()
-        )
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
-        return response.json()
+    return await report_status(report_id, response)
+
+@app.get("/progress/{report_id}/stream")
+async def progress_stream_events(report_id: int, request: Request):
+    """
+    Server-sent events with the report status whenever it changes. The stream
+    ends after a terminal status; all subscribers of a report share one poller.
+    """
+    if not API_KEY:
+        raise HTTPException(status_code=500, detail="API key not set.")
+    return StreamingResponse(
+        progress_stream.stream(progress_hub, report_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/progress-stream/stats")
+async def progress_stream_stats():
+    return progress_hub.stats()
 
 @app.get("/healthz")
 async def health_check():
+    """Latest result of the background upstream probe; never calls upstream itself."""
     if not API_KEY:
         return {"error": "API key not set"}
-    async with httpx.AsyncClient() as client:
-        print("Sending headers:", headers())
-        response = await client.get(
-            f"{API_BASE_URL}/reports",
-            headers=headers()
-        )
-        return {
-            "status_code": response.status_code,
-            "response_text": response.text
-        }
+    return health.probe.snapshot()
 
 @app.post("/test-direct")
 async def test_direct():
@@ -560,7 +1257,7 @@ async def test_direct():
         "is_search_storage": "1",
         "is_json": "1"
     }
-    async with httpx.AsyncClient() as client:
+    async with upstream.client() as client:
         print("Sending headers:", headers())
         response = await client.post(
             f"{API_BASE_URL}/reports/create",
@@ -0,0 +1,128 @@
+"""
+Local store of report statuses fed by PlagiarismSearch webhooks.
+
+The ReportCheckedWebhook payload (and every status fetched from upstream) is
+kept per report id, so /status/{id} and /progress/{id} can be answered locally.
+Terminal statuses never go stale; in-progress ones are refreshed upstream once
+they are older than STATUS_STALE_SECONDS. The most recently used
+STATUS_MEMORY_ENTRIES statuses are also kept in memory.
+"""
+from collections import OrderedDict
+from typing import Optional
+import os
+import time
+
+import datastore
+import passthrough
+from report_cache import is_terminal_status
+
+STALE_SECONDS = float(os.getenv("STATUS_STALE_SECONDS", "10"))
+MEMORY_MAX_ENTRIES = int(os.getenv("STATUS_MEMORY_ENTRIES", "10000"))
+
+WEBHOOK = "webhook"
+UPSTREAM = "upstream"
+
+
+def webhook_report(payload) -> Optional[dict]:
+    """Pull the report object out of a webhook body ({"data": {...}} or the bare report)."""
+    if not isinstance(payload, dict):
+        return None
+    data = payload.get("data")
+    if isinstance(data, dict) and "id" in data:
+        return data
+    if "id" in payload:
+        return payload
+    return None
+
+
+class StatusStore:
+    def __init__(self, db_name: str = "status.sqlite3", stale_seconds: float = STALE_SECONDS,
+                 memory_max_entries: int = MEMORY_MAX_ENTRIES):
+        self.stale_seconds = stale_seconds
+        self.memory_max_entries = memory_max_entries
+        self._memory: OrderedDict = OrderedDict()
+        self.local_hits = 0
+        self.upstream_fetches = 0
+        self.webhooks = 0
+        self._db = datastore.connect(db_name)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS statuses ("
+            " report_id INTEGER PRIMARY KEY, status INTEGER, response TEXT NOT NULL,"
+            " source TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def _remember(self, report_id: int, entry: dict):
+        self._memory[report_id] = entry
+        self._memory.move_to_end(report_id)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+
+    def _load(self, report_id: int) -> Optional[dict]:
+        entry = self._memory.get(report_id)
+        if entry is not None:
+            self._memory.move_to_end(report_id)
+            return entry
+        row = self._db.execute(
+            "SELECT response, source, updated FROM statuses WHERE report_id = ?", (report_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        entry = {"response": passthrough.loads(row[0]), "source": row[1], "updated": row[2]}
+        self._remember(report_id, entry)
+        return entry
+
+    def get(self, report_id: int, allow_stale: bool = False) -> Optional[dict]:
+        """Return the stored upstream-shaped status response, or None if unknown (or stale, unless allowed)."""
+        entry = self._load(report_id)
+        if entry is None:
+            return None
+        data = entry["response"].get("data") or {}
+        if allow_stale:
+            return entry["response"]
+        if not is_terminal_status(data.get("status")) and time.time() - entry["updated"] > self.stale_seconds:
+            return None
+        return entry["response"]
+
+    def put(self, report_id: int, response: dict, source: str = UPSTREAM):
+        data = response.get("data") if isinstance(response, dict) else None
+        status = data.get("status") if isinstance(data, dict) else None
+        current = self._load(report_id)
+        # Never let a late in-progress poll overwrite a terminal status we already know.
+        if current is not None and not is_terminal_status(status):
+            known = (current["response"].get("data") or {}).get("status")
+            if is_terminal_status(known):
+                return
+        now = time.time()
+        self._remember(report_id, {"response": response, "source": source, "updated": now})
+        self._db.execute(
+            "INSERT OR REPLACE INTO statuses (report_id, status, response, source, updated)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (report_id, status, passthrough.dumps(response).decode(), source, now),
+        )
+
+    def record_webhook(self, report_id: int, report: dict) -> dict:
+        """Store a ReportCheckedWebhook report object in the /reports/status response shape."""
+        self.webhooks += 1
+        response = {"status": True, "code": 200, "data": report}
+        self.put(report_id, response, source=WEBHOOK)
+        return response
+
+    def forget(self, report_id: int):
+        self._memory.pop(report_id, None)
+        self._db.execute("DELETE FROM statuses WHERE report_id = ?", (report_id,))
+
+    def stats(self) -> dict:
+        entries = self._db.execute("SELECT COUNT(*) FROM statuses").fetchone()[0]
+        lookups = self.local_hits + self.upstream_fetches
+        return {
+            "entries": entries,
+            "memory_entries": len(self._memory),
+            "stale_seconds": self.stale_seconds,
+            "webhooks": self.webhooks,
+            "local_hits": self.local_hits,
+            "upstream_fetches": self.upstream_fetches,
+            "local_ratio": round(self.local_hits / lookups, 4) if lookups else None,
+        }
+
+
+store = StatusStore()
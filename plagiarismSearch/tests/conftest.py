@@ -0,0 +1,140 @@
+"""
+Shared fixtures for the proxy's behavior tests.
+
+The proxy's stores are module-level singletons that open their SQLite files on
+import, so the environment is set up here before any proxy module is imported:
+a throwaway PROXY_DATA_DIR, a dummy API key, no rate limiting, fast retries and
+a breaker that never opens on its own (tests that need one build their own).
+Upstream is either the benchmark mock (bench/mock_upstream.py, served in
+process through httpx.ASGITransport) or an httpx.MockTransport handler.
+"""
+import asyncio
+import atexit
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+DATA_DIR = tempfile.mkdtemp(prefix="proxy-tests-")
+atexit.register(shutil.rmtree, DATA_DIR, ignore_errors=True)
+
+os.environ.update({
+    "PROXY_DATA_DIR": DATA_DIR,
+    "PLAGIARISMSEARCH_API_KEY": "test-key",
+    "PLAGIARISMSEARCH_API_BASE_URL": "http://upstream.test/api/v3",
+    "WEBHOOK_TOKEN": "",
+    "WEBHOOK_CALLBACK_URL": "",
+    "HEALTH_PROBE_INTERVAL": "0",
+    "UPSTREAM_RATE_LIMIT": "none",
+    "UPSTREAM_RETRY_BASE_DELAY": "0.01",
+    "UPSTREAM_RETRY_MAX_DELAY": "0.1",
+    "UPSTREAM_BREAKER_FAILURES": "1000000",
+    "JOBS_RETRY_BASE_DELAY": "0.01",
+    "MOCK_LATENCY_MS": "0",
+    "MOCK_JITTER_MS": "0",
+    "MOCK_REPORT_SECONDS": "0",
+    "MOCK_SOURCES": "20",
+    "MOCK_HTML_KB": "1",
+})
+sys.path[:0] = [ROOT, os.path.join(ROOT, "bench")]
+os.chdir(ROOT)
+
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import mock_upstream
+import pdf_render
+import server
+import upstream
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class _Stream(httpx.AsyncByteStream):
+    """Unread response body, so raw reads (aiter_raw) work as they do against a real server."""
+
+    def __init__(self, data: bytes):
+        self._data = data
+
+    async def __aiter__(self):
+        yield self._data
+
+
+def reply(payload=None, status_code: int = 200, headers: dict = None, content: bytes = None) -> httpx.Response:
+    """An httpx.Response for MockTransport handlers, with `payload` as its JSON body."""
+    body = content if content is not None else json.dumps(payload).encode()
+    return httpx.Response(status_code, headers={"content-type": "application/json", **(headers or {})},
+                          stream=_Stream(body))
+
+
+def ok(data) -> httpx.Response:
+    return reply({"status": True, "code": 200, "data": data})
+
+
+_report_ids = itertools.count(100000)
+
+
+@pytest.fixture
+def report_id() -> int:
+    """A report id no other test has used, so the app's caches and stores start empty for it."""
+    return next(_report_ids)
+
+
+def _install(transport):
+    previous = upstream._client
+    upstream._client = httpx.AsyncClient(transport=transport)
+    return previous
+
+
+@pytest.fixture(scope="session")
+def client():
+    """The proxy app, with its lifespan running, in front of the in-process mock upstream."""
+    _install(httpx.ASGITransport(app=mock_upstream.app))
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def upstream_handler(client):
+    """Route upstream calls to a MockTransport handler for one test: `upstream_handler(fn)`."""
+    previous = []
+
+    def install(handler):
+        previous.append(_install(httpx.MockTransport(handler)))
+
+    yield install
+    if previous:
+        upstream._client = previous[0]
+
+
+def fake_render(html_full: str, path: str) -> float:
+    """Stands in for WeasyPrint: writes the HTML into a file that looks like a PDF."""
+    if "render-fails" in html_full:
+        raise RuntimeError("render failed")
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4 " + html_full.encode())
+    return 0.001
+
+
+@pytest.fixture
+def pdf_renderer(monkeypatch):
+    """A fresh PdfRenderer installed as the app's renderer, rendering with fake_render on threads."""
+    renderer = pdf_render.PdfRenderer(workers=2, max_queue=4)
+    renderer._pool = ThreadPoolExecutor(2)
+    renderer._slots = asyncio.Semaphore(2)
+    monkeypatch.setattr(pdf_render, "_render", fake_render)
+    monkeypatch.setattr(pdf_render, "renderer", renderer)
+    monkeypatch.setattr(pdf_render, "AVAILABLE", True)
+    yield renderer
+    renderer.shutdown()
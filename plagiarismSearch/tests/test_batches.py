@@ -0,0 +1,125 @@
+import io
+import zipfile
+
+import pytest
+
+import batches
+import uploads
+
+URL = "/check/batch"
+
+
+def test_json_batch_is_submitted_and_summarized(client, report_id):
+    texts = [f"batch {report_id} document {n}" for n in range(3)]
+    response = client.post(URL, json={"items": texts + ["https://example.com/paper"], "options": {"is_search_web": 0}})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["submitted"], body["failed"]) == (4, 0)
+    assert [item["source"] for item in body["items"]] == ["text"] * 3 + ["url"]
+    summary = client.get(f"{URL}/{body['batch_id']}").json()["summary"]
+    assert summary["submitted"] == 4
+    assert summary["done"] is True
+
+
+def test_duplicate_items_share_a_report(client, report_id):
+    text = f"batch duplicate {report_id}"
+    items = client.post(URL, json=[text, {"text": text, "title": "again"}]).json()["items"]
+    assert items[0]["report_id"] == items[1]["report_id"]
+    assert sorted(item["dedup"] for item in items) == ["inflight", "miss"]
+
+
+@pytest.mark.parametrize("body", [
+    [],
+    {},
+    {"items": "text"},
+    {"items": ["ok"], "options": []},
+    {"items": ["ok"], "options": "is_search_web=0"},
+    {"items": ["ok"], "options": {"callback_url": 5}},
+    [None],
+    [{"title": "no content"}],
+    [{"text": 5}],
+    [{"url": ["https://example.com"]}],
+    [{"text": "ok", "title": {"nested": True}}],
+])
+def test_invalid_json_batches_are_400(client, body):
+    response = client.post(URL, json=body)
+    assert response.status_code == 400, response.text
+
+
+def test_non_json_body_is_400(client):
+    assert client.post(URL, content=b"text=abc", headers={"content-type": "text/plain"}).status_code == 400
+
+
+def test_non_integer_option_is_422(client):
+    response = client.post(URL, json={"items": ["ok"], "options": {"is_search_web": "yes"}})
+    assert response.status_code == 422
+
+
+def test_too_many_items_is_413(client, monkeypatch):
+    monkeypatch.setattr(batches, "MAX_ITEMS", 2)
+    assert client.post(URL, json=["a", "b", "c"]).status_code == 413
+
+
+def zip_upload(files: dict) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def test_zip_batch_submits_document_members(client, report_id):
+    archive = zip_upload({
+        "papers/one.txt": f"first {report_id}",
+        "papers/two.tex": f"second {report_id}",
+        "papers/.hidden.txt": "skipped",
+        "__MACOSX/papers/._one.txt": "skipped",
+        "papers/figure.png": b"\x89PNG",
+    })
+    response = client.post(URL, files={"file": ("papers.zip", archive, "application/zip")}, data={"is_search_web": "0"})
+    assert response.status_code == 200
+    body = response.json()
+    assert [item["title"] for item in body["items"]] == ["one.txt", "two.tex"]
+    assert {item["source"] for item in body["items"]} == {"zip"}
+    assert body["submitted"] == 2
+
+
+def test_zip_batch_rejects_bad_uploads(client):
+    assert client.post(URL, files={"file": ("x.zip", b"not a zip", "application/zip")}).status_code == 400
+    assert client.post(URL, files={"other": ("x.zip", zip_upload({"a.txt": "a"}), "application/zip")}).status_code == 400
+    assert client.post(URL, files={"file": ("x.zip", zip_upload({"a.png": "a"}), "application/zip")}).status_code == 400
+
+
+def test_zip_bomb_is_413(client, monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_BYTES", 1000)
+    archive = zip_upload({"big.txt": "x" * 5000})
+    assert len(archive) < 1000
+    assert client.post(URL, files={"file": ("x.zip", archive, "application/zip")}).status_code == 413
+
+
+def corrupt(archive: bytes, name: str) -> bytes:
+    """Flip bytes in the middle of one member's stored data."""
+    info = zipfile.ZipFile(io.BytesIO(archive)).getinfo(name)
+    start = info.header_offset + 30 + len(info.filename) + len(info.extra) + info.compress_size // 2
+    data = bytearray(archive)
+    for offset in range(start, start + 4):
+        data[offset] ^= 0xFF
+    return bytes(data)
+
+
+@pytest.mark.parametrize("compression", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED], ids=["bad-crc", "bad-deflate"])
+def test_corrupt_member_fails_alone(client, report_id, compression):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression) as archive:
+        archive.writestr("good.txt", f"good document {report_id} " * 20)
+        archive.writestr("bad.txt", f"bad document {report_id} " * 20)
+    response = client.post(URL, files={"file": ("x.zip", corrupt(buffer.getvalue(), "bad.txt"), "application/zip")})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["submitted"], body["failed"]) == (1, 1)
+    good, bad = body["items"]
+    assert good["report_id"] is not None
+    assert bad["status_code"] == 400 and "bad.txt" in bad["error"]
+    # The batch was recorded, so the report created for good.txt is not orphaned.
+    items = client.get(f"{URL}/{body['batch_id']}").json()["items"]
+    assert [item["report_id"] for item in items] == [good["report_id"], None]
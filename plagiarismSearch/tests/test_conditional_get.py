@@ -0,0 +1,35 @@
+import pytest
+
+
+def test_etag_answers_304(client, report_id):
+    first = client.get(f"/report/{report_id}")
+    etag = first.headers["ETag"]
+    assert client.get(f"/report/{report_id}", headers={"If-None-Match": etag}).status_code == 304
+    # A tag for another coding of the same body still matches.
+    bare = etag.split("-")[0].strip('"')
+    assert client.get(f"/report/{report_id}", headers={"If-None-Match": f'W/"{bare}-br"'}).status_code == 304
+    assert client.get(f"/report/{report_id}", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_not_modified_has_no_body_and_keeps_the_validators(client, report_id):
+    etag = client.get(f"/reports/sources/{report_id}").headers["ETag"]
+    response = client.get(f"/reports/sources/{report_id}", headers={"If-None-Match": f'"other", {etag}'})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+    assert "Accept-Encoding" in response.headers["Vary"]
+
+
+@pytest.mark.parametrize("accept, coding", [("br", "br"), ("gzip", "gzip"), ("identity", None)])
+def test_content_coding_follows_accept_encoding(client, report_id, accept, coding):
+    response = client.get(f"/reports/sources/{report_id}", headers={"Accept-Encoding": accept})
+    assert response.headers.get("Content-Encoding") == coding
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert len(response.json()["data"]["sources"]) == 20
+
+
+def test_each_coding_has_its_own_tag_for_the_same_body(client, report_id):
+    tags = {accept: client.get(f"/reports/sources/{report_id}", headers={"Accept-Encoding": accept}).headers["ETag"]
+            for accept in ("br", "gzip", "identity")}
+    assert len(set(tags.values())) == 3
+    assert len({tag.strip('"').split("-")[0] for tag in tags.values()}) == 1
@@ -0,0 +1,85 @@
+import asyncio
+import uuid
+
+from fastapi import HTTPException
+import pytest
+
+import dedup
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def index():
+    return dedup.DedupIndex(f"dedup-{uuid.uuid4().hex}.sqlite3")
+
+
+def created(report_id: int) -> dict:
+    return {"status": True, "data": {"id": report_id}}
+
+
+def test_submission_key_ignores_cosmetic_differences():
+    options = {"is_search_web": 1, "is_search_ai": None}
+    key = dedup.submission_key("check", options, text="Some  text\n")
+    assert key == dedup.submission_key("check", {"is_search_web": 1}, text="Some text")
+    assert key != dedup.submission_key("ai-check", options, text="Some text")
+    assert key != dedup.submission_key("check", {"is_search_web": 0}, text="Some text")
+
+
+async def test_concurrent_submissions_share_one_create(index):
+    calls = 0
+
+    async def create():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        return created(11)
+
+    results = await asyncio.gather(*[index.submit("key", create) for _ in range(4)])
+    assert calls == 1
+    assert sorted(outcome for _, outcome in results) == [dedup.INFLIGHT] * 3 + [dedup.MISS]
+    assert all(result == created(11) for result, _ in results)
+    assert await index.submit("key", create) == (created(11), dedup.HIT)
+
+
+async def test_errors_reach_every_waiter_and_are_not_stored(index):
+    async def fail():
+        await asyncio.sleep(0.02)
+        raise HTTPException(status_code=502, detail="down")
+
+    results = await asyncio.gather(*[index.submit("key", fail) for _ in range(3)], return_exceptions=True)
+    assert [r.status_code for r in results] == [502] * 3
+    assert index.get("key") is None
+
+    async def create():
+        return created(12)
+
+    assert await index.submit("key", create) == (created(12), dedup.MISS)
+
+
+async def test_responses_without_report_id_are_not_stored(index):
+    async def create():
+        return {"status": False, "message": "quota"}
+
+    await index.submit("key", create)
+    assert index.get("key") is None
+
+
+async def test_forget_report_drops_its_submissions(index):
+    async def create():
+        return created(13)
+
+    await index.submit("key", create)
+    index.forget_report(13)
+    assert index.get("key") is None
+
+
+def test_lru_eviction_and_ttl():
+    index = dedup.DedupIndex(f"dedup-{uuid.uuid4().hex}.sqlite3", max_entries=2)
+    for n in range(3):
+        index.put(f"key{n}", created(n))
+    assert index.get("key0") is None
+    assert index.evictions == 1
+    expired = dedup.DedupIndex(f"dedup-{uuid.uuid4().hex}.sqlite3", ttl=-1)
+    expired.put("key", created(1))
+    assert expired.get("key") is None
@@ -0,0 +1,55 @@
+import os
+import tempfile
+
+import extract
+import uploads
+
+
+def test_extracted_upload_releases_its_budget_and_temp_file(client, monkeypatch, tmp_path, report_id):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    text = f"Extracted document {report_id}. " * 20
+    response = client.post("/check", files={"file": ("paper.txt", text.encode(), "text/plain")})
+    assert response.status_code == 200
+    assert response.headers["X-Extraction"] == "txt"
+    assert "read" in response.headers["Server-Timing"]
+    assert uploads.budget.in_use == 0
+    assert not [name for name in os.listdir(tmp_path) if name.startswith("extract-")]
+
+
+def test_extraction_reuses_the_request_reservation(client, monkeypatch, report_id):
+    # A 2 MiB document under a 3 MiB budget: it fits once, not twice.
+    data = (f"Budgeted document {report_id}. ".encode() * 80000)[:2 * 1024 * 1024]
+    monkeypatch.setattr(uploads.budget, "capacity", 3 * 1024 * 1024)
+    rejected = uploads.budget.rejected_busy
+    response = client.post("/check", files={"file": ("paper.txt", data, "text/plain")})
+    assert response.status_code == 200
+    assert response.headers["X-Extraction"] == "txt"
+    assert uploads.budget.rejected_busy == rejected
+    assert uploads.budget.in_use == 0
+
+
+def test_upload_spooled_to_disk_is_extracted_from_a_temp_copy(client, monkeypatch, tmp_path, report_id):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    spilled = []
+    real_spill = extract._spill
+
+    def spill(file):
+        spilled.append(real_spill(file))
+        return spilled[-1]
+
+    monkeypatch.setattr(extract, "_spill", spill)
+    data = f"Rolled over document {report_id}. ".encode() * 40000
+    assert len(data) > uploads.UPLOAD_MEMORY_BYTES
+    response = client.post("/check", files={"file": ("paper.txt", data, "text/plain")})
+    assert response.status_code == 200
+    assert response.headers["X-Extraction"] == "txt"
+    assert [size for _, size in spilled] == [len(data)]
+    assert not [name for name in os.listdir(tmp_path) if name.startswith("extract-")]
+
+
+def test_in_memory_upload_is_not_copied(client, monkeypatch, report_id):
+    monkeypatch.setattr(extract, "_spill", lambda file: (_ for _ in ()).throw(AssertionError("copied")))
+    text = f"Small document {report_id}. " * 20
+    response = client.post("/check", files={"file": ("paper.txt", text.encode(), "text/plain")})
+    assert response.status_code == 200
+    assert response.headers["X-Extraction"] == "txt"
@@ -0,0 +1,91 @@
+import asyncio
+import base64
+
+import httpx
+import pytest
+
+from conftest import ok, reply
+import health
+
+URL = "http://upstream.test/api/v3/reports"
+
+
+@pytest.fixture
+def probes(upstream_handler):
+    """Upstream calls made by a probe, answered by `probes.handler` (200 by default)."""
+
+    class Calls(list):
+        handler = staticmethod(lambda request: ok([]))
+
+    calls = Calls()
+
+    def handler(request):
+        calls.append(request)
+        return calls.handler(request)
+
+    upstream_handler(handler)
+    return calls
+
+
+@pytest.mark.anyio
+async def test_probe_asks_for_one_report(probes):
+    probe = health.UpstreamProbe(interval=0)
+    result = await probe.check(URL, {"Authorization": "test-key"})
+    assert result["reachable"] is True
+    assert result["status_code"] == 200
+    assert dict(probes[0].url.params) == {"page": "1", "limit": "1"}
+    assert probes[0].headers["Authorization"] == "test-key"
+    assert probe.snapshot()["probes"] == 1
+
+
+@pytest.mark.anyio
+async def test_probe_reports_failures_without_raising(probes):
+    probe = health.UpstreamProbe(interval=0)
+    probes.handler = lambda request: reply({"status": False}, status_code=503)
+    assert (await probe.check(URL, {}))["reachable"] is False
+
+    def refuse(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    probes.handler = refuse
+    result = await probe.check(URL, {})
+    assert (result["reachable"], result["status_code"], result["error"]) == (False, None, "ConnectError")
+    snapshot = probe.snapshot()
+    assert (snapshot["probes"], snapshot["failures"]) == (2, 2)
+
+
+@pytest.mark.anyio
+async def test_probe_runs_in_the_background_until_stopped(probes):
+    probe = health.UpstreamProbe(interval=0.01)
+    assert probe.snapshot() == {"reachable": None, "checked_at": None, "interval": 0.01}
+    probe.start(URL, dict)
+    await asyncio.sleep(0.1)
+    await probe.stop()
+    stopped = len(probes)
+    assert stopped >= 2
+    await asyncio.sleep(0.05)
+    assert len(probes) == stopped
+
+
+def test_probe_is_not_started_without_an_interval():
+    probe = health.UpstreamProbe(interval=0)
+    probe.start(URL, dict)
+    assert probe._task is None
+
+
+def test_health_endpoints_serve_the_last_probe_without_calling_upstream(client, probes, monkeypatch):
+    probe = health.UpstreamProbe(interval=0)
+    probe.last = {"reachable": True, "status_code": 200, "error": None, "latency_ms": 12.5, "checked_at": 0.0}
+    monkeypatch.setattr(health, "probe", probe)
+    snapshot = client.get("/healthz").json()
+    assert snapshot["reachable"] is True and snapshot["latency_ms"] == 12.5
+    credentials = base64.b64encode(b"cronjob@mintellect:mintellect2025").decode()
+    response = client.get("/health", headers={"Authorization": f"Basic {credentials}"})
+    assert response.status_code == 200
+    assert response.json()["upstream"]["status_code"] == 200
+    assert "memory" in response.json()
+    assert probes == []
+
+
+def test_health_needs_credentials(client):
+    assert client.get("/health").status_code == 401
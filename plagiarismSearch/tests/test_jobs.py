@@ -0,0 +1,149 @@
+import asyncio
+import io
+import multiprocessing
+import os
+import time
+import uuid
+
+from fastapi import HTTPException, UploadFile
+import httpx
+import pytest
+
+import jobs
+import upstream
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def db_name():
+    return f"jobs-{uuid.uuid4().hex}.sqlite3"
+
+
+async def fill(queue: jobs.JobQueue, count: int) -> list:
+    return [(await queue.enqueue("check", "/reports/create", {"text": f"doc {n}"}))["job_id"] for n in range(count)]
+
+
+def claim_all(db_name: str) -> list:
+    """Runs in a separate process: claim jobs until none is left."""
+    queue = jobs.JobQueue(db_name)
+    claimed = []
+    while (job := queue._claim()) is not None:
+        claimed.append(job["job_id"])
+        queue._finish(job, jobs.DONE, result={"data": {"id": 1}})
+    return claimed
+
+
+async def test_processes_never_claim_the_same_job(db_name):
+    ids = await fill(jobs.JobQueue(db_name), 200)
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        claimed = [job_id for batch in pool.map(claim_all, [db_name] * 4) for job_id in batch]
+    assert len(claimed) == len(set(claimed)) == len(ids)
+    assert jobs.JobQueue(db_name).stats()["done"] == len(ids)
+
+
+async def test_claim_is_conditional(db_name):
+    first, second = jobs.JobQueue(db_name), jobs.JobQueue(db_name)
+    [job_id] = await fill(first, 1)
+    assert first._claim()["job_id"] == job_id
+    assert second._claim() is None
+    assert first.get(job_id)["attempts"] == 1
+
+
+async def test_expired_lease_is_reclaimed_and_the_old_owner_cannot_settle(db_name):
+    crashed = jobs.JobQueue(db_name, lease_seconds=0.05)
+    survivor = jobs.JobQueue(db_name)
+    [job_id] = await fill(crashed, 1)
+    job = crashed._claim()
+    assert survivor._claim() is None
+    time.sleep(0.1)
+    reclaimed = survivor._claim()
+    assert reclaimed["job_id"] == job_id and reclaimed["attempts"] == 2
+    assert survivor.recovered == 1
+    assert not crashed._finish(job, jobs.DONE, result={"data": {"id": 1}})
+    assert crashed.lost == 1
+    assert survivor._finish(reclaimed, jobs.DONE, result={"data": {"id": 2}})
+    assert survivor.get(job_id)["report_id"] == 2
+
+
+async def test_running_lease_is_renewed(db_name):
+    queue = jobs.JobQueue(db_name, lease_seconds=0.1)
+    await fill(queue, 1)
+    job = queue._claim()
+    renewer = asyncio.create_task(queue._keep_lease(job))
+    await asyncio.sleep(0.25)
+    assert jobs.JobQueue(db_name)._claim() is None
+    renewer.cancel()
+
+
+async def test_stop_only_requeues_its_own_jobs(db_name):
+    mine, theirs = jobs.JobQueue(db_name), jobs.JobQueue(db_name)
+    await fill(mine, 2)
+    mine_job, their_job = mine._claim(), theirs._claim()
+    await mine.stop()
+    assert mine.get(mine_job["job_id"])["state"] == jobs.QUEUED
+    assert mine.get(their_job["job_id"])["state"] == jobs.RUNNING
+
+
+async def test_worker_retries_throttled_submissions_and_cleans_up(db_name):
+    queue = jobs.JobQueue(db_name, workers=1)
+    upload = UploadFile(io.BytesIO(b"document body"), filename="doc.txt")
+    job = await queue.enqueue("check", "/reports/create", {}, upload=upload, meta={"content_key": "k"})
+    path = job["document"]["file"]
+    with open(path, "rb") as f:
+        assert f.read() == b"document body"
+    attempts, done = [], asyncio.Event()
+
+    async def send(job):
+        attempts.append(job["attempts"])
+        if len(attempts) == 1:
+            raise HTTPException(status_code=429, detail="slow down")
+        return {"data": {"id": 42}}
+
+    def on_done(job, result):
+        assert job["meta"] == {"content_key": "k"}
+        done.set()
+
+    queue.start(send, on_done)
+    try:
+        await asyncio.wait_for(done.wait(), 5)
+    finally:
+        await queue.stop()
+    finished = queue.get(job["job_id"])
+    assert (finished["state"], finished["report_id"], attempts) == (jobs.DONE, 42, [1, 2])
+    assert queue.retried == 1
+    assert not os.path.exists(path)
+
+
+async def test_non_retryable_errors_fail_the_job(db_name):
+    queue = jobs.JobQueue(db_name)
+    [job_id] = await fill(queue, 1)
+
+    async def send(job):
+        raise upstream.UpstreamTransportError(httpx.ReadTimeout("slow"))
+
+    await queue._run(queue._claim(), send, lambda job, result: None)
+    failed = queue.get(job_id)
+    assert failed["state"] == jobs.FAILED
+    assert "ReadTimeout" in failed["error"]
+    assert jobs.public(failed)["error"] == failed["error"]
+
+
+def test_wants_async():
+    assert jobs.wants_async("respond-async, wait=5")
+    assert not jobs.wants_async(None)
+
+
+def test_queued_submission_through_the_api(client, report_id):
+    response = client.post("/check", data={"text": f"queued document {report_id}"},
+                           headers={"Prefer": "respond-async"})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    for _ in range(100):
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["state"] != jobs.QUEUED and job["state"] != jobs.RUNNING:
+            break
+        time.sleep(0.02)
+    assert job["state"] == jobs.DONE
+    assert job["result"]["data"]["id"] == job["report_id"]
+    assert client.get("/jobs/missing").status_code == 404
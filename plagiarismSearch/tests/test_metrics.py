@@ -0,0 +1,60 @@
+import re
+
+import metrics
+
+
+def scrape(client) -> str:
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == metrics.CONTENT_TYPE
+    return response.text
+
+
+def sample(text: str, name: str, **labels) -> float:
+    """The value of one sample line, matched on its name and (a subset of) its labels."""
+    for line in text.splitlines():
+        if line.startswith("#") or not re.match(rf"{name}(\{{|\s)", line):
+            continue
+        if all(f'{key}="{value}"' in line for key, value in labels.items()):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_requests_are_counted_by_route_template(client, report_id):
+    before = scrape(client)
+    assert client.get(f"/report/{report_id}").status_code == 200
+    after = scrape(client)
+    labels = {"method": "GET", "route": "/report/{report_id}", "status": "200"}
+    assert sample(after, "proxy_http_requests_total", **labels) == sample(before, "proxy_http_requests_total", **labels) + 1
+    count = "proxy_http_request_duration_seconds_count"
+    assert sample(after, count, route="/report/{report_id}") == sample(before, count, route="/report/{report_id}") + 1
+    assert str(report_id) not in after
+
+
+def test_upstream_calls_are_counted_by_path_template(client, report_id):
+    before = scrape(client)
+    client.get(f"/report/{report_id}")
+    after = scrape(client)
+    labels = {"method": "GET", "path": "/api/v3/reports/{id}", "status": "200"}
+    assert sample(after, "proxy_upstream_responses_total", **labels) > sample(before, "proxy_upstream_responses_total", **labels)
+    assert sample(after, "proxy_upstream_request_duration_seconds_count", path="/api/v3/reports/{id}") > 0
+
+
+def test_unmatched_paths_share_one_label_and_scrapes_are_not_counted(client):
+    before = scrape(client)
+    client.get("/no/such/route/1")
+    client.get("/no/such/route/2")
+    after = scrape(client)
+    labels = {"route": "unmatched", "status": "404"}
+    assert sample(after, "proxy_http_requests_total", **labels) == sample(before, "proxy_http_requests_total", **labels) + 2
+    assert 'route="/metrics"' not in after
+
+
+def test_every_series_has_help_and_type(client):
+    text = scrape(client)
+    documented = set(re.findall(r"^# TYPE (\S+) ", text, re.MULTILINE))
+    assert {"proxy_http_requests_total", "proxy_report_cache_lookups_total", "proxy_uploads_rejected_total"} <= documented
+    for line in text.splitlines():
+        if not line.startswith("#"):
+            name = re.match(r"[a-z_]+", line).group()
+            assert name in documented or re.sub(r"_(bucket|sum|count)$", "", name) in documented
@@ -0,0 +1,74 @@
+import random
+import uuid
+
+import pytest
+
+import near_dup
+
+WORDS = ("report source match paragraph thesis method result sample survey model "
+         "network theory archive student review chapter figure table data proof").split()
+
+
+def essay(seed: int, words: int = 400) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) + str(rng.randrange(50)) for _ in range(words))
+
+
+@pytest.fixture
+def index():
+    return near_dup.NearDupIndex(f"near-dup-{uuid.uuid4().hex}.sqlite3")
+
+
+def test_exact_copy_is_found(index):
+    text = essay(1)
+    key, count, sig = near_dup.fingerprint(text)
+    index.add(key, count, sig, "check", title="original", report_id=5)
+    [match] = index.query(*near_dup.fingerprint(text)[::2])
+    assert match["exact"] and match["similarity"] == 1.0 and match["report_id"] == 5
+
+
+def test_lightly_edited_copy_is_a_near_duplicate(index):
+    original = essay(2)
+    index.add(*near_dup.fingerprint(original), "check")
+    words = original.split()
+    for position in range(0, len(words), 40):
+        words[position] = "edited"
+    key, _, sig = near_dup.fingerprint(" ".join(words))
+    [match] = index.query(key, sig, threshold=0.5)
+    assert not match["exact"]
+    assert 0.5 <= match["similarity"] < 1.0
+
+
+def test_unrelated_text_is_not_a_candidate(index):
+    index.add(*near_dup.fingerprint(essay(3)), "check")
+    key, _, sig = near_dup.fingerprint(essay(4))
+    assert index.query(key, sig) == []
+
+
+def test_similarity_estimate_tracks_jaccard():
+    base = set(range(1000))
+    a = near_dup.signature({hash(("s", n)) & 0xFFFFFFFF for n in base})
+    b = near_dup.signature({hash(("s", n)) & 0xFFFFFFFF for n in set(range(500, 1500))})
+    assert abs(near_dup.similarity(a, b) - 1 / 3) < 0.15
+
+
+def test_link_fills_in_the_upstream_id(index):
+    fp = near_dup.fingerprint(essay(5))
+    index.add(*fp, "storage")
+    index.link(fp[0], storage_id=9)
+    assert index.query(fp[0], fp[2])[0]["storage_id"] == 9
+
+
+def test_check_reports_near_duplicates_of_earlier_submissions(client, report_id):
+    text = essay(report_id)
+    first = client.post("/check", data={"text": text})
+    assert first.headers["X-Near-Duplicates"] == "0"
+    edited = text.replace(text.split()[10], "changed", 1)
+    lookup = client.post("/near-duplicates", data={"text": edited}).json()
+    assert lookup["candidates"][0]["report_id"] == first.json()["data"]["id"]
+    skipped = client.post("/check", data={"text": edited, "skip_similarity": "0.5"}).json()
+    assert skipped["skipped"] is True
+
+
+def test_near_duplicate_lookup_needs_text(client):
+    assert client.post("/near-duplicates", data={"text": "  "}).status_code == 400
@@ -0,0 +1,102 @@
+import asyncio
+import io
+import json
+import zipfile
+
+import pytest
+
+from conftest import fake_render, reply
+import pdf_archive
+import pdf_render
+
+
+def archive_of(response) -> zipfile.ZipFile:
+    assert response.status_code == 200
+    assert response.headers["content-type"] == pdf_archive.MEDIA_TYPE
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert archive.testzip() is None
+    return archive
+
+
+def test_archive_holds_a_pdf_per_report(client, pdf_renderer, report_id):
+    ids = [report_id * 1000 + k for k in range(5)]
+    response = client.get("/reports/pdf/archive", params={"ids": ids + ids[:2]})
+    assert 'filename="reports.zip"' in response.headers["content-disposition"]
+    archive = archive_of(response)
+    assert sorted(archive.namelist()) == sorted(pdf_archive.entry_name(i) for i in ids)
+    for report in ids:
+        pdf = archive.read(pdf_archive.entry_name(report))
+        assert pdf.startswith(b"%PDF") and f"report {report}.".encode() in pdf
+    assert all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist())
+    assert pdf_renderer.renders == len(ids)
+
+
+def test_failed_renders_are_listed_in_errors_json(client, pdf_renderer, monkeypatch, report_id):
+    ids = [report_id * 1000 + k for k in range(3)]
+    failing = ids[1]
+
+    def render(html_full, path):
+        if f"report {failing}." in html_full:
+            raise RuntimeError("render failed")
+        return fake_render(html_full, path)
+
+    monkeypatch.setattr(pdf_render, "_render", render)
+    archive = archive_of(client.get("/reports/pdf/archive", params={"ids": ids}))
+    assert sorted(archive.namelist()) == sorted([pdf_archive.entry_name(ids[0]), pdf_archive.entry_name(ids[2]),
+                                                 pdf_archive.ERRORS_ENTRY])
+    errors = json.loads(archive.read(pdf_archive.ERRORS_ENTRY))
+    assert list(errors) == [str(failing)]
+    assert "render failed" in errors[str(failing)]
+
+
+def test_archive_of_a_remote_id(client, pdf_renderer, upstream_handler, report_id):
+    ids = [report_id * 1000 + k for k in range(2)]
+
+    def handler(request):
+        if request.url.path.endswith("/reports"):
+            assert request.url.params["remote_id"] == "crm/42"
+            return reply({"status": True, "code": 200, "data": [{"id": i} for i in ids]})
+        report = int(request.url.path.rsplit("/", 1)[1])
+        return reply({"status": True, "code": 200,
+                      "data": {"id": report, "status": 2, "html": f"<p>report {report}.</p>"}})
+
+    upstream_handler(handler)
+    response = client.get("/reports/pdf/archive", params={"remote_id": "crm/42"})
+    assert 'filename="reports_crm42.zip"' in response.headers["content-disposition"]
+    assert sorted(archive_of(response).namelist()) == sorted(pdf_archive.entry_name(i) for i in ids)
+
+
+def test_archive_needs_ids_or_a_remote_id(client, pdf_renderer):
+    assert client.get("/reports/pdf/archive").status_code == 422
+
+
+def test_archive_is_capped(client, pdf_renderer, monkeypatch):
+    monkeypatch.setattr(pdf_archive, "MAX_REPORTS", 2)
+    assert client.get("/reports/pdf/archive", params={"ids": [1, 2, 3]}).status_code == 413
+
+
+def test_archive_without_weasyprint(client, monkeypatch):
+    monkeypatch.setattr(pdf_render, "AVAILABLE", False)
+    assert client.get("/reports/pdf/archive", params={"ids": [1]}).status_code == 500
+
+
+@pytest.mark.anyio
+async def test_renders_run_within_the_concurrency_limit_in_completion_order(tmp_path):
+    running = {"now": 0, "max": 0}
+    delays = {1: 0.04, 2: 0.01, 3: 0.01, 4: 0.05}
+
+    async def render(report_id: int) -> str:
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        try:
+            await asyncio.sleep(delays[report_id])
+        finally:
+            running["now"] -= 1
+        path = tmp_path / f"{report_id}.pdf"
+        path.write_bytes(b"%PDF-1.4 " + str(report_id).encode())
+        return str(path)
+
+    data = b"".join([chunk async for chunk in pdf_archive.stream([1, 2, 3, 4], render, concurrency=2)])
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    assert archive.namelist() == [pdf_archive.entry_name(i) for i in (2, 3, 1, 4)]
+    assert running["max"] == 2
@@ -0,0 +1,64 @@
+import asyncio
+import os
+
+import pytest
+
+import pdf_render
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_rendered_pdfs_are_cached(pdf_renderer, report_id):
+    path = await pdf_renderer.render(report_id, "<p>first</p>")
+    assert open(path, "rb").read().startswith(b"%PDF")
+    assert await pdf_renderer.render(report_id, "<p>first</p>") == path
+    assert (pdf_renderer.renders, pdf_renderer.cache_hits) == (1, 1)
+    # Changed HTML means a changed report: it is rendered again.
+    assert await pdf_renderer.render(report_id, "<p>second</p>") != path
+    assert pdf_renderer.renders == 2
+
+
+async def test_concurrent_requests_share_one_render(pdf_renderer, report_id):
+    paths = await asyncio.gather(*[pdf_renderer.render(report_id, "<p>same</p>") for _ in range(5)])
+    assert len(set(paths)) == 1
+    assert pdf_renderer.renders == 1
+
+
+async def test_full_queue_is_503(pdf_renderer, report_id):
+    pdf_renderer.max_queue = 0
+    with pytest.raises(pdf_render.HTTPException) as raised:
+        await pdf_renderer.render(report_id, "<p>queued</p>")
+    assert raised.value.status_code == 503
+    assert pdf_renderer.rejected == 1
+
+
+async def test_failed_render_is_counted_and_raised(pdf_renderer, report_id):
+    with pytest.raises(RuntimeError):
+        await pdf_renderer.render(report_id, "<p>render-fails</p>")
+    assert pdf_renderer.failures == 1
+    assert pdf_renderer.stats()["rendering"] == 0
+
+
+async def test_cache_is_trimmed_to_its_file_limit(pdf_renderer, report_id, monkeypatch):
+    monkeypatch.setattr(pdf_render, "CACHE_MAX_FILES", 2)
+    paths = []
+    for n in range(4):
+        paths.append(await pdf_renderer.render(report_id, f"<p>version {n}</p>"))
+        os.utime(paths[-1], (n, n))
+    assert len([name for name in os.listdir(os.path.dirname(paths[0])) if name.endswith(".pdf")]) <= 2
+    assert os.path.exists(paths[-1])
+
+
+def test_pdf_endpoint_renders_the_html_report(client, pdf_renderer, report_id):
+    response = client.get(f"/report/pdf/{report_id}")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/pdf"
+    assert f"report_{report_id}.pdf" in response.headers["content-disposition"]
+    assert response.content.startswith(b"%PDF") and b"report-section" in response.content
+    assert client.get(f"/report/pdf/{report_id}").status_code == 200
+    assert (pdf_renderer.renders, pdf_renderer.cache_hits) == (1, 1)
+
+
+def test_pdf_endpoint_without_weasyprint(client, monkeypatch, report_id):
+    monkeypatch.setattr(pdf_render, "AVAILABLE", False)
+    assert client.get(f"/report/pdf/{report_id}").status_code == 500
@@ -0,0 +1,100 @@
+import json
+
+import pipeline
+from conftest import ok, reply
+
+
+def submit(client, report_id) -> dict:
+    response = client.post("/pipeline", data={"text": f"Pipeline document {report_id}. " * 20, "title": "paper"})
+    assert response.status_code == 200
+    body = response.json()
+    assert response.headers["Location"] == f"/pipeline/{body['pipeline_id']}"
+    return body
+
+
+def events(body: str) -> list:
+    pairs = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        pairs.append((lines["event"], json.loads(lines["data"])))
+    return pairs
+
+
+def test_pipeline_creates_both_reports(client, report_id):
+    body = submit(client, report_id)
+    assert body["report"]["data"]["id"] != body["ai_report"]["data"]["id"]
+    stored = pipeline.store.get(body["pipeline_id"])
+    assert stored["ids"] == {pipeline.REPORT: body["report"]["data"]["id"],
+                             pipeline.AI_REPORT: body["ai_report"]["data"]["id"]}
+
+
+def test_status_merges_both_parts(client, report_id):
+    body = submit(client, report_id)
+    status = client.get(f"/pipeline/{body['pipeline_id']}").json()
+    assert status["done"] is True
+    assert status["progress"] == 1.0
+    assert status["title"] == "paper"
+    for part in pipeline.PARTS:
+        assert status[part]["report_id"] == body[part]["data"]["id"]
+        assert status[part]["status"] == 2
+        assert status[part]["done"] is True
+
+
+def test_result_holds_both_finished_reports(client, report_id):
+    body = submit(client, report_id)
+    response = client.get(f"/pipeline/{body['pipeline_id']}/result")
+    assert response.status_code == 200
+    result = response.json()
+    assert result["pipeline_id"] == body["pipeline_id"]
+    assert result["summary"]["done"] is True
+    for part in pipeline.PARTS:
+        assert result[part]["data"]["id"] == body[part]["data"]["id"]
+        assert result[part]["data"]["status"] == 2
+    assert result[pipeline.REPORT]["data"]["sources"]
+
+
+def test_stream_reports_both_parts_and_ends(client, report_id):
+    body = submit(client, report_id)
+    with client.stream("GET", f"/pipeline/{body['pipeline_id']}/stream") as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        received = events("".join(response.iter_text()))
+    ids = {part: body[part]["data"]["id"] for part in pipeline.PARTS}
+    statuses = [data for event, data in received if event == "status"]
+    assert {data["part"] for data in statuses} == set(pipeline.PARTS)
+    assert all(data["report_id"] == ids[data["part"]] for data in statuses)
+    assert received[-1] == ("end", ids)
+
+
+def test_result_is_202_with_the_summary_while_checking(client, upstream_handler, report_id):
+    ids = {pipeline.REPORT: report_id, pipeline.AI_REPORT: report_id + 1}
+    pipeline_id = pipeline.store.create("pending", ids, {})
+    progress = {report_id: 0.4, report_id + 1: 0.6}
+
+    def handler(request):
+        if "/status/" not in request.url.path:
+            return reply({"status": False, "code": 500, "message": "unexpected"}, status_code=500)
+        reported = int(request.url.path.rsplit("/", 1)[1])
+        return ok({"id": reported, "status": 1, "progress": progress[reported]})
+
+    upstream_handler(handler)
+    response = client.get(f"/pipeline/{pipeline_id}/result")
+    assert response.status_code == 202
+    summary = response.json()
+    assert summary["done"] is False
+    assert summary["progress"] == 0.5
+    assert summary[pipeline.AI_REPORT]["progress"] == 0.6
+
+
+def test_part_that_failed_to_submit_counts_as_finished(client, report_id):
+    pipeline_id = pipeline.store.create("half", {pipeline.REPORT: report_id}, {pipeline.AI_REPORT: "quota exceeded"})
+    status = client.get(f"/pipeline/{pipeline_id}").json()
+    assert status["done"] is True
+    assert status[pipeline.AI_REPORT] == {"report_id": None, "error": "quota exceeded", "done": True}
+    result = client.get(f"/pipeline/{pipeline_id}/result").json()
+    assert result[pipeline.REPORT]["data"]["id"] == report_id
+    assert result[pipeline.AI_REPORT] == {"error": "quota exceeded"}
+
+
+def test_unknown_pipeline_is_404(client):
+    for suffix in ("", "/stream", "/result"):
+        assert client.get(f"/pipeline/{'0' * 32}{suffix}").status_code == 404
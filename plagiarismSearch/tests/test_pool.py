@@ -0,0 +1,38 @@
+import pytest
+
+import upstream
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_handlers_share_the_lifespan_client(monkeypatch):
+    shared = upstream._new_client()
+    monkeypatch.setattr(upstream, "_client", shared)
+    async with upstream.client() as first, upstream.client() as second:
+        assert first is second is shared
+    assert not shared.is_closed
+    await shared.aclose()
+
+
+async def test_a_throwaway_client_is_closed_without_the_pool(monkeypatch):
+    monkeypatch.setattr(upstream, "_client", None)
+    async with upstream.client() as throwaway:
+        assert not throwaway.is_closed
+    assert throwaway.is_closed
+
+
+async def test_open_and_close_pool(monkeypatch):
+    monkeypatch.setattr(upstream, "_client", None)
+    await upstream.open_pool()
+    opened = upstream._client
+    await upstream.open_pool()
+    assert upstream._client is opened
+    await upstream.close_pool()
+    assert upstream._client is None and opened.is_closed
+
+
+def test_pool_stats_endpoint(client):
+    client.get("/status/1")
+    stats = client.get("/pool/stats").json()
+    assert stats["mode"] == "shared" and stats["active"] is True
+    assert stats["requests"] >= 0 and "breaker" in stats
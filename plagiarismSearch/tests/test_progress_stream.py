@@ -0,0 +1,109 @@
+import asyncio
+import json
+
+from fastapi import HTTPException
+import httpx
+import pytest
+
+import progress_stream
+
+pytestmark = pytest.mark.anyio
+
+
+def status(value, progress=0.0) -> dict:
+    return {"status": True, "data": {"id": 1, "status": value, "progress": progress}}
+
+
+async def never_disconnected():
+    return False
+
+
+async def events(hub, report_id=1, timeout=5) -> list:
+    """Collect (event, data) pairs from one stream until it ends."""
+    collected = []
+
+    async def read():
+        async for chunk in progress_stream.stream(hub, report_id, never_disconnected, heartbeat=1):
+            if chunk.startswith("event: "):
+                name, data = chunk.split("\n")[:2]
+                collected.append((name.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+
+    await asyncio.wait_for(read(), timeout)
+    return collected
+
+
+def fetcher(*results):
+    """A fetch function returning (or raising) `results` in turn, repeating the last one."""
+    results = list(results)
+    calls = []
+
+    async def fetch(report_id):
+        calls.append(report_id)
+        result = results.pop(0) if len(results) > 1 else results[0]
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    fetch.calls = calls
+    return fetch
+
+
+async def test_stream_ends_after_a_terminal_status():
+    hub = progress_stream.ProgressHub(fetcher(status(1, 0.2), status(1, 0.2), status(1, 0.7), status(2, 1.0)),
+                                      min_interval=0.01)
+    received = await events(hub)
+    assert [name for name, _ in received] == ["status", "status", "status", "end"]
+    assert [data["data"]["progress"] for _, data in received[:-1]] == [0.2, 0.7, 1.0]
+    assert hub.stats()["pollers"] == 0
+
+
+async def test_unexpected_poller_error_ends_every_stream(caplog):
+    hub = progress_stream.ProgressHub(fetcher(status(1), KeyError("data")), min_interval=0.01)
+    first, second = await asyncio.gather(events(hub), events(hub))
+    for received in (first, second):
+        assert [name for name, _ in received] == ["status", "error", "end"]
+        assert received[1][1] == {"status_code": 502, "detail": "Status polling failed: KeyError"}
+    assert hub.poller_errors == 1
+    assert hub.stats()["subscribers"] == 0
+    assert "Progress poller for report 1 failed" in caplog.text
+
+
+async def test_client_errors_end_the_stream():
+    hub = progress_stream.ProgressHub(fetcher(HTTPException(status_code=404, detail="Report not found")),
+                                      min_interval=0.01)
+    assert await events(hub) == [("error", {"status_code": 404, "detail": "Report not found"}),
+                                 ("end", {"report_id": 1})]
+    assert hub.poller_errors == 0
+
+
+async def test_transient_errors_are_retried():
+    fetch = fetcher(httpx.ConnectError("down"), HTTPException(status_code=503, detail="busy"),
+                    HTTPException(status_code=429, detail="slow down"), status(2, 1.0))
+    hub = progress_stream.ProgressHub(fetch, min_interval=0.01)
+    assert [name for name, _ in await events(hub)] == ["status", "end"]
+    assert len(fetch.calls) == 4
+
+
+async def test_subscribers_share_one_poller():
+    fetch = fetcher(status(1), status(1), status(1), status(2, 1.0))
+    hub = progress_stream.ProgressHub(fetch, min_interval=0.02)
+    results = await asyncio.gather(*[events(hub) for _ in range(5)])
+    assert all(received[-1][0] == "end" for received in results)
+    assert len(fetch.calls) == 4
+
+
+async def test_published_updates_reach_subscribers():
+    hub = progress_stream.ProgressHub(fetcher(status(1)), min_interval=10)
+    reader = asyncio.create_task(events(hub))
+    await asyncio.sleep(0.05)
+    assert hub.publish(1, status(2, 1.0))
+    assert [name for name, _ in await reader] == ["status", "status", "end"]
+    assert not hub.publish(1, status(2, 1.0))
+
+
+def test_progress_stream_endpoint(client, report_id):
+    with client.stream("GET", f"/progress/{report_id}/stream") as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        body = "".join(response.iter_text())
+    assert body.startswith("event: status\n")
+    assert f'event: end\ndata: {{"report_id": {report_id}}}' in body
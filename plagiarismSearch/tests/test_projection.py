@@ -0,0 +1,63 @@
+import gzip
+
+import pytest
+
+from passthrough import Body
+import passthrough
+import projection
+import report_cache
+
+
+@pytest.fixture(params=["incremental", "in-memory"])
+def parser(request, monkeypatch):
+    if request.param == "in-memory":
+        monkeypatch.setattr(projection, "ijson", None)
+        monkeypatch.setattr(report_cache, "ijson", None)
+    elif projection.ijson is None:
+        pytest.skip("ijson is not installed")
+    return request.param
+
+
+def test_fields_and_source_window(client, report_id, parser):
+    response = client.get(f"/report/{report_id}",
+                          params={"fields": "id,status,sources.url", "sources_offset": 1, "sources_limit": 2})
+    body = response.json()
+    assert body["status"] is True
+    data = body["data"]
+    assert set(data) == {"id", "status", "sources", "sources_total"}
+    assert data["sources_total"] == 20
+    assert data["sources"] == [{"url": f"https://example.com/source/{report_id}/{k}"} for k in (1, 2)]
+
+
+def test_projection_of_a_gzip_body(parser):
+    payload = b'{"status": true, "data": {"id": 1, "title": "t", "sources": [{"url": "a"}, {"url": "b"}]}}'
+    body = Body(gzip.compress(payload), "gzip")
+    projected = projection.project(body, {"title"}, 1, None)
+    assert projected.json() == {"status": True, "data": {"title": "t"}}
+    window = projection.project(body, None, 1, 5)
+    assert window.json()["data"]["sources"] == [{"url": "b"}]
+    assert window.json()["data"]["sources_total"] == 2
+
+
+@pytest.mark.parametrize("payload, status", [
+    (b'{"status": true, "data": {"sources": [{"status": 9}], "status": 2}}', 2),
+    (b'{"status": true, "data": {"id": 1, "status": -10}}', -10),
+    (b'{"status": true, "data": {"id": 1}}', None),
+    (b'{"status": true, "data": [{"status": 2}]}', None),
+])
+def test_cache_reads_the_report_status(parser, payload, status):
+    assert report_cache.body_status(Body(payload)) == status
+    assert report_cache.body_status(Body(gzip.compress(payload), passthrough.GZIP)) == status
+
+
+def test_cache_miss_does_not_decode_the_report(client, report_id, monkeypatch):
+    if report_cache.ijson is None:
+        pytest.skip("ijson is not installed")
+
+    def decode(self):
+        raise AssertionError("decoded")
+
+    monkeypatch.setattr(Body, "json", decode)
+    first = client.get(f"/report/{report_id}")
+    assert first.headers["X-Cache"] == "miss"
+    assert client.get(f"/report/{report_id}").headers["X-Cache"] == "memory"
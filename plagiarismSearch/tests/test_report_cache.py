@@ -0,0 +1,85 @@
+import uuid
+
+import pytest
+
+from conftest import ok
+from passthrough import Body
+import dedup
+import report_cache
+
+pytestmark = pytest.mark.anyio
+
+
+def checked(report_id: int, status: int = 2) -> Body:
+    return Body(b'{"status": true, "data": {"id": %d, "status": %d, "title": "%s"}}'
+                % (report_id, status, b"x" * 200))
+
+
+@pytest.fixture
+def cache():
+    return report_cache.ReportCache(f"reports-{uuid.uuid4().hex}.sqlite3", memory_max_entries=2)
+
+
+def test_report_is_cached_once_checked(client, report_id):
+    first = client.get(f"/report/{report_id}")
+    second = client.get(f"/report/{report_id}")
+    assert first.status_code == second.status_code == 200
+    assert (first.headers["X-Cache"], second.headers["X-Cache"]) == ("miss", "memory")
+    assert first.json() == second.json()
+    assert first.json()["data"]["id"] == report_id
+
+
+def test_unfinished_reports_are_not_cached(client, upstream_handler, report_id):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return ok({"id": report_id, "status": 1, "progress": 0.5})
+
+    upstream_handler(handler)
+    outcomes = [client.get(f"/report/{report_id}").headers["X-Cache"] for _ in range(2)]
+    assert outcomes == ["miss", "miss"]
+    assert len(calls) == 2
+
+
+def test_failed_report_is_dropped_from_dedup(client, upstream_handler, report_id):
+    key = dedup.submission_key("check", {}, text=f"failed {report_id}")
+    dedup.index.put(key, {"status": True, "data": {"id": report_id}})
+    upstream_handler(lambda request: ok({"id": report_id, "status": -10}))
+    assert client.get(f"/report/{report_id}").status_code == 200
+    assert dedup.index.get(key) is None
+
+
+async def test_memory_evictions_fall_back_to_disk(cache):
+    for report_id in (1, 2, 3):
+        async def fetch(report_id=report_id):
+            return checked(report_id)
+
+        assert (await cache.get_or_fetch(report_cache.REPORT, report_id, 0, fetch))[1] == report_cache.MISS
+
+    async def unused():
+        raise AssertionError("cached reports are not fetched again")
+
+    body, outcome = await cache.get_or_fetch(report_cache.REPORT, 1, 0, unused)
+    assert outcome == report_cache.DISK_HIT
+    assert body.json()["data"]["id"] == 1
+    assert (await cache.get_or_fetch(report_cache.REPORT, 1, 0, unused))[1] == report_cache.MEMORY_HIT
+
+
+async def test_invalidate_drops_both_tiers(cache):
+    async def fetch():
+        return checked(7)
+
+    await cache.get_or_fetch(report_cache.REPORT, 7, 0, fetch)
+    cache.invalidate(7)
+    assert cache.get(report_cache.REPORT, 7) == (None, report_cache.MISS)
+
+
+def test_disk_tier_is_trimmed_to_its_budget():
+    cache = report_cache.ReportCache(f"reports-{uuid.uuid4().hex}.sqlite3")
+    cache.disk_max_bytes = 2 * cache.put(report_cache.REPORT, 0, 0, checked(0)).size
+    for report_id in range(1, 5):
+        cache.put(report_cache.REPORT, report_id, 0, checked(report_id))
+    disk = cache.stats()["disk"]
+    assert disk["entries"] == 2 and disk["bytes"] <= cache.disk_max_bytes
+    assert cache.get(report_cache.REPORT, 4)[0] is not None
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import math
+
+import httpx
+import pytest
+
+import listing
+import mock_upstream
+from conftest import reply
+
+
+def lines(response) -> list:
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith(listing.MEDIA_TYPE)
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+@pytest.fixture
+def history(report_id):
+    """At least 25 reports in the mock's history; returns its ids in listing order."""
+    for offset in range(25):
+        mock_upstream._report(report_id * 100 + offset)
+    return sorted(mock_upstream._reports)
+
+
+def page_handler(total: int, short_page: int = None, failing_page: int = None, pagination: bool = True):
+    """GET /reports pages of `limit` made-up reports, with a slow second page so later ones finish before it."""
+    seen = {"pages": [], "in_flight": 0, "max_in_flight": 0}
+
+    async def handler(request: httpx.Request):
+        page, limit = int(request.url.params["page"]), int(request.url.params["limit"])
+        seen["pages"].append(page)
+        seen["in_flight"] += 1
+        seen["max_in_flight"] = max(seen["max_in_flight"], seen["in_flight"])
+        try:
+            await asyncio.sleep(0.05 if page == 2 else 0.01)
+        finally:
+            seen["in_flight"] -= 1
+        if page == failing_page:
+            return reply({"status": False, "code": 400, "message": "bad page"}, status_code=400)
+        count = limit // 2 if page == short_page else limit
+        first = (page - 1) * limit
+        data = [{"id": i} for i in range(first, min(first + count, total))]
+        payload = {"status": True, "code": 200, "data": data}
+        if pagination:
+            payload["pagination"] = {"page": page, "limit": limit, "count": total}
+        return reply(payload)
+
+    return handler, seen
+
+
+def test_streams_every_page_of_the_history_in_order(client, history):
+    before = mock_upstream.calls["total"]
+    reports = lines(client.get("/reports/stream", params={"limit": 7}))
+    assert [r["id"] for r in reports] == history[:len(reports)]
+    assert len(reports) >= len(history)
+    pages = mock_upstream.calls["total"] - before
+    assert pages == math.ceil(len(reports) / 7)
+
+
+def test_page_range_is_honoured(client, history):
+    reports = lines(client.get("/reports/stream", params={"limit": 5, "page_from": 2, "page_to": 3}))
+    assert [r["id"] for r in reports] == history[5:15]
+
+
+def test_pages_are_prefetched_within_the_window_and_written_in_order(client, upstream_handler):
+    handler, seen = page_handler(total=20 * 10)
+    upstream_handler(handler)
+    reports = lines(client.get("/reports/stream", params={"limit": 10}))
+    assert [r["id"] for r in reports] == list(range(200))
+    assert sorted(seen["pages"]) == list(range(1, 21))
+    assert 1 < seen["max_in_flight"] <= listing.PREFETCH
+
+
+def test_short_page_ends_an_open_ended_listing(client, upstream_handler):
+    handler, seen = page_handler(total=10 ** 6, short_page=3, pagination=False)
+    upstream_handler(handler)
+    reports = lines(client.get("/reports/stream", params={"limit": 10}))
+    assert [r["id"] for r in reports] == list(range(25))
+    # Pages already prefetched past the short one are requested, but never written.
+    assert max(seen["pages"]) <= 3 + listing.PREFETCH
+
+
+def test_upstream_error_mid_stream_becomes_a_final_error_line(client, upstream_handler):
+    handler, _ = page_handler(total=100, failing_page=3)
+    upstream_handler(handler)
+    errors = listing.stats["errors"]
+    reports = lines(client.get("/reports/stream", params={"limit": 10}))
+    assert [r["id"] for r in reports[:-1]] == list(range(20))
+    assert reports[-1]["status_code"] == 400
+    assert reports[-1]["request"] == 3
+    assert "bad page" in reports[-1]["error"]
+    assert listing.stats["errors"] == errors + 1
+
+
+def test_error_on_the_first_page_keeps_its_status_code(client, upstream_handler):
+    handler, _ = page_handler(total=100, failing_page=1)
+    upstream_handler(handler)
+    response = client.get("/reports/stream", params={"limit": 10})
+    assert response.status_code == 400
+
+
+def test_ids_are_looked_up_in_chunks_and_kept_in_order(client, upstream_handler):
+    chunks = []
+
+    async def handler(request: httpx.Request):
+        ids = json.loads(request.content)["ids"]
+        chunks.append(ids)
+        # Later chunks answer first.
+        await asyncio.sleep(0.01 * (4 - len(chunks)))
+        return reply({"status": True, "code": 200, "data": [{"id": i} for i in ids]})
+
+    upstream_handler(handler)
+    size = listing.IDS_CHUNK
+    ids = list(range(1, 2 * size + 2))
+    response = client.get("/reports/stream", params={"ids": ids})
+    assert [r["id"] for r in lines(response)] == ids
+    assert sorted(chunks) == [ids[:size], ids[size:2 * size], ids[2 * size:]]
@@ -0,0 +1,204 @@
+import asyncio
+
+import pytest
+
+from conftest import ok
+import scheduler
+import upstream
+from scheduler import BACKGROUND, BULK, INTERACTIVE, Ticket
+
+pytestmark = pytest.mark.anyio
+
+
+async def hold(s: scheduler.Scheduler, ticket: Ticket, release: asyncio.Event, order: list = None):
+    async with s.slot(ticket):
+        if order is not None:
+            order.append(ticket)
+        await release.wait()
+
+
+async def test_tenant_quota_is_rejected_with_retry_after():
+    s = scheduler.Scheduler(slots=1, tenant_max_pending=2, max_wait=5)
+    release = asyncio.Event()
+    holders = [asyncio.create_task(hold(s, Ticket(INTERACTIVE, "a"), release)) for _ in range(2)]
+    await asyncio.sleep(0)
+    with pytest.raises(scheduler.Rejected) as raised:
+        async with s.slot(Ticket(INTERACTIVE, "a")):
+            pass
+    assert raised.value.status_code == 429
+    assert "Retry-After" in raised.value.headers
+    assert s.rejected["quota"] == 1
+    # Another tenant is not affected by a's quota.
+    other = asyncio.create_task(hold(s, Ticket(INTERACTIVE, "b"), release))
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(*holders, other)
+    assert s.stats()["tenants"] == 0
+
+
+async def test_exempt_tickets_skip_the_quota():
+    s = scheduler.Scheduler(slots=4, tenant_max_pending=1)
+    release = asyncio.Event()
+    holders = [asyncio.create_task(hold(s, scheduler.SYSTEM, release)) for _ in range(3)]
+    await asyncio.sleep(0)
+    assert s.running[BACKGROUND] == 3
+    release.set()
+    await asyncio.gather(*holders)
+
+
+async def test_interactive_calls_go_first():
+    s = scheduler.Scheduler(slots=1, bulk_share=1, background_share=1)
+    first, release = asyncio.Event(), asyncio.Event()
+    blocker = asyncio.create_task(hold(s, Ticket(INTERACTIVE, "x"), first))
+    await asyncio.sleep(0)
+    order = []
+    waiters = [asyncio.create_task(hold(s, Ticket(priority, "t" + priority), release, order))
+               for priority in (BULK, BACKGROUND, INTERACTIVE)]
+    await asyncio.sleep(0)
+    release.set()
+    first.set()
+    await asyncio.gather(blocker, *waiters)
+    assert [t.priority for t in order] == [INTERACTIVE, BACKGROUND, BULK]
+
+
+async def test_tenants_take_turns_within_a_class():
+    s = scheduler.Scheduler(slots=1, tenant_max_pending=10)
+    first, release = asyncio.Event(), asyncio.Event()
+    blocker = asyncio.create_task(hold(s, Ticket(INTERACTIVE, "x"), first))
+    await asyncio.sleep(0)
+    order = []
+    tickets = [Ticket(INTERACTIVE, "a")] * 3 + [Ticket(INTERACTIVE, "b")] * 2
+    waiters = [asyncio.create_task(hold(s, ticket, release, order)) for ticket in tickets]
+    await asyncio.sleep(0)
+    release.set()
+    first.set()
+    await asyncio.gather(blocker, *waiters)
+    assert [t.tenant for t in order] == ["a", "b", "a", "b", "a"]
+
+
+async def test_class_limits_leave_room_for_interactive_calls():
+    s = scheduler.Scheduler(slots=4, bulk_share=0.5)
+    release = asyncio.Event()
+    bulk = [asyncio.create_task(hold(s, Ticket(BULK, f"t{n}"), release)) for n in range(4)]
+    await asyncio.sleep(0)
+    assert s.running[BULK] == 2
+    async with s.slot(Ticket(INTERACTIVE, "i")):
+        assert s.running[INTERACTIVE] == 1
+    release.set()
+    await asyncio.gather(*bulk)
+
+
+async def test_wait_timeout_rejects_and_cleans_up():
+    s = scheduler.Scheduler(slots=1, max_wait=0.05)
+    release = asyncio.Event()
+    blocker = asyncio.create_task(hold(s, Ticket(INTERACTIVE, "a"), release))
+    await asyncio.sleep(0)
+    with pytest.raises(scheduler.Rejected):
+        async with s.slot(Ticket(INTERACTIVE, "b")):
+            pass
+    assert s.rejected["timeout"] == 1
+    assert s.waiting(INTERACTIVE) == 0
+    assert "b" not in s.stats()["busiest_tenants"]
+    release.set()
+    await blocker
+    assert sum(s.running.values()) == 0
+
+
+async def test_cancelled_waiter_frees_its_place():
+    s = scheduler.Scheduler(slots=1)
+    release = asyncio.Event()
+    blocker = asyncio.create_task(hold(s, Ticket(INTERACTIVE, "a"), release))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(hold(s, Ticket(INTERACTIVE, "b"), release))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    release.set()
+    await blocker
+    assert s.stats()["tenants"] == 0
+    assert sum(s.running.values()) == 0
+
+
+URL = "http://upstream.test/api/v3/reports/1"
+
+
+async def as_caller(ticket: Ticket, call):
+    """Run `call` in a task scheduled under `ticket`, as SchedulerMiddleware would set it."""
+    async def run():
+        scheduler._current.set(ticket)
+        return await call()
+
+    return await asyncio.create_task(run())
+
+
+async def test_shared_get_is_not_run_under_another_tenants_quota(monkeypatch, upstream_handler):
+    s = scheduler.Scheduler(slots=4, tenant_max_pending=1)
+    monkeypatch.setattr(scheduler, "scheduler", s)
+    upstream_handler(lambda request: ok({"id": 1}))
+    release = asyncio.Event()
+    # Tenant a is at its quota; b has nothing in flight.
+    holder = asyncio.create_task(hold(s, Ticket(INTERACTIVE, "a"), release))
+    await asyncio.sleep(0)
+    a, b = await asyncio.gather(as_caller(Ticket(INTERACTIVE, "a"), lambda: upstream.get_json(URL, {})),
+                                as_caller(Ticket(INTERACTIVE, "b"), lambda: upstream.get_json(URL, {})),
+                                return_exceptions=True)
+    assert isinstance(a, scheduler.Rejected) and a.status_code == 429
+    assert b == {"status": True, "code": 200, "data": {"id": 1}}
+    release.set()
+    await holder
+
+
+async def test_interactive_get_does_not_wait_in_a_bulk_flight(monkeypatch, upstream_handler):
+    s = scheduler.Scheduler(slots=2, bulk_share=0.5)
+    monkeypatch.setattr(scheduler, "scheduler", s)
+    upstream_handler(lambda request: ok({"id": 1}))
+    release = asyncio.Event()
+    # The bulk class is saturated, so a bulk call to URL waits for a slot.
+    holder = asyncio.create_task(hold(s, Ticket(BULK, "t"), release))
+    await asyncio.sleep(0)
+    bulk = asyncio.create_task(as_caller(Ticket(BULK, "t"), lambda: upstream.get_json(URL, {})))
+    await asyncio.sleep(0.01)
+    assert s.waiting(BULK) == 1
+    interactive = await asyncio.wait_for(
+        as_caller(Ticket(INTERACTIVE, "t"), lambda: upstream.get_json(URL, {})), timeout=1)
+    assert interactive["data"] == {"id": 1}
+    assert not bulk.done()
+    release.set()
+    assert (await bulk)["data"] == {"id": 1}
+    await holder
+
+
+def tenant_of(monkeypatch, headers: dict, host: str, trusted=("127.0.0.1",)) -> str:
+    monkeypatch.setattr(scheduler, "TRUSTED_CLIENTS", set(trusted))
+    return scheduler._tenant({k.encode(): v.encode() for k, v in headers.items()}, (host, 50000))
+
+
+def test_tenant_headers_are_believed_from_trusted_clients(monkeypatch):
+    assert tenant_of(monkeypatch, {"x-tenant-id": "ip:203.0.113.9"}, "127.0.0.1") == "x-tenant-id:ip:203.0.113.9"
+    assert tenant_of(monkeypatch, {"x-user-id": "7", "x-group-id": "g"}, "127.0.0.1") == "x-group-id:g"
+    secret = tenant_of(monkeypatch, {"x-api-token": "s3cret"}, "127.0.0.1")
+    assert secret.startswith("x-api-token:") and "s3cret" not in secret
+    assert tenant_of(monkeypatch, {}, "127.0.0.1") == "ip:127.0.0.1"
+
+
+def test_tenant_headers_from_other_clients_are_ignored(monkeypatch):
+    # Otherwise a new X-User-Id on every request would dodge the quota.
+    for user in ("1", "2"):
+        assert tenant_of(monkeypatch, {"x-user-id": user}, "198.51.100.4") == "ip:198.51.100.4"
+    assert tenant_of(monkeypatch, {"x-user-id": "1"}, "198.51.100.4", trusted=("*",)) == "x-user-id:1"
+
+
+def test_middleware_sets_the_ticket_for_the_request(monkeypatch):
+    monkeypatch.setattr(scheduler, "TRUSTED_CLIENTS", {"127.0.0.1"})
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(scheduler.current())
+
+    middleware = scheduler.SchedulerMiddleware(app)
+    for path, headers, client in (("/report/1", [(b"x-tenant-id", b"u1")], ("127.0.0.1", 1)),
+                                  ("/check/batch", [(b"x-priority", b"background")], ("10.0.0.5", 1)),
+                                  ("/reports/stream", [(b"x-priority", b"interactive")], ("10.0.0.5", 1))):
+        asyncio.run(middleware({"type": "http", "path": path, "headers": headers, "client": client}, None, None))
+    assert seen == [Ticket(INTERACTIVE, "x-tenant-id:u1"), Ticket(BULK, "ip:10.0.0.5"), Ticket(BULK, "ip:10.0.0.5")]
+    assert scheduler.current() == scheduler.SYSTEM
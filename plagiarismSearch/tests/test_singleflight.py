@@ -0,0 +1,74 @@
+import asyncio
+
+from fastapi import HTTPException
+import httpx
+import pytest
+
+from conftest import ok
+import upstream
+
+pytestmark = pytest.mark.anyio
+
+URL = "http://upstream.test/api/v3/reports/status/1"
+
+
+async def test_single_flight_shares_one_call():
+    flights = upstream.SingleFlight()
+    started = 0
+
+    async def fetch():
+        nonlocal started
+        started += 1
+        await asyncio.sleep(0.01)
+        return {"value": started}
+
+    results = await asyncio.gather(*[flights.do("key", fetch) for _ in range(5)])
+    assert results == [{"value": 1}] * 5
+    assert (flights.calls, flights.coalesced) == (1, 4)
+    assert await flights.do("key", fetch) == {"value": 2}
+
+
+async def test_single_flight_delivers_errors_to_every_caller():
+    flights = upstream.SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise HTTPException(status_code=502, detail="down")
+
+    results = await asyncio.gather(*[flights.do("key", fail) for _ in range(3)], return_exceptions=True)
+    assert [r.status_code for r in results] == [502] * 3
+    assert flights.stats()["in_flight"] == 0
+
+
+async def test_single_flight_survives_a_cancelled_caller():
+    flights = upstream.SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    first = asyncio.ensure_future(flights.do("key", fetch))
+    second = asyncio.ensure_future(flights.do("key", fetch))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == "done"
+
+
+async def test_get_json_coalesces_concurrent_requests(monkeypatch):
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.02)
+        return ok({"id": 1})
+
+    monkeypatch.setattr(upstream, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(upstream, "flights", upstream.SingleFlight())
+    monkeypatch.setattr(upstream, "COALESCE", True)
+    # Query parameter order does not matter.
+    results = await asyncio.gather(*[upstream.get_json(URL, {}, params) for params in
+                                     ({"a": 1, "b": 2}, {"b": 2, "a": 1}, {"a": 1, "b": 2})])
+    assert all(r["data"]["id"] == 1 for r in results)
+    assert len(calls) == 1
+    await upstream.get_json(URL, {}, {"a": 2})
+    assert len(calls) == 2
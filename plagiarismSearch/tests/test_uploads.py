@@ -0,0 +1,47 @@
+import pytest
+
+import server
+import uploads
+
+POST_ROUTES = sorted(route.path for route in server.app.routes if "POST" in getattr(route, "methods", ()))
+
+
+def test_every_upload_route_is_covered():
+    assert {"/check", "/ai-check", "/storage/create", "/check/batch", "/pipeline", "/near-duplicates"} <= set(POST_ROUTES)
+
+
+@pytest.mark.parametrize("path", POST_ROUTES)
+def test_oversized_upload_is_413_on_every_route(client, monkeypatch, path):
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_BYTES", 1000)
+    rejected = uploads.budget.rejected_too_large
+    response = client.post(path, files={"file": ("big.txt", b"x" * 2000, "text/plain")})
+    assert response.status_code == 413
+    assert uploads.budget.rejected_too_large == rejected + 1
+    assert uploads.budget.in_use == 0
+
+
+@pytest.mark.parametrize("path", POST_ROUTES)
+def test_upload_beyond_the_budget_is_503_on_every_route(client, monkeypatch, path):
+    monkeypatch.setattr(uploads.budget, "capacity", 100)
+    response = client.post(path, files={"file": ("doc.txt", b"x" * 500, "text/plain")})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(uploads.RETRY_AFTER_SECONDS)
+    assert uploads.budget.in_use == 0
+
+
+def test_chunked_upload_is_cut_off_at_the_limit(client, monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_BYTES", 1000)
+    body = b"--b\r\nContent-Disposition: form-data; name=\"text\"\r\n\r\n" + b"x" * 5000 + b"\r\n--b--\r\n"
+
+    def chunks():
+        for start in range(0, len(body), 512):
+            yield body[start:start + 512]
+
+    response = client.post("/check", content=chunks(), headers={"content-type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+    assert uploads.budget.in_use == 0
+
+
+def test_json_bodies_are_not_counted_as_uploads(client, monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_BYTES", 10)
+    assert client.post("/check/batch", json=["a text longer than ten bytes"]).status_code == 200
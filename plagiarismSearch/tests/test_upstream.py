@@ -0,0 +1,161 @@
+from fastapi import HTTPException
+import httpx
+import pytest
+
+from conftest import ok, reply
+import upstream
+
+pytestmark = pytest.mark.anyio
+
+URL = "http://upstream.test/api/v3/reports/status/1"
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Record upstream requests; the handler for them is set with calls.handler = fn."""
+    class Calls(list):
+        handler = staticmethod(lambda request: ok({"id": 1}))
+
+    recorded = Calls()
+
+    def handle(request):
+        recorded.append(request)
+        return recorded.handler(request)
+
+    monkeypatch.setattr(upstream, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handle)))
+    monkeypatch.setattr(upstream, "breaker", upstream.CircuitBreaker(failures=3, reset_seconds=60))
+    monkeypatch.setattr(upstream, "limiter", upstream.TokenBucket(rate=None))
+    monkeypatch.setattr(upstream, "RETRY_ATTEMPTS", 3)
+    return recorded
+
+
+async def test_token_bucket_spends_burst_then_waits():
+    bucket = upstream.TokenBucket(rate=50, burst=2, max_wait=1)
+    await bucket.acquire()
+    await bucket.acquire()
+    assert bucket.waited == 0
+    await bucket.acquire()
+    assert bucket.waited == 1
+
+
+async def test_token_bucket_rejects_waits_beyond_max_wait():
+    bucket = upstream.TokenBucket(rate=1, burst=1, max_wait=0.5)
+    await bucket.acquire()
+    with pytest.raises(HTTPException) as raised:
+        await bucket.acquire()
+    assert raised.value.status_code == 503
+    assert raised.value.headers["Retry-After"] == "1"
+    assert bucket.rejected == 1
+
+
+async def test_token_bucket_without_rate_never_waits():
+    bucket = upstream.TokenBucket(rate=None, burst=0)
+    for _ in range(100):
+        await bucket.acquire()
+    assert bucket.waited == 0
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = upstream.CircuitBreaker(failures=2, reset_seconds=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(upstream.CircuitOpenError) as raised:
+        breaker.before_call()
+    assert raised.value.status_code == 503
+    assert breaker.short_circuited == 1
+
+
+def test_breaker_half_open_lets_one_probe_through():
+    breaker = upstream.CircuitBreaker(failures=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.state == "half-open"
+    breaker.before_call()
+    with pytest.raises(upstream.CircuitOpenError):
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.opened == 2
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_breaker_released_probe_can_be_retried():
+    breaker = upstream.CircuitBreaker(failures=1, reset_seconds=0)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.release_probe()
+    breaker.before_call()
+
+
+async def test_request_retries_idempotent_calls(calls):
+    statuses = iter([503, 502, 200])
+    calls.handler = lambda request: reply({"code": 0}, status_code=next(statuses))
+    response = await upstream.request("GET", URL)
+    assert response.status_code == 200
+    assert len(calls) == 3
+    assert upstream.breaker.failures == 0
+
+
+async def test_request_gives_up_after_retry_attempts(calls):
+    calls.handler = lambda request: reply({}, status_code=503)
+    response = await upstream.request("GET", URL)
+    assert response.status_code == 503
+    assert len(calls) == upstream.RETRY_ATTEMPTS
+
+
+async def test_request_does_not_retry_client_errors(calls):
+    calls.handler = lambda request: reply({}, status_code=404)
+    assert (await upstream.request("GET", URL)).status_code == 404
+    assert len(calls) == 1
+
+
+async def test_request_honours_retry_after(calls):
+    statuses = iter([429, 200])
+    calls.handler = lambda request: reply({}, status_code=next(statuses), headers={"Retry-After": "0"})
+    assert (await upstream.request("GET", URL)).status_code == 200
+    assert len(calls) == 2
+
+
+async def test_create_is_not_retried_on_server_errors(calls):
+    calls.handler = lambda request: reply({}, status_code=503)
+    response = await upstream.request("POST", "http://upstream.test/api/v3/reports/create", data={"text": "x"})
+    assert response.status_code == 503
+    assert len(calls) == 1
+
+
+async def test_create_is_not_retried_after_a_read_timeout(calls):
+    def handler(request):
+        raise httpx.ReadTimeout("slow", request=request)
+
+    calls.handler = handler
+    with pytest.raises(httpx.ReadTimeout):
+        await upstream.request("POST", "http://upstream.test/api/v3/reports/create", data={"text": "x"})
+    assert len(calls) == 1
+
+
+async def test_create_is_retried_when_the_connect_failed(calls):
+    outcomes = iter([httpx.ConnectError, None])
+
+    def handler(request):
+        error = next(outcomes)
+        if error:
+            raise error("refused", request=request)
+        return ok({"id": 7})
+
+    calls.handler = handler
+    response = await upstream.request("POST", "http://upstream.test/api/v3/reports/create", data={"text": "x"})
+    assert response.status_code == 200
+    assert len(calls) == 2
+
+
+async def test_open_breaker_short_circuits_calls(calls):
+    calls.handler = lambda request: reply({}, status_code=500)
+    for _ in range(3):
+        await upstream.request("GET", URL, idempotent=False)
+    with pytest.raises(upstream.CircuitOpenError):
+        await upstream.request("GET", URL)
+    assert len(calls) == 3
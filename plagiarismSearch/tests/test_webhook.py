@@ -0,0 +1,99 @@
+import hmac
+
+import pytest
+
+import dedup
+import server
+import status_store
+
+URL = "/webhook/plagiarismsearch"
+TOKEN = "s3cret-token"
+
+
+@pytest.fixture
+def token(monkeypatch):
+    monkeypatch.setattr(server, "WEBHOOK_TOKEN", TOKEN)
+    return TOKEN
+
+
+def report(report_id, status=2, **extra) -> dict:
+    return {"data": {"id": report_id, "status": status, "progress": 1.0, **extra}}
+
+
+@pytest.mark.parametrize("query", [{}, {"token": "wrong"}, {"token": TOKEN[:-1]}, {"token": ""}])
+def test_bad_or_missing_token_is_rejected(client, token, report_id, query):
+    response = client.post(URL, params=query, json=report(report_id))
+    assert response.status_code == 403
+    assert status_store.store.get(report_id) is None
+
+
+def test_token_is_compared_in_constant_time(client, token, report_id, monkeypatch):
+    compared, original = [], hmac.compare_digest
+
+    def compare_digest(a, b):
+        compared.append((a, b))
+        return original(a, b)
+
+    monkeypatch.setattr(server.hmac, "compare_digest", compare_digest)
+    assert client.post(URL, params={"token": TOKEN}, json=report(report_id)).status_code == 200
+    assert compared == [(TOKEN.encode(), TOKEN.encode())]
+
+
+def test_authenticated_webhook_is_served_locally(client, token, report_id):
+    assert client.post(URL, params={"token": token}, json=report(report_id, plagiarism=12.5)).status_code == 200
+    response = client.get(f"/status/{report_id}")
+    assert response.headers["X-Status-Source"] == "local"
+    assert response.json()["data"]["plagiarism"] == 12.5
+
+
+def test_form_encoded_webhook(client, token, report_id):
+    response = client.post(URL, params={"token": token}, data={"id": str(report_id), "status": "1"})
+    assert response.status_code == 200
+    assert int(status_store.store.get(report_id)["data"]["status"]) == 1
+
+
+@pytest.mark.parametrize("body, headers", [
+    (b"{not json", {"content-type": "application/json"}),
+    (b'{"data": {"status": 2}}', {"content-type": "application/json"}),
+    (b'["a list"]', {"content-type": "application/json"}),
+    (b'{"id": "12abc", "status": 2}', {"content-type": "application/json"}),
+    (b'{"data": {"id": null}}', {"content-type": "application/json"}),
+])
+def test_malformed_payloads_are_400(client, token, body, headers):
+    response = client.post(URL, params={"token": token}, content=body, headers=headers)
+    assert response.status_code == 400
+
+
+def test_unauthenticated_terminal_status_is_confirmed_upstream(client, report_id):
+    # Without a token a "failed" callback could be forged; the mock upstream says the report is checked.
+    assert client.post(URL, json=report(report_id, status=-10)).status_code == 200
+    assert status_store.store.get(report_id)["data"]["status"] == 2
+
+
+def test_unauthenticated_progress_is_taken_as_is(client, report_id):
+    assert client.post(URL, json=report(report_id, status=1)).status_code == 200
+    assert status_store.store.get(report_id)["data"]["status"] == 1
+
+
+def test_callback_url_without_token_disables_the_webhook(client, report_id, monkeypatch):
+    monkeypatch.setattr(server, "WEBHOOK_CALLBACK_URL", "https://proxy.example/webhook/plagiarismsearch")
+    assert client.post(URL, json=report(report_id)).status_code == 503
+
+
+def test_failed_report_is_dropped_from_dedup(client, token, report_id):
+    key = dedup.submission_key("check", {}, text=f"webhook {report_id}")
+    dedup.index.put(key, {"status": True, "data": {"id": report_id}})
+    assert client.post(URL, params={"token": token}, json=report(report_id, status=-11)).status_code == 200
+    assert dedup.index.get(key) is None
+
+
+def test_status_store_memory_is_bounded():
+    store = status_store.StatusStore("status-lru.sqlite3", memory_max_entries=3)
+    for n in range(5):
+        store.record_webhook(n, {"id": n, "status": 2})
+    assert list(store._memory) == [2, 3, 4]
+    store.get(2)
+    store.record_webhook(5, {"id": 5, "status": 2})
+    assert list(store._memory) == [4, 2, 5]
+    # Evicted entries are still answered from SQLite.
+    assert store.get(0)["data"]["status"] == 2
@@ -0,0 +1,175 @@
+"""
+Memory-bounded document uploads.
+
+Uploads stay in memory up to UPLOAD_MEMORY_BYTES and are spooled to disk beyond
+that (Starlette's SpooledTemporaryFile). Handlers never read a whole file:
+hashing and the multipart body sent upstream both work in fixed-size chunks.
+UploadLimitMiddleware reserves each request's Content-Length from a global
+byte budget before the body is parsed, so oversized uploads get a fast 413 and
+uploads beyond the budget a fast 503.
+"""
+from typing import Optional
+import hashlib
+import json
+import os
+
+from fastapi import HTTPException, UploadFile
+from starlette.formparsers import MultiPartParser
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_MEMORY_BYTES = int(os.getenv("UPLOAD_MEMORY_BYTES", str(1024 * 1024)))
+UPLOAD_BUFFER_BYTES = int(os.getenv("UPLOAD_BUFFER_BYTES", str(200 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+RETRY_AFTER_SECONDS = 5
+
+MultiPartParser.spool_max_size = UPLOAD_MEMORY_BYTES
+
+
+class UploadBudget:
+    """Bytes reserved by uploads that are currently being received or forwarded."""
+
+    def __init__(self, capacity: int = UPLOAD_BUFFER_BYTES):
+        self.capacity = capacity
+        self.in_use = 0
+        self.peak = 0
+        self.accepted = 0
+        self.bytes_received = 0
+        self.rejected_too_large = 0
+        self.rejected_busy = 0
+
+    def try_acquire(self, size: int) -> bool:
+        if self.in_use + size > self.capacity:
+            return False
+        self.in_use += size
+        self.peak = max(self.peak, self.in_use)
+        return True
+
+    def release(self, size: int):
+        self.in_use -= size
+
+    def stats(self) -> dict:
+        return {
+            "max_upload_bytes": MAX_UPLOAD_BYTES,
+            "memory_spool_bytes": UPLOAD_MEMORY_BYTES,
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "peak": self.peak,
+            "accepted": self.accepted,
+            "bytes_received": self.bytes_received,
+            "rejected_too_large": self.rejected_too_large,
+            "rejected_busy": self.rejected_busy,
+        }
+
+
+budget = UploadBudget()
+
+
+async def _reject(send, status: int, detail: str, headers: Optional[list] = None):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())] + (headers or []),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware enforcing MAX_UPLOAD_BYTES and the global upload budget.
+
+    Every multipart POST counts as an upload, whatever its route, so a new
+    upload endpoint is covered without being registered here.
+    """
+
+    def __init__(self, app, budget: UploadBudget = budget):
+        self.app = app
+        self.budget = budget
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope["headers"]) if scope["type"] == "http" else {}
+        if scope["type"] != "http" or scope["method"] != "POST" or \
+                not headers.get(b"content-type", b"").lower().startswith(b"multipart/"):
+            await self.app(scope, receive, send)
+            return
+        length = headers.get(b"content-length")
+        declared = int(length) if length and length.isdigit() else None
+        if declared is not None and declared > MAX_UPLOAD_BYTES:
+            self.budget.rejected_too_large += 1
+            await _reject(send, 413, f"Upload exceeds the maximum size of {MAX_UPLOAD_BYTES} bytes.")
+            return
+        # Chunked uploads without a length reserve the worst case.
+        reserved = declared if declared is not None else MAX_UPLOAD_BYTES
+        if not self.budget.try_acquire(reserved):
+            self.budget.rejected_busy += 1
+            await _reject(send, 503, "Too many uploads in progress, retry shortly.",
+                          [(b"retry-after", str(RETRY_AFTER_SECONDS).encode())])
+            return
+        self.budget.accepted += 1
+        received = 0
+
+        async def counted_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                self.budget.bytes_received += len(message.get("body", b""))
+                if received > reserved:
+                    self.budget.rejected_too_large += 1
+                    raise HTTPException(status_code=413, detail="Upload exceeds its declared or maximum size.")
+            return message
+
+        try:
+            await self.app(scope, counted_receive, send)
+        finally:
+            self.budget.release(reserved)
+
+
+async def digest(upload: UploadFile) -> str:
+    """SHA-256 of an upload, read in chunks; the file is rewound afterwards."""
+    sha = hashlib.sha256()
+    await upload.seek(0)
+    while True:
+        chunk = await upload.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        sha.update(chunk)
+    await upload.seek(0)
+    return sha.hexdigest()
+
+
+class StreamingFile:
+    """
+    File-like view handed to httpx for the multipart body.
+
+    httpx reads it in 64 KiB chunks and measures it with tell/seek. fileno() is
+    deliberately not exposed: on a SpooledTemporaryFile it would force an
+    in-memory upload to roll over to disk. Each view keeps its own position,
+    so several concurrent upstream requests can stream the same upload.
+    """
+
+    def __init__(self, file):
+        self._file = file
+        self._position = file.tell()
+
+    def read(self, size: int = -1) -> bytes:
+        self._file.seek(self._position)
+        data = self._file.read(size)
+        self._position += len(data)
+        return data
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence == 1:
+            offset, whence = self._position + offset, 0
+        self._file.seek(offset, whence)
+        self._position = self._file.tell()
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+def upstream_file(upload: UploadFile) -> tuple:
+    """httpx `files=` entry that streams the upload instead of buffering it."""
+    return (upload.filename, StreamingFile(upload.file), upload.content_type)
@@ -0,0 +1,560 @@
+"""
+Shared HTTP client for calls to the PlagiarismSearch API.
+
+One pooled httpx.AsyncClient is opened in the app lifespan and reused by every
+handler, so polling traffic keeps its TCP/TLS connections alive instead of
+handshaking with plagiarismsearch.com on every request. Identical concurrent
+GETs are coalesced into a single upstream call.
+
+Every call goes through request(): the scheduler hands out upstream slots by
+priority class and tenant, a token bucket smooths bursts, idempotent calls are
+retried with jittered exponential backoff (honouring Retry-After), and a
+circuit breaker fails fast while upstream keeps failing.
+
+get_raw() returns the body bytes as they came over the wire (gzip-encoded when
+upstream compressed them) for the endpoints that pass them straight through.
+"""
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional
+import asyncio
+import gzip
+import os
+import random
+import time
+
+from fastapi import HTTPException
+import httpx
+
+import metrics
+import passthrough
+import scheduler
+
+try:
+    import h2  # noqa: F401  (only needed when UPSTREAM_HTTP2 is enabled)
+except ImportError:
+    h2 = None
+
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_int(name: str, default: Optional[int]) -> Optional[int]:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    if value.strip().lower() == "none":
+        return None
+    return int(value)
+
+
+def env_float(name: str, default: Optional[float]) -> Optional[float]:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    if value.strip().lower() == "none":
+        return None
+    return float(value)
+
+
+# "shared" reuses one pooled client for the whole process, "per-request"
+# restores the old behaviour of a fresh client (and connection) per call.
+CLIENT_MODE = os.getenv("UPSTREAM_CLIENT_MODE", "shared").strip().lower()
+HTTP2 = env_bool("UPSTREAM_HTTP2", False)
+COALESCE = env_bool("UPSTREAM_COALESCE", True)
+
+MAX_CONNECTIONS = env_int("UPSTREAM_MAX_CONNECTIONS", 100)
+MAX_KEEPALIVE_CONNECTIONS = env_int("UPSTREAM_MAX_KEEPALIVE", 20)
+KEEPALIVE_EXPIRY = env_float("UPSTREAM_KEEPALIVE_EXPIRY", 30.0)
+
+CONNECT_TIMEOUT = env_float("UPSTREAM_CONNECT_TIMEOUT", 10.0)
+READ_TIMEOUT = env_float("UPSTREAM_READ_TIMEOUT", 60.0)
+WRITE_TIMEOUT = env_float("UPSTREAM_WRITE_TIMEOUT", 60.0)
+POOL_TIMEOUT = env_float("UPSTREAM_POOL_TIMEOUT", 10.0)
+
+RATE_LIMIT = env_float("UPSTREAM_RATE_LIMIT", 10.0)
+RATE_BURST = env_int("UPSTREAM_RATE_BURST", 20)
+RATE_MAX_WAIT = env_float("UPSTREAM_RATE_MAX_WAIT", 10.0)
+
+RETRY_ATTEMPTS = env_int("UPSTREAM_RETRY_ATTEMPTS", 3)
+RETRY_BASE_DELAY = env_float("UPSTREAM_RETRY_BASE_DELAY", 0.5)
+RETRY_MAX_DELAY = env_float("UPSTREAM_RETRY_MAX_DELAY", 20.0)
+
+BREAKER_FAILURES = env_int("UPSTREAM_BREAKER_FAILURES", 5)
+BREAKER_RESET_SECONDS = env_float("UPSTREAM_BREAKER_RESET_SECONDS", 30.0)
+
+RETRY_STATUSES = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+if CLIENT_MODE not in ("shared", "per-request"):
+    print(f"Unknown UPSTREAM_CLIENT_MODE={CLIENT_MODE!r}, falling back to 'shared'")
+    CLIENT_MODE = "shared"
+
+if HTTP2 and h2 is None:
+    print("UPSTREAM_HTTP2 is enabled but the 'h2' package is missing; using HTTP/1.1. Install with 'pip install httpx[http2]'.")
+    HTTP2 = False
+
+
+class PoolStats:
+    """Counters fed by httpx trace events, used to observe connection reuse."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+        self.failures = 0
+
+    async def trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            self.new_connections += 1
+        elif event_name == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+        elif event_name.endswith(".failed"):
+            self.failures += 1
+
+    async def on_request(self, request: httpx.Request):
+        self.requests += 1
+        request.extensions["trace"] = self.trace
+
+
+class SingleFlight:
+    """
+    Share one in-flight call between concurrent callers with the same key.
+
+    The call runs in its own task, so a caller that disconnects does not cancel
+    it for the others; its result or exception is delivered to every caller.
+    """
+
+    def __init__(self):
+        self._calls: dict = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def _done(self, key, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # mark as retrieved even if every caller went away
+
+    async def do(self, key, fn: Callable[[], Awaitable]):
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        total = self.calls + self.coalesced
+        return {
+            "enabled": COALESCE,
+            "upstream_calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls),
+            "coalesced_ratio": round(self.coalesced / total, 4) if total else None,
+        }
+
+
+class CircuitOpenError(HTTPException):
+    """Raised instead of calling upstream while the circuit breaker is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(
+            status_code=503,
+            detail="PlagiarismSearch is unavailable, retry shortly.",
+            headers={"Retry-After": str(max(int(retry_after), 1))},
+        )
+
+
+class UpstreamTransportError(HTTPException):
+    """502 for a call that failed in transport; `connect` is set when it never reached upstream."""
+
+    def __init__(self, error: httpx.TransportError):
+        super().__init__(status_code=502, detail=f"PlagiarismSearch request failed: {error.__class__.__name__}")
+        self.connect = isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+class TokenBucket:
+    def __init__(self, rate: Optional[float] = RATE_LIMIT, burst: int = RATE_BURST,
+                 max_wait: Optional[float] = RATE_MAX_WAIT):
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.waited = 0
+        self.rejected = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Take one token, sleeping until one is free; 503 if that would take longer than max_wait."""
+        if not self.rate:
+            return
+        self._refill()
+        # Tokens may go negative: each waiter reserves its slot in the queue.
+        wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        if self.max_wait is not None and wait > self.max_wait:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Upstream rate limit reached, retry shortly.",
+                                headers={"Retry-After": str(max(int(wait), 1))})
+        self.tokens -= 1
+        if wait > 0:
+            self.waited += 1
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """Opens after BREAKER_FAILURES consecutive failures; one probe is let through after the reset time."""
+
+    def __init__(self, failures: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.threshold = failures
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.opened = 0
+        self.short_circuited = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half-open" and self.probing):
+            self.short_circuited += 1
+            remaining = self.reset_seconds - (time.monotonic() - self.opened_at)
+            raise CircuitOpenError(remaining)
+        if state == "half-open":
+            self.probing = True
+
+    def release_probe(self):
+        """A half-open probe ended without telling us anything about upstream health."""
+        self.probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or (self.opened_at is None and self.failures >= self.threshold):
+            self.opened_at = time.monotonic()
+            self.opened += 1
+        self.probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "threshold": self.threshold,
+            "reset_seconds": self.reset_seconds,
+            "opened": self.opened,
+            "short_circuited": self.short_circuited,
+        }
+
+
+stats = PoolStats()
+flights = SingleFlight()
+limiter = TokenBucket()
+breaker = CircuitBreaker()
+retries = {"attempts": 0, "retried": 0, "gave_up": 0}
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        connect=CONNECT_TIMEOUT,
+        read=READ_TIMEOUT,
+        write=WRITE_TIMEOUT,
+        pool=POOL_TIMEOUT,
+    )
+
+
+def _new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=HTTP2,
+        limits=_limits(),
+        timeout=_timeout(),
+        event_hooks={"request": [stats.on_request]},
+    )
+
+
+async def open_pool():
+    """Create the app-wide client. Called from the FastAPI lifespan."""
+    global _client
+    if CLIENT_MODE == "shared" and _client is None:
+        _client = _new_client()
+
+
+async def close_pool():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+@asynccontextmanager
+async def client():
+    """
+    Yield an httpx.AsyncClient for one upstream call.
+
+    In shared mode this is the pooled lifespan client and is left open on exit;
+    in per-request mode (or before the lifespan has started) a throwaway client
+    is created and closed around the call.
+    """
+    if _client is not None:
+        yield _client
+        return
+    async with _new_client() as throwaway:
+        yield throwaway
+
+
+def retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+async def request(method: str, url: str, idempotent: Optional[bool] = None, raw: bool = False, **kwargs):
+    """
+    Send one upstream request through the rate limiter, retry policy and circuit breaker.
+
+    Idempotent calls are retried on 429/502/503/504 and transport errors.
+    Non-idempotent calls (report creation) are only retried when upstream
+    certainly did not process them: 429 responses and failed connects.
+    Returns the final response (a RawResponse when `raw` is set); raises
+    CircuitOpenError, scheduler.Rejected or httpx.TransportError.
+    """
+    method = method.upper()
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+    path = metrics.path_template(httpx.URL(url).path)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            # Backoff sleeps below happen without a slot, so retries do not hold capacity.
+            async with scheduler.scheduler.slot():
+                await limiter.acquire()
+                retries["attempts"] += 1
+                started = time.perf_counter()
+                try:
+                    async with client() as http:
+                        response = await (_send_raw(http, method, url, **kwargs) if raw
+                                          else http.request(method, url, **kwargs))
+                finally:
+                    metrics.UPSTREAM_LATENCY.observe(time.perf_counter() - started, method, path)
+            metrics.UPSTREAM_RESPONSES.inc(method, path, response.status_code)
+        except httpx.TransportError as e:
+            metrics.UPSTREAM_RESPONSES.inc(method, path, e.__class__.__name__)
+            breaker.record_failure()
+            safe = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+            if not safe or attempt + 1 >= RETRY_ATTEMPTS:
+                retries["gave_up"] += 1
+                raise
+            delay = _backoff(attempt)
+        except BaseException:
+            breaker.release_probe()
+            raise
+        else:
+            if response.status_code < 500 and response.status_code != 429:
+                breaker.record_success()
+                return response
+            # 429 means upstream is up but throttling us; only errors count towards the breaker.
+            if response.status_code != 429:
+                breaker.record_failure()
+            else:
+                breaker.release_probe()
+            retryable = response.status_code == 429 or (idempotent and response.status_code in RETRY_STATUSES)
+            delay = retry_after_seconds(response)
+            if delay is None:
+                delay = _backoff(attempt)
+            if not retryable or attempt + 1 >= RETRY_ATTEMPTS or delay > RETRY_MAX_DELAY:
+                if retryable:
+                    retries["gave_up"] += 1
+                return response
+        attempt += 1
+        retries["retried"] += 1
+        await asyncio.sleep(delay)
+
+
+class RawResponse:
+    """An upstream response whose body was read without decoding its Content-Encoding."""
+
+    def __init__(self, response: httpx.Response, body: bytes, encoding: Optional[str]):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.body = body
+        self.encoding = encoding
+
+    @property
+    def text(self) -> str:
+        data = gzip.decompress(self.body) if self.encoding == passthrough.GZIP else self.body
+        return data.decode("utf-8", errors="replace")
+
+    def to_body(self) -> passthrough.Body:
+        media_type = self.headers.get("content-type", passthrough.JSON_MEDIA_TYPE)
+        return passthrough.Body(self.body, self.encoding, media_type)
+
+
+async def _send_raw(http: httpx.AsyncClient, method: str, url: str, **kwargs) -> RawResponse:
+    """Send a request and keep a gzip body compressed instead of letting httpx decode it."""
+    response = await http.send(http.build_request(method, url, **kwargs), stream=True)
+    try:
+        encoding = response.headers.get("content-encoding", "").strip().lower() or None
+        if encoding in (None, "identity", passthrough.GZIP):
+            body = b"".join([chunk async for chunk in response.aiter_raw()])
+        else:
+            # Any other coding is decoded by httpx and passed on as identity.
+            body = await response.aread()
+        return RawResponse(response, body, encoding if encoding == passthrough.GZIP else None)
+    finally:
+        await response.aclose()
+
+
+def raise_for_upstream(response):
+    """Convert an upstream error status into an HTTPException carrying the upstream body."""
+    if response.status_code < 400:
+        return
+    headers = None
+    if response.status_code in (429, 503) and "Retry-After" in response.headers:
+        headers = {"Retry-After": response.headers["Retry-After"]}
+    raise HTTPException(status_code=response.status_code, detail=response.text, headers=headers)
+
+
+async def request_json(method: str, url: str, idempotent: Optional[bool] = None, **kwargs):
+    """request() + raise_for_upstream() + JSON decoding; transport failures become 502."""
+    try:
+        response = await request(method, url, idempotent=idempotent, **kwargs)
+    except httpx.TransportError as e:
+        raise UpstreamTransportError(e)
+    raise_for_upstream(response)
+    return passthrough.loads(response.content)
+
+
+async def _get_json(url: str, headers: dict, params: Optional[dict]):
+    return await request_json("GET", url, headers=headers, params=params)
+
+
+async def _get_raw(url: str, headers: dict, params: Optional[dict]) -> passthrough.Body:
+    try:
+        response = await request("GET", url, raw=True, headers={**headers, "Accept-Encoding": passthrough.GZIP},
+                                 params=params)
+    except httpx.TransportError as e:
+        raise UpstreamTransportError(e)
+    raise_for_upstream(response)
+    return response.to_body()
+
+
+def _flight_key(kind: str, url: str, params: Optional[dict]) -> tuple:
+    # The shared call is scheduled under its first caller's ticket, so only callers
+    # with the same class and tenant may join it: no one inherits another's quota or queue.
+    return (kind, url, tuple(sorted(httpx.QueryParams(params or {}).multi_items())), scheduler.current())
+
+
+async def get_json(url: str, headers: dict, params: Optional[dict] = None):
+    """
+    GET an upstream URL and return the decoded JSON body.
+
+    Upstream error statuses are raised as HTTPException with the upstream body.
+    Concurrent calls for the same URL and query (parameter order ignored) from
+    the same tenant and priority class share one request; callers must treat
+    the returned object as read-only.
+    """
+    if not COALESCE:
+        return await _get_json(url, headers, params)
+    return await flights.do(_flight_key("GET", url, params), lambda: _get_json(url, headers, params))
+
+
+async def get_raw(url: str, headers: dict, params: Optional[dict] = None) -> passthrough.Body:
+    """
+    GET an upstream URL and return its body undecoded, as a passthrough.Body.
+
+    Same error handling and coalescing as get_json(); nothing is parsed here.
+    """
+    if not COALESCE:
+        return await _get_raw(url, headers, params)
+    return await flights.do(_flight_key("RAW", url, params), lambda: _get_raw(url, headers, params))
+
+
+def pool_stats() -> dict:
+    connections = []
+    if _client is not None:
+        pool = getattr(_client._transport, "_pool", None)
+        connections = list(getattr(pool, "connections", []) or [])
+    reused = max(stats.requests - stats.new_connections, 0)
+    return {
+        "mode": CLIENT_MODE,
+        "active": _client is not None,
+        "http2": HTTP2,
+        "limits": {
+            "max_connections": MAX_CONNECTIONS,
+            "max_keepalive_connections": MAX_KEEPALIVE_CONNECTIONS,
+            "keepalive_expiry": KEEPALIVE_EXPIRY,
+        },
+        "timeouts": {
+            "connect": CONNECT_TIMEOUT,
+            "read": READ_TIMEOUT,
+            "write": WRITE_TIMEOUT,
+            "pool": POOL_TIMEOUT,
+        },
+        "connections": {
+            "open": len(connections),
+            "idle": sum(1 for c in connections if c.is_idle()),
+            "http2": sum(1 for c in connections if "HTTP/2" in c.info()),
+        },
+        "requests": stats.requests,
+        "new_connections": stats.new_connections,
+        "tls_handshakes": stats.tls_handshakes,
+        "failures": stats.failures,
+        "reused_requests": reused,
+        "reuse_ratio": round(reused / stats.requests, 4) if stats.requests else None,
+        "since": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(stats.started)),
+        "coalescing": flights.stats(),
+        "rate_limit": {"rate": limiter.rate, "burst": limiter.burst, "tokens": round(limiter.tokens, 2),
+                       "waited": limiter.waited, "rejected": limiter.rejected},
+        "retries": {**retries, "max_attempts": RETRY_ATTEMPTS},
+        "breaker": breaker.stats(),
+    }
@@ -6,6 +6,10 @@ import asyncHandler from '../utils/asyncHandler.js';
 const router = express.Router();
 const trustScoreCalculator = new TrustScoreCalculator();
 
+// Tenant for the PlagiarismSearch proxy's upstream quota, which it only accepts from localhost.
+// Keyed on the caller's address: the x-user header is set by the client and could be rotated.
+const proxyTenant = (req) => ({ 'X-Tenant-Id': `ip:${req.ip}` });
+
 // Multer configuration for file uploads
 const storage = multer.memoryStorage();
 const upload = multer({ 
@@ -228,6 +232,7 @@ router.post('/:fileId/check-plagiarism', asyncHandler(async (req, res) => {
       method: 'POST',
       headers: {
         'Content-Type': 'application/x-www-form-urlencoded',
+        ...proxyTenant(req),
       },
       body: new URLSearchParams({
         text: textContent,
@@ -334,7 +339,9 @@ router.get('/:fileId/plagiarism-results', asyncHandler(async (req, res) => {
     console.log(`[Files] Fetching plagiarism results for file: ${fileId}, report: ${reportId}`);
     
     // Call the PlagiarismSearch proxy server to get report data
-    const reportResponse = await fetch(`http://localhost:8000/report/${reportId}`);
+    const reportResponse = await fetch(`http://localhost:8000/report/${reportId}`, {
+      headers: proxyTenant(req)
+    });
     
     if (!reportResponse.ok) {
       throw new Error(`Failed to fetch report: ${reportResponse.status} ${reportResponse.statusText}`);